@@ -0,0 +1,169 @@
+'''
+Cost of the astar_chat search core on large synthetic trees, without any language model.
+
+The frontier section replays the same search with the former frontier, a queue.PriorityQueue of pydantic items
+holding a copy of the whole path, and with the heap of parent-pointer nodes, and reports time and peak memory.
+The astar_chat section runs the full search with agents answering instantly, then the event section
+compares a plain loop with an async generator yielding a SearchEvent per step, and reports the cost per event
+and its share of the astar_chat_stream run.
+
+Usage: python -m benchmarks.bench_astar [--nodes 100000]
+'''
+import argparse
+import asyncio
+import queue
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+from pydantic import BaseModel
+from siumai.groupchat import astar_chat, astar_chat_stream
+from siumai.schema import Message, Content
+from siumai.search import Frontier, Node, SearchEvent, SearchStats
+
+BRANCHING = 8
+
+
+class LegacyQueueItem(BaseModel):
+    priority:float
+    messages:List[List[Message]]
+
+    def __lt__(self, other):
+        return self.priority < other.priority
+
+
+def make_messages(n_nodes:int) -> List[Message]:
+    return [Message(role='assistant', content=Content(text=f'reply {i}')) for i in range(n_nodes)]
+
+
+def legacy_search(messages:List[Message], n_nodes:int) -> int:
+    frontier = queue.PriorityQueue()
+    frontier.put(LegacyQueueItem(priority=0, messages=[[messages[0]]]))
+    pushed = 1
+    while pushed < n_nodes:
+        item = frontier.get()
+        path = [message for chunk in item.messages for message in chunk]
+        for _ in range(BRANCHING):
+            frontier.put(LegacyQueueItem(priority=len(path) + pushed % 7, messages=item.messages + [[messages[pushed]]]))
+            pushed += 1
+    return frontier.qsize()
+
+
+def heap_search(messages:List[Message], n_nodes:int) -> int:
+    frontier = Frontier()
+    frontier.push(Node(key=(0,), messages=(messages[0],)))
+    pushed = 1
+    while pushed < n_nodes:
+        node = frontier.pop()
+        path = node.path()
+        for _ in range(BRANCHING):
+            frontier.push(Node(key=(pushed,), messages=(messages[pushed],), parent=node, cost=len(path) + pushed % 7))
+            pushed += 1
+    return len(frontier)
+
+
+def measure(function:Callable[[], object]) -> Tuple[float, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    duration = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duration, peak / 2**20
+
+
+def timeit(function:Callable[[], object]) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+class InstantAgent():
+    def __init__(self, name:str):
+        self.name = name
+        self.count = 0
+
+    async def a_generate_response(self, messages:List[Message]) -> List[Message]:
+        self.count += 1
+        return [Message(role='assistant', content=Content(text=f'{self.name} {self.count}'))]
+
+
+async def run_astar_chat(n_nodes:int) -> SearchStats:
+    n_agents, n_replies = 4, 25
+    stats = SearchStats()
+    await astar_chat(
+        agents=[InstantAgent(f'agent {i}') for i in range(n_agents)],
+        messages=[Message(role='user', content=Content(text='start'))],
+        cost=lambda messages, next_messages: 1,
+        # never reaches the threshold, the search runs all its iterations
+        heuristic=lambda messages: 1000 - len(messages),
+        threshold=0,
+        n_replies=n_replies,
+        max_iteration=n_nodes // (n_agents * n_replies),
+        stats=stats,
+    )
+    return stats
+
+
+async def count_events(n_nodes:int) -> Tuple[int, float]:
+    n_agents, n_replies = 4, 25
+    start = time.perf_counter()
+    n_events = 0
+    async for event in astar_chat_stream(
+        agents=[InstantAgent(f'agent {i}') for i in range(n_agents)],
+        messages=[Message(role='user', content=Content(text='start'))],
+        cost=lambda messages, next_messages: 1,
+        heuristic=lambda messages: 1000 - len(messages),
+        threshold=0,
+        n_replies=n_replies,
+        max_iteration=n_nodes // (n_agents * n_replies),
+    ):
+        n_events += 1
+    return n_events, time.perf_counter() - start
+
+
+async def plain_loop(n:int, node:Node) -> int:
+    count = 0
+    for i in range(n):
+        count += 1
+    return count
+
+
+async def event_loop(n:int, node:Node) -> int:
+    async def events():
+        for i in range(n):
+            yield SearchEvent('child_scored', i, node=node, score=0)
+
+    count = 0
+    async for event in events():
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=100000)
+    args = parser.parse_args()
+
+    messages = make_messages(args.nodes + BRANCHING)
+    print(f'{"frontier":<28} {"nodes":>8} {"time (s)":>9} {"peak (MB)":>10}')
+    for name, search in [('PriorityQueue + path copies', legacy_search), ('heap + parent pointers', heap_search)]:
+        duration, peak = measure(lambda: search(messages, args.nodes))
+        print(f'{name:<28} {args.nodes:>8} {duration:>9.2f} {peak:>10.1f}')
+
+    start = time.perf_counter()
+    stats = asyncio.run(run_astar_chat(args.nodes))
+    print(f'astar_chat: {stats.pushed} nodes in {time.perf_counter() - start:.2f}s, {stats}')
+
+    node = Node(key=(0,), messages=(messages[0],))
+    plain = min(timeit(lambda: asyncio.run(plain_loop(args.nodes, node))) for _ in range(3))
+    evented = min(timeit(lambda: asyncio.run(event_loop(args.nodes, node))) for _ in range(3))
+    per_event = (evented - plain) / args.nodes
+    n_events, duration = asyncio.run(count_events(args.nodes))
+    print(
+        f'events: {per_event * 1e6:.2f}us per event over a plain loop, '
+        f'astar_chat_stream yields {n_events} events in {duration:.2f}s, i.e. {100 * per_event * n_events / duration:.1f}% of the search'
+    )
+
+
+if __name__ == '__main__':
+    main()
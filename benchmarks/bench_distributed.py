@@ -0,0 +1,90 @@
+'''
+Throughput of distributed_astar_chat against the number of worker processes.
+
+The agents answer after a fixed latency and the heuristic burns a fixed CPU time, like a local scoring model,
+so the single process astar_chat is bound by its one core while the workers score in parallel.
+
+Usage: python -m benchmarks.bench_distributed [--workers 1 2 4] [--iterations 8] [--cpu-ms 5]
+'''
+import argparse
+import asyncio
+import time
+from typing import List
+from siumai.distributed import AgentSpec, distributed_astar_chat
+from siumai.groupchat import astar_chat
+from siumai.schema import Message, Content
+from siumai.search import SearchStats
+
+LATENCY = 0.02
+N_REPLIES = 4
+CPU_SECONDS = 0.005
+
+
+class LatencyAgent():
+    def __init__(self, name:str):
+        self.name = name
+        self.count = 0
+
+    async def a_generate_response(self, messages:List[Message]) -> List[Message]:
+        self.count += 1
+        text = f'{self.name} {len(messages)} {self.count}'
+        await asyncio.sleep(LATENCY)
+        return [Message(role='assistant', content=Content(text=text))]
+
+
+def unit_cost(messages:List[Message], next_messages:List[Message]) -> float:
+    return 1
+
+
+def busy_heuristic(messages:List[Message]) -> float:
+    end = time.perf_counter() + CPU_SECONDS
+    while time.perf_counter() < end:
+        pass
+    # never reaches the threshold, the search runs all its iterations
+    return 1000 - len(messages)
+
+
+async def run(workers:List[int], iterations:int):
+    kwargs = dict(
+        messages=[Message(role='user', content=Content(text='start'))],
+        cost=unit_cost,
+        heuristic=busy_heuristic,
+        threshold=0,
+        n_replies=N_REPLIES,
+        max_iteration=iterations,
+    )
+    # the throughput counts the replies generated and scored
+    print(f'{"search":<34} {"replies":>7} {"time (s)":>9} {"replies/s":>9}')
+    for n_workers in workers:
+        expansion_width = max(workers)
+        stats = SearchStats()
+        start = time.perf_counter()
+        if n_workers == 0:
+            await astar_chat(agents=[LatencyAgent('a'), LatencyAgent('b')], expansion_width=expansion_width, stats=stats, **kwargs)
+            name = 'astar_chat'
+        else:
+            await distributed_astar_chat(
+                agent_specs=[AgentSpec(LatencyAgent, name='a'), AgentSpec(LatencyAgent, name='b')],
+                n_workers=n_workers,
+                expansion_width=expansion_width,
+                stats=stats,
+                **kwargs,
+            )
+            name = f'distributed_astar_chat ({n_workers} workers)'
+        duration = time.perf_counter() - start
+        print(f'{name:<34} {stats.generated:>7} {duration:>9.2f} {stats.generated / duration:>9.1f}')
+
+
+def main():
+    global CPU_SECONDS
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4], help='0 runs astar_chat in this process')
+    parser.add_argument('--iterations', type=int, default=8)
+    parser.add_argument('--cpu-ms', type=float, default=5)
+    args = parser.parse_args()
+    CPU_SECONDS = args.cpu_ms / 1000
+    asyncio.run(run(args.workers, args.iterations))
+
+
+if __name__ == '__main__':
+    main()
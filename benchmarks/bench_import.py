@@ -0,0 +1,58 @@
+'''
+Cold start cost of siumai, measured in fresh interpreters.
+
+For every scenario, reports the median time to run it and the provider SDKs it imported,
+so that a pure OpenAI deployment can be checked not to pay for Vertex AI or Bedrock.
+
+Usage: python -m benchmarks.bench_import [--repeat 5]
+'''
+import argparse
+import json
+import subprocess
+import sys
+from statistics import median
+
+SCENARIOS = {
+    'import siumai': 'import siumai',
+    'import siumai.agent': 'import siumai.agent',
+    'import siumai.groupchat': 'import siumai.groupchat',
+    'openai Agent': '''
+import siumai.agent
+from siumai.schema import GenerationConfig
+siumai.agent.Agent(name='bench', generation_config=GenerationConfig(api_type='openai', api_key='bench'))
+''',
+}
+
+PROVIDER_MODULES = ['openai', 'vertexai', 'google.cloud.aiplatform', 'boto3', 'aiohttp', 'requests']
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+exec({code!r})
+elapsed = time.perf_counter() - start
+print(json.dumps({{'elapsed': elapsed, 'modules': [m for m in {modules!r} if m in sys.modules]}}))
+'''
+
+
+def run(code:str) -> dict:
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(code=code, modules=PROVIDER_MODULES)],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"scenario":<26} {"median (ms)":>12}  imported')
+    for name, code in SCENARIOS.items():
+        results = [run(code) for _ in range(args.repeat)]
+        elapsed = median([result['elapsed'] for result in results])
+        print(f'{name:<26} {elapsed * 1000:>12.1f}  {", ".join(results[-1]["modules"]) or "-"}')
+
+
+if __name__ == '__main__':
+    main()
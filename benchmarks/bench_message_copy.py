@@ -0,0 +1,69 @@
+'''
+Per-turn cost of preparing the conversation history in Agent.generate_response.
+
+Compares the former deepcopy of the history with the current request preparation,
+for histories of growing length where every other message carries a base64 image.
+
+Usage: python -m benchmarks.bench_message_copy
+'''
+import base64
+import os
+import time
+from copy import deepcopy
+from statistics import median
+from typing import Callable, List
+from siumai.agent import Agent
+from siumai.schema import GenerationConfig, Message, Content, File
+
+HISTORY_SIZES = [10, 50, 100, 200]
+IMAGE_BYTES = 64 * 1024
+REPEAT = 20
+
+
+class EchoClient():
+    def generate(self, messages, generation_config, reduce_function=None, output_model=None):
+        return Message(role='assistant', content=Content(text='ok'))
+
+
+def make_history(size:int) -> List[Message]:
+    image = base64.b64encode(os.urandom(IMAGE_BYTES)).decode('utf-8')
+    history = []
+    for i in range(size):
+        if i % 2 == 0:
+            history.append(Message(
+                role='user',
+                content=Content(text=f'message {i}', files=[File(mime_type='image/png', base64Str=image)]),
+            ))
+        else:
+            history.append(Message(role='assistant', content=Content(text=f'message {i}')))
+    return history
+
+
+def timeit(function:Callable[[], object]) -> float:
+    durations = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return median(durations)
+
+
+def main():
+    agent = Agent(
+        name='bench',
+        system_prompt='You are a helpful assistant.',
+        generation_config=GenerationConfig(api_type='openai', api_key='bench'),
+    )
+    agent.client = EchoClient()
+
+    print(f'{"history":>8} {"deepcopy (ms)":>14} {"prepare (ms)":>13} {"turn (ms)":>10}')
+    for size in HISTORY_SIZES:
+        history = make_history(size)
+        copy_time = timeit(lambda: deepcopy(history))
+        prepare_time = timeit(lambda: agent._request_messages(history))
+        turn_time = timeit(lambda: agent.generate_response(history))
+        print(f'{size:>8} {copy_time * 1000:>14.3f} {prepare_time * 1000:>13.3f} {turn_time * 1000:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+'''
+Local OpenAI-compatible chat completions server, for measuring siumai without provider latency.
+
+Point an agent at it with the fastchat api_type:
+
+    with MockOpenAIServer(latency=0.05) as server:
+        agent = Agent(
+            name='agent',
+            generation_config=GenerationConfig(api_type='fastchat', api_key='mock', base_url=server.base_url, model='mock'),
+        )
+'''
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Union
+
+
+def example_from_schema(schema:Dict[str, Any], defs:Union[Dict[str, Any], None]=None) -> Any:
+    '''
+    Build a value that validates against a JSON schema, so that injected tool calls pass validate_function_call
+    '''
+    defs = defs if defs != None else schema.get('$defs', {})
+    if '$ref' in schema:
+        return example_from_schema(defs[schema['$ref'].split('/')[-1]], defs)
+    if 'enum' in schema:
+        return schema['enum'][0]
+    for key in ['anyOf', 'oneOf', 'allOf']:
+        if key in schema:
+            return example_from_schema(schema[key][0], defs)
+    schema_type = schema.get('type', 'object')
+    if schema_type == 'object':
+        return {key: example_from_schema(value, defs) for key, value in schema.get('properties', {}).items()}
+    if schema_type == 'array':
+        return [example_from_schema(schema.get('items', {}), defs)]
+    if schema_type == 'string':
+        return 'mock'
+    if schema_type == 'integer':
+        return 1
+    if schema_type == 'number':
+        return 1.0
+    if schema_type == 'boolean':
+        return True
+    return None
+
+
+class MockOpenAIServer():
+    '''
+    OpenAI-compatible server answering /v1/chat/completions, streaming included.
+
+    :param latency: Seconds spent on every request before answering
+    :param jitter: Uniform random extra latency in seconds
+    :param tool_call_rate: Probability of answering with tool calls when the request has tools and the last message is not a tool response
+    :param tool_calls_per_turn: Number of tool calls of an injected tool call message
+    :param text: Text of the plain answers
+    :param json_response: Object returned when the request asks for a JSON object
+    :param seed: Seed of the random generator deciding the tool call injection
+    '''
+
+    def __init__(
+        self,
+        latency:float=0.0,
+        jitter:float=0.0,
+        tool_call_rate:float=0.0,
+        tool_calls_per_turn:int=1,
+        text:str='This is a mock response.',
+        json_response:Union[Dict[str, Any], None]=None,
+        seed:int=0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.tool_call_rate = tool_call_rate
+        self.tool_calls_per_turn = tool_calls_per_turn
+        self.text = text
+        self.json_response = json_response if json_response != None else {}
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server:Union[ThreadingHTTPServer, None] = None
+        self._thread:Union[threading.Thread, None] = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_port}/v1'
+
+    def __enter__(self) -> 'MockOpenAIServer':
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if not self.path.endswith('/chat/completions'):
+                    self.send_error(404)
+                    return
+                if body.get('stream'):
+                    self.send_stream(server.completion(body))
+                else:
+                    self.send_json(server.completion(body))
+
+            def send_json(self, payload:Dict[str, Any]):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_stream(self, completion:Dict[str, Any]):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for chunk in server.chunks(completion):
+                    self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+                    self.wfile.flush()
+                self.wfile.write(b'data: [DONE]\n\n')
+                self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._server != None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def choice(self, request:Dict[str, Any], index:int) -> Dict[str, Any]:
+        messages:List[Dict[str, Any]] = request.get('messages', [])
+        tools:List[Dict[str, Any]] = request.get('tools') or []
+        with self._lock:
+            inject = len(tools) > 0 and (len(messages) == 0 or messages[-1].get('role') != 'tool') \
+                and self._random.random() < self.tool_call_rate
+            tool_indices = [self._random.randrange(len(tools)) for _ in range(self.tool_calls_per_turn)] if inject else []
+
+        if inject:
+            message = {
+                'role': 'assistant',
+                'content': None,
+                'tool_calls': [
+                    {
+                        'id': f'call_{index}_{i}',
+                        'type': 'function',
+                        'function': {
+                            'name': tools[tool_index]['function']['name'],
+                            'arguments': json.dumps(example_from_schema(tools[tool_index]['function']['parameters'])),
+                        },
+                    } for i, tool_index in enumerate(tool_indices)
+                ],
+            }
+            return {'index': index, 'message': message, 'finish_reason': 'tool_calls'}
+
+        if (request.get('response_format') or {}).get('type') == 'json_object':
+            content = json.dumps(self.json_response)
+        else:
+            content = self.text
+        return {'index': index, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}
+
+    def completion(self, request:Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        choices = [self.choice(request, index) for index in range(request.get('n') or 1)]
+        prompt_tokens = sum(len(json.dumps(message)) // 4 for message in request.get('messages', []))
+        completion_tokens = sum(len(json.dumps(choice['message'])) // 4 for choice in choices)
+        return {
+            'id': f'chatcmpl-mock-{self.requests}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model') or 'mock',
+            'choices': choices,
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        }
+
+    def chunks(self, completion:Dict[str, Any]) -> List[Dict[str, Any]]:
+        '''
+        Split the first choice of a completion into streaming chunks, one per word or tool call argument fragment
+        '''
+        message = completion['choices'][0]['message']
+        deltas:List[Dict[str, Any]] = [{'role': 'assistant'}]
+        if message.get('tool_calls'):
+            for index, tool_call in enumerate(message['tool_calls']):
+                arguments = tool_call['function']['arguments']
+                middle = len(arguments) // 2
+                deltas.append({'tool_calls': [{
+                    'index': index,
+                    'id': tool_call['id'],
+                    'type': 'function',
+                    'function': {'name': tool_call['function']['name'], 'arguments': arguments[:middle]},
+                }]})
+                deltas.append({'tool_calls': [{'index': index, 'function': {'arguments': arguments[middle:]}}]})
+        else:
+            words = message['content'].split(' ')
+            deltas.extend({'content': word if i == 0 else f' {word}'} for i, word in enumerate(words))
+
+        return [
+            {
+                'id': completion['id'],
+                'object': 'chat.completion.chunk',
+                'created': completion['created'],
+                'model': completion['model'],
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}],
+            } for delta in deltas
+        ]
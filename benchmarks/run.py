@@ -0,0 +1,240 @@
+'''
+Offline latency, throughput and memory benchmarks of siumai against the local mock server.
+
+Measures Agent.generate_response, Agent.a_generate_response, astar_chat, group_chat and
+TextualGradientPromptTrainer.fit. With a fixed mock latency, any change in the numbers is siumai's own overhead.
+
+Usage: python -m benchmarks.run [--latency 0.05] [--repeat 20] [--json results.json]
+'''
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+from statistics import quantiles
+from typing import Any, Awaitable, Callable, Dict, List, Union
+from pydantic import BaseModel
+from benchmarks.mock_server import MockOpenAIServer
+from siumai.agent import Agent
+from siumai.groupchat import astar_chat, group_chat
+from siumai.optimisers import TextualGradientPromptTrainer
+from siumai.schema import GenerationConfig, Message, Content
+from siumai.tool import Tool
+
+
+class Address(BaseModel):
+    address: str
+
+
+class EchoTool(Tool):
+    '''
+    Answers locally, so that only siumai and the mock server are measured
+    '''
+    def run(self, **kwargs) -> str:
+        return json.dumps({'response': kwargs})
+
+    async def a_run(self, **kwargs) -> str:
+        return json.dumps({'response': kwargs})
+
+
+class Prediction(BaseModel):
+    value: int
+
+
+class Truth(BaseModel):
+    value: int
+
+
+def percentile(durations:List[float], q:int) -> float:
+    if len(durations) == 1:
+        return durations[0]
+    return quantiles(durations, n=100, method='inclusive')[q - 1]
+
+
+def report(name:str, durations:List[float], wall:float, peak:int, requests:int) -> Dict[str, Any]:
+    return {
+        'name': name,
+        'calls': len(durations),
+        'p50_ms': percentile(durations, 50) * 1000,
+        'p95_ms': percentile(durations, 95) * 1000,
+        'throughput': len(durations) / wall if wall > 0 else 0.0,
+        'peak_memory_mb': peak / 2**20,
+        'llm_requests': requests,
+    }
+
+
+class Benchmark():
+    def __init__(self, server:MockOpenAIServer, repeat:int, concurrency:int, n_candidates:int):
+        self.server = server
+        self.repeat = repeat
+        self.concurrency = concurrency
+        self.generation_config = GenerationConfig(
+            api_type='fastchat',
+            api_key='mock',
+            base_url=server.base_url,
+            model='mock',
+            n_candidates=n_candidates,
+        )
+        self.messages = [Message(role='user', content=Content(text='What is the distance between Tunis and Naples?'))]
+
+    def agent(self, name:str, tools:bool=True) -> Agent:
+        return Agent(
+            name=name,
+            system_prompt='Use the functions you have been provided to solve the problem.',
+            generation_config=self.generation_config,
+            tools=[EchoTool(name='geocoding', description='Geocode an address.', input_model=Address)] if tools else None,
+        )
+
+    def measure(self, name:str, function:Callable[[], Any]) -> Dict[str, Any]:
+        # warm up connections and lazily imported modules
+        function()
+        durations = []
+        requests = self.server.requests
+        tracemalloc.start()
+        start = time.perf_counter()
+        for _ in range(self.repeat):
+            call_start = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - call_start)
+        wall = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return report(name, durations, wall, peak, self.server.requests - requests)
+
+    async def a_measure(
+        self,
+        name:str,
+        function:Callable[[], Awaitable[Any]],
+        repeat:Union[int, None]=None,
+        concurrency:Union[int, None]=None,
+        warm_up:bool=True,
+    ) -> Dict[str, Any]:
+        repeat = repeat if repeat != None else self.repeat
+        if warm_up:
+            await function()
+        semaphore = asyncio.Semaphore(concurrency if concurrency != None else self.concurrency)
+        durations = []
+
+        async def timed():
+            async with semaphore:
+                call_start = time.perf_counter()
+                await function()
+                durations.append(time.perf_counter() - call_start)
+
+        requests = self.server.requests
+        tracemalloc.start()
+        start = time.perf_counter()
+        await asyncio.gather(*[timed() for _ in range(repeat)])
+        wall = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return report(name, durations, wall, peak, self.server.requests - requests)
+
+    async def run(self, fit:bool=True) -> List[Dict[str, Any]]:
+        results = []
+        agent = self.agent('agent')
+        results.append(self.measure('Agent.generate_response', lambda: agent.generate_response(self.messages)))
+        results.append(await self.a_measure('Agent.a_generate_response', lambda: agent.a_generate_response(self.messages)))
+
+        agents = [self.agent('geocoding_agent'), self.agent('geodesic_agent')]
+        # the goal is reached after a few turns, whatever the content
+        heuristic = lambda messages: max(0, 8 - len(messages))
+        cost = lambda messages, next_messages: sum(1 for message in next_messages if message.role != 'tool')
+        results.append(await self.a_measure(
+            'astar_chat',
+            lambda: astar_chat(agents=agents, messages=self.messages, cost=cost, heuristic=heuristic, threshold=1, n_replies=2, max_iteration=4),
+            repeat=max(1, self.repeat // 4),
+            concurrency=1,
+        ))
+        results.append(await self.a_measure(
+            'astar_chat (expansion_width=4)',
+            lambda: astar_chat(
+                agents=agents, messages=self.messages, cost=cost, heuristic=heuristic, threshold=1, n_replies=2, max_iteration=4,
+                expansion_width=4, max_concurrency=16,
+            ),
+            repeat=max(1, self.repeat // 4),
+            concurrency=1,
+        ))
+        results.append(await self.a_measure(
+            'group_chat',
+            lambda: group_chat(agents=agents, messages=self.messages, max_iteration=3),
+            repeat=max(1, self.repeat // 4),
+            concurrency=1,
+        ))
+        results.append(await self.a_measure(
+            'group_chat (broadcast)',
+            lambda: group_chat(agents=agents, messages=self.messages, max_iteration=3, mode='broadcast'),
+            repeat=max(1, self.repeat // 4),
+            concurrency=1,
+        ))
+
+        if fit:
+            async def forward(agent:Agent, x:Address) -> Union[Prediction, None]:
+                response = await agent.a_generate_response(
+                    [Message(role='user', content=Content(text=x.model_dump_json()))],
+                    output_model=Prediction,
+                )
+                return Prediction.model_validate_json(response[-1].content.text) if response else None
+
+            trainer = TextualGradientPromptTrainer(
+                generation_config=self.generation_config,
+                agent=self.agent('predictor', tools=False),
+                forward=forward,
+                loss=lambda predict, truth: abs(predict.value - truth.value),
+                batch_size=4,
+                n_beam=1,
+                n_sample=2,
+                budget=4,
+                concurrency=4,
+            )
+            x = [Address(address=f'address {i}') for i in range(8)]
+            y = [Truth(value=i) for i in range(8)]
+            results.append(await self.a_measure(
+                'TextualGradientPromptTrainer.fit',
+                lambda: trainer.fit(x=x, y=y, n_training_steps=1),
+                repeat=1,
+                concurrency=1,
+                warm_up=False,
+            ))
+
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.05, help='mock provider latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='uniform random extra latency in seconds')
+    parser.add_argument('--tool-call-rate', type=float, default=0.5, help='probability of an injected tool call')
+    parser.add_argument('--n-candidates', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--skip-fit', action='store_true')
+    parser.add_argument('--json', type=str, default=None, help='write the results to this file')
+    args = parser.parse_args()
+
+    with MockOpenAIServer(
+        latency=args.latency,
+        jitter=args.jitter,
+        tool_call_rate=args.tool_call_rate,
+        json_response={
+            'value': 1,
+            'suggestions': [{'reason': 'mock', 'prompt': f'mock prompt {i}'} for i in range(2)],
+        },
+    ) as server:
+        benchmark = Benchmark(server, repeat=args.repeat, concurrency=args.concurrency, n_candidates=args.n_candidates)
+        results = asyncio.run(benchmark.run(fit=not args.skip_fit))
+
+    print(f'{"benchmark":<34} {"calls":>6} {"p50 (ms)":>10} {"p95 (ms)":>10} {"calls/s":>9} {"peak (MB)":>10} {"LLM reqs":>9}')
+    for result in results:
+        print(
+            f'{result["name"]:<34} {result["calls"]:>6} {result["p50_ms"]:>10.1f} {result["p95_ms"]:>10.1f} '
+            f'{result["throughput"]:>9.2f} {result["peak_memory_mb"]:>10.2f} {result["llm_requests"]:>9}'
+        )
+
+    if args.json != None:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,13 @@
 from os.path import dirname, basename, isfile, join
+from importlib import import_module
 import glob
 modules = glob.glob(join(dirname(__file__), "*.py"))
 __all__ = [
     basename(f)[:-3] for f in modules if isfile(f) and not f.endswith('__init__.py')
 ]
-from . import *
\ No newline at end of file
+
+# submodules are imported on first access, so that e.g. a pure OpenAI deployment never imports the Vertex AI or Bedrock SDKs
+def __getattr__(name):
+    if name in __all__ or name == 'models':
+        return import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,13 +1,14 @@
 import asyncio
-from copy import deepcopy
+from concurrent.futures import Future, TimeoutError
 import json
-from typing import List, Callable, Optional, Union, TypeVar
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Callable, Optional, Union, TypeVar
 from pydantic import BaseModel
-from siumai.schema import Message, Content, ToolResponse, GenerationConfig, File, Function
+from siumai.schema import Message, Content, ToolCall, ToolResponse, GenerationConfig, File, Function, StreamRejected
 from siumai.tool import Tool
-import siumai.oai_client
-import siumai.vertexai_client
-import siumai.bedrock_client
+from siumai.cache import ResponseCache
+from siumai.instrumentation import span
 
 OutputType = TypeVar('OutputType')
 class Agent():
@@ -21,6 +22,9 @@ class Agent():
         tools (Optional[List[Tool]]): A dictionary of tools that the agent can use.
         terminate_function (Callable[[List[Message]], bool]): A function that determines the termination criteria for generation.
         reduce_function (Callable[[List[Message]], Message]): A function that reduces a list of messages into a single message. Useful for running self-consistency algorithms to improve performance.
+        cache (Optional[ResponseCache]): A cache of language model responses keyed by the full request. Defaults to None, i.e. no caching.
+        max_tool_concurrency (int): The maximum number of tool calls of one turn that run at the same time. Defaults to 8.
+        tool_timeout (Optional[float]): The timeout of a single tool call in seconds, from the moment it starts. A timed out call responds with an error message and gives its concurrency slot up to the queued calls. Defaults to None, i.e. no timeout.
 
     Methods:
         __init__(self, name:str, system_prompt:str=None, generation_config:GenerationConfig=None,
@@ -46,6 +50,9 @@ class Agent():
         tools:Union[List[Tool], None]=None,
         termination_function:Callable[[List[Message]], bool]=lambda x: False,
         reduce_function:Callable[[List[Message]], Message]=lambda x: x[-1],
+        cache:Union[ResponseCache, None]=None,
+        max_tool_concurrency:int=8,
+        tool_timeout:Union[float, None]=None,
     ):
         function_map = {tool.name: tool.run for tool in tools} if tools != None else {}
         a_function_map = {tool.name: tool.a_run for tool in tools} if tools != None else {}
@@ -65,115 +72,296 @@ class Agent():
         self.a_function_map = a_function_map
         self.termination_function = termination_function
         self.reduce_function = reduce_function
+        self.cache = cache
+        self.max_tool_concurrency = max_tool_concurrency
+        self.tool_timeout = tool_timeout
+        self._system_message:Union[Message, None] = None
 
+        # provider SDKs are imported with the first agent using them
         if self.generation_config.api_type in ['openai', 'fastchat', 'azure']:
-            self.client = siumai.oai_client.OAIClient(
+            from siumai.oai_client import OAIClient
+            self.client = OAIClient(
                 generation_config=self.generation_config
             )
 
         if self.generation_config.api_type == 'vertexai':
-            self.client = siumai.vertexai_client.VertexAIClient(
+            from siumai.vertexai_client import VertexAIClient
+            self.client = VertexAIClient(
                 generation_config=generation_config
             )
         
         if self.generation_config.api_type == 'bedrock':
-            self.client = siumai.bedrock_client.BedrockClient()
+            from siumai.bedrock_client import BedrockClient
+            self.client = BedrockClient()
 
+    def _generate(
+        self,
+        messages:List[Message],
+        output_model:Union[OutputType, None]=None,
+    ) -> Union[Message, List[Message], None]:
+        """
+        Call the language model, serving the response from the cache when the same request was seen before
+        """
+        with span('agent.generate', agent=self.name, messages=len(messages)) as generate_span:
+            key = None
+            if self.cache != None:
+                key = self.cache.request_key(messages, self.generation_config, output_model)
+                response = self.cache.get_response(key)
+                generate_span.set(cached=response != None)
+                if response != None:
+                    return response
 
-    def generate_response(
+            start = time.perf_counter()
+            response = self.client.generate(
+                messages=messages,
+                generation_config=self.generation_config,
+                reduce_function=self.reduce_function,
+                output_model=output_model,
+            )
+            if key != None and response != None:
+                self.cache.set_response(key, response, latency=time.perf_counter() - start)
+            return response
+
+    async def _a_generate(
         self,
         messages:List[Message],
         output_model:Union[OutputType, None]=None,
-    ) -> Union[None, List[Message]]:
+    ) -> Union[Message, List[Message], None]:
         """
-        Generate a response to the given messages based on the generation config
+        Async version of _generate
         """
-        # determine termination criteria
-        if self.termination_function(messages):
-            return None
+        with span('agent.generate', agent=self.name, messages=len(messages)) as generate_span:
+            key = None
+            if self.cache != None:
+                key = self.cache.request_key(messages, self.generation_config, output_model)
+                response = self.cache.get_response(key)
+                generate_span.set(cached=response != None)
+                if response != None:
+                    return response
 
-        _messages = deepcopy(messages)
-        # add system prompt
-        if self.system_prompt != None:
-            _messages = [Message(
+            start = time.perf_counter()
+            response = await self.client.a_generate(
+                messages=messages,
+                generation_config=self.generation_config,
+                reduce_function=self.reduce_function,
+                output_model=output_model,
+            )
+            if key != None and response != None:
+                self.cache.set_response(key, response, latency=time.perf_counter() - start)
+            return response
+
+
+    def _request_messages(self, messages:List[Message]) -> List[Message]:
+        """
+        Build the messages of a request, i.e. the system prompt followed by the conversation.
+        Messages are treated as immutable values: the list is new but the messages are shared with the caller,
+        and neither the agent nor the clients modify them, so no copy of the history is needed.
+        """
+        if self.system_prompt == None:
+            return list(messages)
+        # reuse the system message so that its provider format stays cached across requests
+        system_message = self._system_message
+        if system_message == None or system_message.content.text != self.system_prompt or system_message.name != self.name:
+            system_message = Message(
                 role='system',
                 content=Content(
                     text=self.system_prompt
                 ),
                 name=self.name,
-            )] + _messages
+            )
+            self._system_message = system_message
+        return [system_message] + list(messages)
 
-        message:Message = self.client.generate(
-            messages=_messages,
-            generation_config=self.generation_config,
-            reduce_function=self.reduce_function,
-            output_model=output_model,
-        )
-        if message == None:
-            return None
-        message.name = self.name
+    def _tool_messages(
+        self,
+        tool_calls:List[ToolCall],
+        responses:List[str],
+    ) -> List[Message]:
+        """
+        Turn the responses of the tool calls into tool messages, followed by the multimodal messages they produce
+        """
+        tool_responses:List[Message] = []
+        multimodal_responses:List[Message] = []
+        for response, tool_call in zip(responses, tool_calls):
+            # the response is assumed to be a json string
+            # if the key 'files' or the key 'url' is present, an additional message is generated
+            tool_responses.append(
+                Message(
+                    role='tool',
+                    content = Content(
+                        tool_response = ToolResponse(
+                            id=tool_call.id,
+                            name=tool_call.function_call.name,
+                            content=response
+                        )
+                    ),
+                    name=tool_call.function_call.name,
+                ),
+            )
 
-        generated_messages:List[Message] = [message]
-        
-        # tool calls
-        tool_calls = generated_messages[-1].content.tool_calls
-        while tool_calls != None:
-            tool_responses:List[Message] = []
-            multimodal_responses:List[Message] = []
-            for tool_call in tool_calls:
-                if tool_call.type == 'function':
-                    function = self.function_map.get(tool_call.function_call.name)
-                    response = function(**json.loads(tool_call.function_call.arguments))
-                    # the response is assumed to be a json string
-                    # if the key 'files' or the key 'url' is present, an additional message is generated
-                    tool_responses.append(
+            deserialised_response = json.loads(response)
+            if isinstance(deserialised_response, dict):
+                files = deserialised_response.get('files')
+                if files != None:
+                    files = [File(**file) for file in files]
+                urls = deserialised_response.get('url')
+                if isinstance(urls, str):
+                    urls = [urls]
+                if files != None or urls != None:
+                    multimodal_responses.append(
                         Message(
-                            role='tool',
+                            role='user',
                             content = Content(
-                                tool_response = ToolResponse(
-                                    id=tool_call.id,
-                                    name=tool_call.function_call.name,
-                                    content=response
-                                )
+                                files=files,
+                                urls=urls
                             ),
-                            name=tool_call.function_call.name,
-                        ),
+                            name=self.name,
+                        )
                     )
 
-                    deserialised_response = json.loads(response)
-
-                    if isinstance(deserialised_response, dict):
-                        files = deserialised_response.get('files', None)
-                        if files != None:
-                            files = [File(**file) for file in files]
-                        urls = deserialised_response.get('url', None)
-                        if files != None or urls != None:
-                            multimodal_responses.append(
-                                Message(
-                                    role='user',
-                                    content = Content(
-                                        files=files,
-                                        url=urls
-                                    ),
-                                    name=self.name,
-                                )
-                            )
-
-            generated_messages += tool_responses + multimodal_responses
-
-            second_message:Message = self.client.generate(
-                messages=_messages + generated_messages,
-                generation_config=self.generation_config,
-                reduce_function=self.reduce_function,
+        return tool_responses + multimodal_responses
+
+    def _tool_timeout_response(self, tool_call:ToolCall) -> str:
+        return json.dumps({
+            'error': f'The tool {tool_call.function_call.name} did not respond within {self.tool_timeout} seconds.'
+        })
+
+    def _run_tool_calls(
+        self,
+        tool_calls:List[ToolCall],
+    ) -> List[Message]:
+        """
+        Run the tool calls in threads, at most max_tool_concurrency at a time, and return the resulting messages in the original order
+        """
+        function_calls = [tool_call for tool_call in tool_calls if tool_call.type == 'function']
+        if len(function_calls) == 0:
+            return []
+
+        # a thread per call, at most max_tool_concurrency of them running the tool: a timed out call gives its slot up
+        # so that the calls queued behind it start, while its thread finishes in the background
+        semaphore = threading.Semaphore(max(1, self.max_tool_concurrency))
+        futures:List[Future] = [Future() for tool_call in function_calls]
+        started:List[threading.Event] = [threading.Event() for tool_call in function_calls]
+        # the timeout of a call starts when it gets a slot, not when it is queued
+        start_times:List[float] = [0.0] * len(function_calls)
+
+        def run(index:int, tool_call:ToolCall):
+            semaphore.acquire()
+            once = threading.Lock()
+            def release():
+                if once.acquire(blocking=False):
+                    semaphore.release()
+            timer = None
+            if self.tool_timeout != None:
+                timer = threading.Timer(self.tool_timeout, release)
+                timer.daemon = True
+                timer.start()
+            start_times[index] = time.monotonic()
+            started[index].set()
+            future = futures[index]
+            future.set_running_or_notify_cancel()
+            try:
+                with span('agent.tool_call', agent=self.name, tool=tool_call.function_call.name):
+                    function = self.function_map.get(tool_call.function_call.name)
+                    future.set_result(function(**json.loads(tool_call.function_call.arguments)))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                if timer != None:
+                    timer.cancel()
+                release()
+
+        for index, tool_call in enumerate(function_calls):
+            # daemon threads, a tool that never returns does not block the interpreter exit
+            threading.Thread(target=run, args=(index, tool_call), name=f'{self.name}-tool-{index}', daemon=True).start()
+
+        responses:List[str] = []
+        for index, tool_call in enumerate(function_calls):
+            # the slots of timed out calls are released, so every call starts
+            started[index].wait()
+            timeout = None
+            if self.tool_timeout != None:
+                timeout = max(0, start_times[index] + self.tool_timeout - time.monotonic())
+            try:
+                responses.append(futures[index].result(timeout=timeout))
+            except TimeoutError:
+                responses.append(self._tool_timeout_response(tool_call))
+
+        return self._tool_messages(function_calls, responses)
+
+    async def _a_run_tool_calls(
+        self,
+        tool_calls:List[ToolCall],
+    ) -> List[Message]:
+        """
+        Async version of _run_tool_calls
+        """
+        function_calls = [tool_call for tool_call in tool_calls if tool_call.type == 'function']
+        semaphore = asyncio.Semaphore(max(1, self.max_tool_concurrency))
+
+        async def run(tool_call:ToolCall) -> str:
+            async with semaphore:
+                with span('agent.tool_call', agent=self.name, tool=tool_call.function_call.name) as tool_span:
+                    coroutine = self.a_function_map.get(
+                        tool_call.function_call.name
+                    )(
+                        **json.loads(tool_call.function_call.arguments)
+                    )
+                    if self.tool_timeout == None:
+                        return await coroutine
+                    try:
+                        return await asyncio.wait_for(coroutine, self.tool_timeout)
+                    except asyncio.TimeoutError:
+                        tool_span.set(timed_out=True)
+                        return self._tool_timeout_response(tool_call)
+
+        responses = await asyncio.gather(*[run(tool_call) for tool_call in function_calls])
+
+        return self._tool_messages(function_calls, responses)
+
+    def generate_response(
+        self,
+        messages:List[Message],
+        output_model:Union[OutputType, None]=None,
+    ) -> Union[None, List[Message]]:
+        """
+        Generate a response to the given messages based on the generation config
+        """
+        # determine termination criteria
+        if self.termination_function(messages):
+            return None
+
+        with span('agent.generate_response', agent=self.name) as response_span:
+            # add system prompt
+            _messages = self._request_messages(messages)
+
+            message:Message = self._generate(
+                messages=_messages,
                 output_model=output_model,
             )
-            if second_message == None:
+            if message == None:
                 return None
-            second_message.name = self.name
-            generated_messages += [second_message]
+            message.name = self.name
+
+            generated_messages:List[Message] = [message]
+        
+            # tool calls
             tool_calls = generated_messages[-1].content.tool_calls
+            while tool_calls != None:
+                generated_messages += self._run_tool_calls(tool_calls)
+
+                second_message:Message = self._generate(
+                    messages=_messages + generated_messages,
+                    output_model=output_model,
+                )
+                if second_message == None:
+                    return None
+                second_message.name = self.name
+                generated_messages += [second_message]
+                tool_calls = generated_messages[-1].content.tool_calls
         
-        return generated_messages
+            response_span.set(generated=len(generated_messages))
+            return generated_messages
 
     async def a_generate_response(
         self, 
@@ -187,94 +375,119 @@ class Agent():
         if self.termination_function(messages):
             return None
         
-        _messages = deepcopy(messages)
+        with span('agent.a_generate_response', agent=self.name) as response_span:
+            # add system prompt
+            _messages = self._request_messages(messages)
 
-        # add system prompt
-        if self.system_prompt != None:
-            _messages = [Message(
-                role='system',
-                content=Content(
-                    text=self.system_prompt
-                ),
-                name=self.name,
-            )] + _messages
+            message:Message = await self._a_generate(
+                messages=_messages,
+                output_model=output_model,
+            )
+        
+            if message == None:
+                return None
+            message.name = self.name
+
+            generated_messages:List[Message] = [message]
+            # tool calls
+            tool_calls = generated_messages[-1].content.tool_calls
 
-        message:Message = await self.client.a_generate(
-            messages=_messages,
+            while tool_calls != None:
+                generated_messages += await self._a_run_tool_calls(tool_calls)
+
+                # call language model again
+                second_message = await self._a_generate(
+                    messages=_messages + generated_messages,
+                    output_model=output_model,
+                )
+                if second_message == None:
+                    return None
+                second_message.name = self.name
+                generated_messages += [second_message]
+                tool_calls = generated_messages[-1].content.tool_calls
+
+            response_span.set(generated=len(generated_messages))
+            return generated_messages
+
+    async def _a_generate_stream(
+        self,
+        messages:List[Message],
+        output_model:Union[OutputType, None]=None,
+    ) -> AsyncIterator[Union[str, Message, StreamRejected]]:
+        """
+        Stream one language model call: text deltas first, then the assembled message, see OAIClient.a_generate_stream.
+        Falls back to a single delta when the request is cached or the client cannot stream.
+        """
+        key = None
+        response = None
+        if self.cache != None:
+            key = self.cache.request_key(messages, self.generation_config, output_model)
+            response = self.cache.get_response(key)
+        if response == None and not hasattr(self.client, 'a_generate_stream'):
+            response = await self._a_generate(messages=messages, output_model=output_model)
+            if response == None:
+                yield StreamRejected(attempt=self.generation_config.max_retries, reason='no valid response')
+                return
+        if response != None:
+            # a reduce_function can return several messages, the stream has a single candidate
+            message = response[0] if isinstance(response, list) else response
+            if message.content.text != None:
+                yield message.content.text
+            yield message
+            return
+
+        start = time.perf_counter()
+        async for chunk in self.client.a_generate_stream(
+            messages=messages,
             generation_config=self.generation_config,
-            reduce_function=self.reduce_function,
             output_model=output_model,
-        )
-        
-        if message == None:
-            return None
-        message.name = self.name
-
-        generated_messages:List[Message] = [message]
-        # tool calls
-        tool_calls = generated_messages[-1].content.tool_calls
-
-        while tool_calls != None:
-            tasks = [
-                self.a_function_map.get(
-                    tool_call.function_call.name
-                )(
-                    **json.loads(tool_call.function_call.arguments)
-                ) for tool_call in tool_calls if tool_call.type == 'function'
-            ]
-
-            responses = await asyncio.gather(*tasks)
-
-            tool_responses = []
-            multimodal_responses = []
-            for response, tool_call in zip(responses, tool_calls):
-                # the response is assumed to be a json string
-                # if the key 'files' or the key 'url' is present, an additional message is generated
-                tool_responses.append(
-                    Message(
-                        role='tool',
-                        content = Content(
-                            tool_response = ToolResponse(
-                                id=tool_call.id,
-                                name=tool_call.function_call.name,
-                                content=response
-                            )
-                        ),
-                        name=tool_call.function_call.name,
-                    ),
-                )
+        ):
+            if isinstance(chunk, Message) and key != None:
+                self.cache.set_response(key, chunk, latency=time.perf_counter() - start)
+            yield chunk
 
-                deserialised_response = json.loads(response)
-                if isinstance(deserialised_response, dict):
-                    files = deserialised_response.get('files')
-                    if files != None:
-                        files = [File(**file) for file in files]
-                    urls = deserialised_response.get('url')
-                    if files != None or urls != None:
-                        multimodal_responses.append(
-                            Message(
-                                role='user',
-                                content = Content(
-                                    files=files,
-                                    url=urls
-                                ),
-                                name=self.name,
-                            )
-                        )
+    async def a_stream_response(
+        self,
+        messages:List[Message],
+        output_model:Union[OutputType, None]=None,
+    ) -> AsyncIterator[Union[str, Message, StreamRejected]]:
+        """
+        Streaming version of a_generate_response.
+        Yields the text deltas of the language model as they arrive, and every message once it is complete,
+        i.e. the assistant messages, the tool responses and the multimodal messages generated by the tools.
+        A StreamRejected voids the deltas streamed since the last message, the call is then retried.
+        The turn failed when the stream ends with a StreamRejected, where a_generate_response returns None.
+        """
+        # determine termination criteria
+        if self.termination_function(messages):
+            return
 
-            generated_messages += tool_responses + multimodal_responses
+        # add system prompt
+        _messages = self._request_messages(messages)
 
-            # call language model again
-            second_message = await self.client.a_generate(
-                messages=messages + generated_messages,
-                generation_config=self.generation_config,
-                reduce_function=self.reduce_function,
+        generated_messages:List[Message] = []
+        while True:
+            message = None
+            async for chunk in self._a_generate_stream(
+                messages=_messages + generated_messages,
                 output_model=output_model,
-            )
-            if second_message == None:
-                return None
-            second_message.name = self.name
-            generated_messages += [second_message]
-            tool_calls = generated_messages[-1].content.tool_calls
+            ):
+                if isinstance(chunk, Message):
+                    message = chunk
+                else:
+                    yield chunk
+
+            if message == None:
+                return
+            message.name = self.name
+            generated_messages.append(message)
+            yield message
+
+            tool_calls = message.content.tool_calls
+            if tool_calls == None:
+                return
 
-        return generated_messages
\ No newline at end of file
+            tool_messages = await self._a_run_tool_calls(tool_calls)
+            generated_messages += tool_messages
+            for tool_message in tool_messages:
+                yield tool_message
@@ -5,6 +5,7 @@ from defusedxml import ElementTree
 import boto3
 from uuid import uuid4
 from siumai.schema import Message, Content, ToolCall, Function, GenerationConfig
+from siumai.instrumentation import span
 
 # UNDER DEVELOPMENT
 
@@ -94,9 +95,12 @@ Here are the tools available:
         accept = 'application/json'
         contentType = 'application/json'
 
-        response = self.brt.invoke_model(body=body, modelId=modelId, accept=accept, contentType=contentType)
+        with span('bedrock.request', model=modelId, request_bytes=len(body)) as request_span:
+            response = self.brt.invoke_model(body=body, modelId=modelId, accept=accept, contentType=contentType)
+            raw_body = response.get('body').read()
+            request_span.set(response_bytes=len(raw_body))
 
-        response_body = json.loads(response.get('body').read())
+        response_body = json.loads(raw_body)
 
         completion, stop_reason, stop_seq = response_body.get('completion', None), response_body.get('stop_reason', None), response_body.get('stop_seq', None)
 
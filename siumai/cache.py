@@ -0,0 +1,248 @@
+from collections import OrderedDict
+from hashlib import blake2b, sha256
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple, Union
+from pydantic import BaseModel
+from siumai.schema import Message, GenerationConfig, canonical_json
+
+# fields of the generation config that do not change what the model generates
+NON_GENERATIVE_FIELDS = {
+    'api_key',
+    'api_version',
+    'organization',
+    'timeout',
+    'max_retries',
+    'path_to_google_service_account_json',
+    'google_application_credential_scope',
+}
+
+
+class LRUCache():
+    """
+    Thread-safe least recently used cache of string values with an optional time-to-live and an optional on-disk tier.
+
+    Attributes:
+        max_size (int): The maximum number of entries kept in memory.
+        ttl (Optional[float]): The time-to-live of an entry in seconds. Defaults to None, i.e. entries never expire.
+        path (Optional[str]): The directory of the on-disk tier. Defaults to None, i.e. memory only.
+        hits (int): The number of lookups served from memory or disk.
+        disk_hits (int): The number of lookups served from disk.
+        misses (int): The number of lookups that found nothing.
+        evictions (int): The number of entries evicted from memory because of max_size.
+        file_suffix (str): The suffix of the entry files, specific to the kind of cache, so that clear removes
+            the entries of this kind of cache only and the directory can be shared.
+    """
+
+    file_suffix = '.siumai-cache.json'
+
+    def __init__(
+        self,
+        max_size:int=1024,
+        ttl:Union[float, None]=None,
+        path:Union[str, None]=None,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._store:Dict[str, Tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        if self.path != None:
+            os.makedirs(self.path, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def _expired(self, created:float) -> bool:
+        return self.ttl != None and time.time() - created > self.ttl
+
+    def _file(self, key:str) -> str:
+        return os.path.join(self.path, sha256(key.encode('utf-8')).hexdigest() + self.file_suffix)
+
+    def _read_disk(self, key:str) -> Union[Tuple[float, str], None]:
+        try:
+            with open(self._file(key), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # guard against digest collisions
+        if entry.get('key') != key:
+            return None
+        return entry['created'], entry['value']
+
+    def _write_disk(self, key:str, created:float, value:str):
+        filename = self._file(key)
+        tmp = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'key': key, 'created': created, 'value': value}, f)
+        # atomic so that concurrent processes never read a partial entry
+        os.replace(tmp, filename)
+
+    def _put(self, key:str, created:float, value:str):
+        self._store[key] = (created, value)
+        self._store.move_to_end(key)
+        while len(self._store) > self.max_size:
+            self._store.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key:str) -> Union[str, None]:
+        with self._lock:
+            entry = self._store.get(key)
+            if entry != None:
+                if not self._expired(entry[0]):
+                    self._store.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._store[key]
+
+            if self.path != None:
+                entry = self._read_disk(key)
+                if entry != None and not self._expired(entry[0]):
+                    self._put(key, *entry)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return entry[1]
+
+            self.misses += 1
+            return None
+
+    def set(self, key:str, value:str):
+        created = time.time()
+        with self._lock:
+            self._put(key, created, value)
+            if self.path != None:
+                self._write_disk(key, created, value)
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+            if self.path != None:
+                for filename in os.listdir(self.path):
+                    if filename.endswith(self.file_suffix):
+                        os.remove(os.path.join(self.path, filename))
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._store),
+            'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+        }
+
+
+class ResponseCache(LRUCache):
+    """
+    Cache of language model responses keyed by a canonical hash of the full request.
+
+    The cached value is the response after the agent's reduce_function is applied,
+    so agents sharing a cache should use the same reduce_function.
+
+    Attributes:
+        saved_seconds (float): The total provider latency avoided by cache hits.
+    """
+
+    file_suffix = '.siumai-response.json'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.saved_seconds = 0.0
+
+    def request_key(
+        self,
+        messages:List[Message],
+        generation_config:GenerationConfig,
+        output_model:Union[BaseModel, None]=None,
+    ) -> str:
+        """
+        Compute the cache key of a request from the messages, the generative fields of the config, the tool schemas and the output model.
+        """
+        config = generation_config.model_dump(mode='json', exclude=NON_GENERATIVE_FIELDS)
+        request = {
+            'messages': [message.model_dump(mode='json') for message in messages],
+            'generation_config': config,
+            'output_model': output_model.model_json_schema() if output_model != None else None,
+        }
+        return sha256(canonical_json(request).encode('utf-8')).hexdigest()
+
+    def get_response(self, key:str) -> Union[Message, List[Message], None]:
+        value = self.get(key)
+        if value == None:
+            return None
+        entry = json.loads(value)
+        self.saved_seconds += entry['latency']
+        messages = [Message.model_validate(message) for message in entry['messages']]
+        if entry['many']:
+            return messages
+        return messages[0]
+
+    def set_response(self, key:str, response:Union[Message, List[Message]], latency:float=0.0):
+        many = isinstance(response, list)
+        messages = response if many else [response]
+        self.set(key, json.dumps({
+            'many': many,
+            'latency': latency,
+            'messages': [message.model_dump(mode='json') for message in messages],
+        }))
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        stats = super().stats()
+        stats['saved_seconds'] = self.saved_seconds
+        return stats
+
+
+class HeuristicCache(LRUCache):
+    """
+    Memo table of heuristic scores keyed by a rolling hash of the conversation.
+
+    The key of a conversation is computed from the key of its prefix and the appended messages only,
+    so a search extends the key of a node without reading the conversation again.
+    A conversation reached again on another branch, or in an earlier run when the cache has a path, is never scored twice.
+    The heuristic is assumed to depend on the content of the conversation only.
+
+    Attributes:
+        saved_calls (int): The number of heuristic calls avoided, i.e. the hits.
+    """
+
+    file_suffix = '.siumai-heuristic.json'
+
+    def __init__(self, max_size:int=100000, **kwargs):
+        super().__init__(max_size=max_size, **kwargs)
+
+    @staticmethod
+    def extend_key(prefix_key:Union[str, None], messages:Iterable[Message]) -> str:
+        """
+        The key of the conversation made of the prefix, whose key is given, followed by the messages.
+        The key of the empty conversation is None.
+        """
+        digest = bytes.fromhex(prefix_key) if prefix_key != None else b''
+        for message in messages:
+            digest = blake2b(digest + message.digest, digest_size=16).digest()
+        return digest.hex()
+
+    def conversation_key(self, messages:Iterable[Message]) -> str:
+        return self.extend_key(None, messages)
+
+    def get_score(self, key:str) -> Tuple[bool, Union[float, None]]:
+        """
+        Return whether the conversation was scored, and its score, which can be None.
+        """
+        value = self.get(key)
+        if value == None:
+            return False, None
+        return True, json.loads(value)
+
+    def set_score(self, key:str, score:Union[float, None]):
+        self.set(key, json.dumps(score))
+
+    @property
+    def saved_calls(self) -> int:
+        return self.hits
@@ -1,9 +1,9 @@
-import requests
 from typing import Literal, Optional, Union
 from pydantic import EmailStr
 from eth_account import Account
 from eth_account.messages import encode_defunct
 from time import time
+from siumai.sessions import SESSION_POOL
 
 
 class Client():
@@ -18,7 +18,7 @@ class Client():
 
 
     def summary(self):
-        response = requests.get(
+        response = SESSION_POOL.get(
             f'{self.url}/users/',
             headers={
                 'Api-Key': self.api_key
@@ -29,7 +29,7 @@ class Client():
 
 
     def delete_tool(self, tool):
-        response = requests.delete(
+        response = SESSION_POOL.delete(
             f'{self.url}/tools/{tool}',
             headers={
                 'Api-Key': self.api_key
@@ -44,7 +44,7 @@ class Client():
         message_hash = encode_defunct(text=message)
         signature = account.sign_message(message_hash).signature.hex()
 
-        response = requests.post(
+        response = SESSION_POOL.post(
             f'{self.url}/users/register_ethereum_address',
             json={
                 'user_id': self.user_id,
@@ -60,7 +60,7 @@ class Client():
 
 
     def stable_coin_payout(self, amount: float, stable_coin: Literal['usdt', 'usdc', 'dai'], address: Optional[str] = None):
-        response = requests.post(
+        response = SESSION_POOL.post(
             f'{self.url}/payout/stable_coin',
             json={
                 'amount': amount,
@@ -76,7 +76,7 @@ class Client():
 
 
     def transfer_payout_to_balance(self, amount: float):
-        response = requests.post(
+        response = SESSION_POOL.post(
             f'{self.url}/payout/balance',
             params={
                 'amount': amount,
@@ -101,15 +101,15 @@ class Client():
         }
 
         if parent_id != None:
-            response = requests.get(
-                f'{self.endpoint}/log/{parent_id}',
+            response = SESSION_POOL.get(
+                f'{self.url}/log/{parent_id}',
                 headers=headers,
             )
             return response.json()
 
         else:
-            response = requests.get(
-                f'{self.endpoint}/log',
+            response = SESSION_POOL.get(
+                f'{self.url}/log',
                 headers=headers,
                 params={
                     'tool_id': tool,
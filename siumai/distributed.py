@@ -0,0 +1,254 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import traceback
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, Union
+from siumai.agent import Agent
+from siumai.schema import Message
+from siumai.search import Canonicaliser, Frontier, Node, SearchStats, StateKey, accept_children, state_key
+from siumai.utils import resolve_awaitables
+
+
+class AgentSpec():
+    """
+    Picklable recipe of an agent, built again in every worker process.
+
+    Agents hold clients, connection pools and lambdas, which cannot be sent to another process,
+    so the workers receive the factory and its arguments instead. The factory must be importable,
+    i.e. a class or a function defined at the top level of a module.
+
+    Attributes:
+        factory (Callable[..., Agent]): The agent class or a function returning the agent. Defaults to Agent.
+        kwargs (Dict[str, Any]): The arguments of the factory, e.g. name, generation_config and system_prompt.
+
+    Example:
+        spec = AgentSpec(name='planner', generation_config=generation_config, system_prompt='Plan the trip.')
+    """
+
+    def __init__(self, factory:Callable[..., Agent]=Agent, **kwargs):
+        self.factory = factory
+        self.kwargs = kwargs
+
+    def build(self) -> Agent:
+        return self.factory(**self.kwargs)
+
+
+def dump_messages(messages:List[Message]) -> str:
+    return json.dumps([message.model_dump(mode='json', exclude_none=True) for message in messages], separators=(',', ':'))
+
+
+def load_messages(data:str) -> List[Message]:
+    return [Message.model_validate(message) for message in json.loads(data)]
+
+
+def worker_loop(
+    agent_specs:List[AgentSpec],
+    cost:Callable[[List[Message], List[Message]], Union[float, Awaitable[float]]],
+    heuristic:Callable[[List[Message]], Union[float, None, Awaitable[Union[float, None]]]],
+    n_replies:int,
+    tasks:multiprocessing.Queue,
+    results:multiprocessing.Queue,
+):
+    """
+    Body of a worker process: run the tasks received on tasks until it receives None.
+
+    A task is (kind, index, conversation), with the messages as JSON:
+    ('expand', index, path) returns (index, children) with a child (messages, cost),
+    ('score', index, conversation) returns (index, heuristic score),
+    and a task that raised returns (index, error) with the traceback as a string.
+    """
+    agents = [spec.build() for spec in agent_specs]
+
+    async def expand(path:List[Message]) -> List[Tuple[str, float]]:
+        responses = await asyncio.gather(*[agent.a_generate_response(path) for agent in agents for i in range(n_replies)])
+        responses = [response for response in responses if response != None]
+        costs = await resolve_awaitables([cost(path, response) for response in responses])
+        return [(dump_messages(response), child_cost) for response, child_cost in zip(responses, costs)]
+
+    async def score(conversation:List[Message]) -> Union[float, None]:
+        return (await resolve_awaitables([heuristic(conversation)]))[0]
+
+    async def serve():
+        while True:
+            task = await asyncio.to_thread(tasks.get)
+            if task == None:
+                return
+            kind, index, data = task
+            try:
+                run = expand if kind == 'expand' else score
+                results.put((index, await run(load_messages(data))))
+            except Exception:
+                results.put((index, traceback.format_exc()))
+
+    asyncio.run(serve())
+
+
+def get_result(results:multiprocessing.Queue, workers:List[multiprocessing.Process]) -> Tuple[int, Any]:
+    """
+    The next result of the workers, raises if a worker died instead of waiting forever.
+    """
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            for worker in workers:
+                if not worker.is_alive():
+                    raise RuntimeError(f'Worker {worker.name} exited with code {worker.exitcode}')
+
+
+async def distributed_astar_chat(
+    agent_specs: List[AgentSpec],
+    messages: List[Message],
+    cost: Callable[[List[Message], List[Message]], Union[float, Awaitable[float]]],
+    heuristic: Callable[[List[Message]], Union[float, None, Awaitable[Union[float, None]]]],
+    threshold: int=10,
+    n_replies: int=1,
+    max_iteration:int=10,
+    n_workers:Union[int, None]=None,
+    expansion_width:Union[int, None]=None,
+    stats:Union[SearchStats, None]=None,
+    canonicaliser:Union[Canonicaliser, None]=None,
+    start_method:Union[str, None]=None,
+) -> Tuple[
+        List[Message],
+        Dict[StateKey, Union[StateKey, None]],
+        Dict[StateKey, float],
+        Dict[StateKey, float],
+        Dict[StateKey, Tuple[Message]]
+    ]:
+    """
+    astar_chat over worker processes, for searches limited by one event loop or one core.
+
+    The coordinator, in the calling process, owns the frontier and the maps. Every iteration it pops expansion_width nodes
+    and sends their conversations to the workers over multiprocessing queues. A worker builds the agents from their specs once,
+    generates the replies of a node and computes their cost. The coordinator drops the duplicates like astar_chat,
+    in the order the nodes were popped, then of the agents and replies, and sends the accepted children back to the workers
+    for their heuristic score, so scoring runs in parallel too and duplicates are never scored.
+    The search is the one of astar_chat with the same expansion_width, whatever the number of workers.
+
+    The cost and the heuristic are sent to the workers, they must be picklable, i.e. defined at the top level of a module.
+
+    :param agent_specs: Recipes of the agents participating in the conversation
+    :param messages: List of messages to start the conversation
+    :param cost: Cost function for the current conversation
+    :param heuristic: Heuristic function for estimating how far the current conversation is from the goal
+    :param threshold: Threshold for the heuristic function
+    :param n_replies: Number of replies to generate for each agent
+    :param max_iteration: Terminate the search after max_iteration iterations
+    :param n_workers: Number of worker processes, defaults to the number of CPUs
+    :param expansion_width: Number of nodes expanded per iteration, defaults to n_workers
+    :param stats: Counters of the search, filled in during the search
+    :param canonicaliser: State keys merging equivalent responses, see astar_chat
+    :param start_method: The multiprocessing start method, e.g. 'spawn', defaults to the one of the platform
+    :return: Same as astar_chat
+    """
+    stats = stats if stats != None else SearchStats()
+    n_workers = n_workers if n_workers != None else os.cpu_count() or 1
+    expansion_width = expansion_width if expansion_width != None else n_workers
+    key_function = canonicaliser if canonicaliser != None else state_key
+
+    context = multiprocessing.get_context(start_method)
+    tasks = context.Queue()
+    results = context.Queue()
+    workers = [
+        context.Process(target=worker_loop, args=(agent_specs, cost, heuristic, n_replies, tasks, results), daemon=True)
+        for i in range(n_workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    async def run_tasks(kind:str, conversations:List[List[Message]]) -> List[Any]:
+        # the results in the order of the conversations, whichever worker ran them
+        for index, conversation in enumerate(conversations):
+            tasks.put((kind, index, dump_messages(conversation)))
+        outputs: List[Any] = [None] * len(conversations)
+        for i in range(len(conversations)):
+            index, output = await asyncio.to_thread(get_result, results, workers)
+            if isinstance(output, str):
+                raise RuntimeError(f'A worker failed to {kind} a conversation:\n{output}')
+            outputs[index] = output
+        return outputs
+
+    try:
+        root = Node(key=key_function(messages), messages=tuple(messages))
+        root.heuristic = (await run_tasks('score', [messages]))[0]
+        stats.heuristic_calls += 1
+
+        came_from: Dict[StateKey, Union[StateKey, None]] = {root.key: None}
+        cost_so_far: Dict[StateKey, float] = {root.key: 0}
+        heuristic_map: Dict[StateKey, float] = {root.key: root.heuristic}
+        hash_map: Dict[StateKey, Tuple[Message]] = {root.key: root.messages}
+        nodes: Dict[StateKey, Node] = {root.key: root}
+
+        frontier = Frontier()
+        frontier.push(root)
+        stats.pushed += 1
+
+        for current_iteration in range(max_iteration):
+            batch: List[Node] = []
+            while len(batch) < expansion_width:
+                node = frontier.pop()
+                if node == None:
+                    break
+                batch.append(node)
+            if len(batch) == 0:
+                break
+            stats.iterations += 1
+            stats.expanded += len(batch)
+
+            # the children in the same order as astar_chat: node, agent, reply
+            paths = [node.path() for node in batch]
+            expansions = await run_tasks('expand', paths)
+            children: List[Tuple[Node, List[Message], List[Message]]] = []
+            costs: List[float] = []
+            for node, path, expansion in zip(batch, paths, expansions):
+                for data, child_cost in expansion:
+                    children.append((node, path, load_messages(data)))
+                    costs.append(child_cost)
+            stats.generated += len(children)
+
+            # only the accepted children are scored, duplicates cost no heuristic call
+            accepted = accept_children(children, costs, key_function, cost_so_far, hash_map, stats, canonicaliser != None)
+            heuristic_scores = await run_tasks('score', [path + next for node, path, next, new_cost in accepted.values()])
+            stats.heuristic_calls += len(accepted)
+
+            goal: Union[Node, None] = None
+            for (key, (node, path, next, new_cost)), heuristic_score in zip(accepted.items(), heuristic_scores):
+                # if heuristic score is None, use the heuristic score of the previous message
+                if heuristic_score == None:
+                    heuristic_score = node.heuristic
+
+                child = Node(key=key, messages=tuple(next), parent=node, cost=new_cost, heuristic=heuristic_score)
+                previous = nodes.get(key)
+                if previous != None:
+                    frontier.discard(previous)
+                nodes[key] = child
+                cost_so_far[key] = new_cost
+                came_from[key] = node.key
+                hash_map[key] = child.messages
+                heuristic_map[key] = heuristic_score
+
+                frontier.push(child)
+                stats.pushed += 1
+                stats.max_frontier_size = max(stats.max_frontier_size, len(frontier))
+
+                if heuristic_score < threshold:
+                    goal = child
+                    break
+
+            if goal != None:
+                stats.stale = frontier.stale
+                return goal.path(), came_from, cost_so_far, heuristic_map, hash_map
+
+        stats.stale = frontier.stale
+        best = nodes[min(heuristic_map, key=heuristic_map.get)]
+        return best.path(), came_from, cost_so_far, heuristic_map, hash_map
+    finally:
+        for worker in workers:
+            tasks.put(None)
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
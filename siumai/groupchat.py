@@ -1,179 +1,568 @@
 import asyncio
-from copy import deepcopy, copy
-import queue
+from copy import copy
+from inspect import isawaitable
+import time
 from siumai.agent import Agent, Message
-from typing import Callable, List, Union, Tuple, Dict
-from pydantic import BaseModel
+from siumai.cache import HeuristicCache
+from siumai.search import Canonicaliser, Frontier, GroupChatStats, IncrementalHeuristic, Node, SearchCheckpoint, SearchEvent, SearchStats, StateKey, accept_children, state_key
+from siumai.utils import resolve_awaitables
+from typing import AsyncIterator, Awaitable, Callable, List, Literal, Union, Tuple, Dict
 from tqdm import tqdm
 
-class QueueItem(BaseModel):
-    priority:float
-    messages:List[List[Message]]
-
-    def __lt__(self, other):
-        return self.priority < other.priority
-    
 
 def reconstruct_path(
-    came_from:Dict[Tuple[int], Union[Tuple[int], None]],
-    goal:Tuple[int],
-    hash_map:Dict[Union[Tuple[int], Tuple[Message]], Union[Tuple[int], Tuple[Message]]]
+    came_from:Dict[StateKey, Union[StateKey, None]],
+    goal:StateKey,
+    hash_map:Dict[StateKey, Tuple[Message]]
 ) -> List[Message]:
+    """
+    Rebuild the conversation leading to the goal state from the maps returned by astar_chat
+    """
     current = goal
     path = []
     # start is None
     while current != None:
-        path.extend(list(hash_map[current]))
+        path.extend(reversed(hash_map[current]))
         current = came_from[current]
     path.reverse()
     return path
 
 
+async def astar_chat_stream(
+    agents: List[Agent],
+    messages: List[Message],
+    cost: Callable[[List[Message], List[Message]], Union[float, Awaitable[float]]],
+    heuristic: Callable[[List[Message]], Union[float, None, Awaitable[Union[float, None]]]],
+    threshold: int=10,
+    n_replies: int=1,
+    max_iteration:int=10,
+    stats:Union[SearchStats, None]=None,
+    expansion_width:int=1,
+    max_concurrency:Union[int, None]=None,
+    heuristic_concurrency:Union[int, None]=None,
+    heuristic_cache:Union[HeuristicCache, None]=None,
+    max_queue_size:Union[int, None]=None,
+    max_frontier_bytes:Union[int, None]=None,
+    checkpoint:Union[SearchCheckpoint, None]=None,
+    resume:bool=False,
+    canonicaliser:Union[Canonicaliser, None]=None,
+) -> AsyncIterator[SearchEvent]:
+    """
+    astar_chat as an async iterator of SearchEvent, yielded as the search goes: every node expanded,
+    every child scored, every new best node, the goal, and finally the result of astar_chat.
+    Stop iterating to cancel the search, no agent call is running while an event is handled.
+
+    The arguments are the ones of astar_chat.
+    """
+    stats = stats if stats != None else SearchStats()
+    key_function = canonicaliser if canonicaliser != None else state_key
+
+    scoring_semaphore = asyncio.Semaphore(heuristic_concurrency) if heuristic_concurrency != None else None
+
+    async def score(conversation_keys:List[Union[str, None]], conversations:Callable[[int], List[Message]]) -> List[Union[float, None]]:
+        # the scores of the conversations, from the heuristic cache when possible
+        scores = []
+        missed = []
+        for index, conversation_key in enumerate(conversation_keys):
+            if heuristic_cache != None:
+                found, heuristic_score = heuristic_cache.get_score(conversation_key)
+                if found:
+                    stats.heuristic_cache_hits += 1
+                    scores.append(heuristic_score)
+                    continue
+            stats.heuristic_calls += 1
+            missed.append(index)
+            scores.append(heuristic(conversations(index)))
+        scores = await resolve_awaitables(scores, scoring_semaphore)
+        if heuristic_cache != None:
+            for index in missed:
+                heuristic_cache.set_score(conversation_keys[index], scores[index])
+        return scores
+
+    frontier = Frontier(max_size=max_queue_size, max_bytes=max_frontier_bytes)
+    # the node holding the cheapest known path to each state
+    nodes: Dict[StateKey, Node] = {}
+    state = None
+    if resume:
+        if checkpoint == None:
+            raise ValueError('resume requires a checkpoint')
+        state = checkpoint.load(key_function)
+        if state == None:
+            raise ValueError(f'No search to resume in {checkpoint.path}')
+
+    if state != None:
+        nodes = state.nodes
+        for key, value in state.stats.items():
+            setattr(stats, key, value)
+        frontier.stale = stats.stale
+        for node in state.queued:
+            frontier.push(node)
+        # conversation keys are only recorded when the interrupted search had a heuristic cache
+        if heuristic_cache != None:
+            for node in nodes.values():
+                if node.conversation_key == None:
+                    node.conversation_key = heuristic_cache.conversation_key(node.path())
+    else:
+        root = Node(key=key_function(messages), messages=tuple(messages))
+        if heuristic_cache != None:
+            root.conversation_key = heuristic_cache.conversation_key(messages)
+        root.heuristic = (await score([root.conversation_key], lambda index: messages))[0]
+        nodes[root.key] = root
+        # the root is expanded first whatever its heuristic score
+        frontier.push(root)
+        stats.pushed += 1
+        if checkpoint != None:
+            checkpoint.start()
+            checkpoint.add_node(root)
+
+    came_from: Dict[StateKey, Union[StateKey, None]] = {
+        key: node.parent.key if node.parent != None else None for key, node in nodes.items()
+    }
+    cost_so_far: Dict[StateKey, float] = {key: node.cost for key, node in nodes.items()}
+    heuristic_map: Dict[StateKey, float] = {key: node.heuristic for key, node in nodes.items()}
+    hash_map: Dict[StateKey, Tuple[Message]] = {key: node.messages for key, node in nodes.items()}
+
+    if state != None:
+        if state.goal != None:
+            yield SearchEvent('goal_reached', stats.iterations, node=state.goal, score=state.goal.heuristic)
+            yield SearchEvent('finished', stats.iterations, node=state.goal, result=(state.goal.path(), came_from, cost_so_far, heuristic_map, hash_map))
+            return
+        checkpoint.start(resume=True)
+
+    # the node with the lowest heuristic score, the result when the threshold is not reached
+    best = min(nodes.values(), key=lambda node: node.heuristic)
+
+    semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency != None else None
+
+    async def generate(agent:Agent, current_messages:List[Message]) -> Union[List[Message], None]:
+        if semaphore == None:
+            return await agent.a_generate_response(current_messages)
+        async with semaphore:
+            return await agent.a_generate_response(current_messages)
+
+    for current_iteration in range(stats.iterations if state != None else 0, max_iteration):
+        # Pick the next nodes to expand
+        batch: List[Node] = []
+        while len(batch) < expansion_width:
+            node = frontier.pop()
+            if node == None:
+                break
+            batch.append(node)
+        if len(batch) == 0:
+            break
+        stats.iterations += 1
+        stats.expanded += len(batch)
+        for node in batch:
+            yield SearchEvent('node_expanded', current_iteration, node=node, score=node.heuristic)
+        paths: List[List[Message]] = [node.path() for node in batch]
+
+        # For each node and each agent generate n_replies responses, all at once
+        tasks = [
+            generate(agent, current_messages) for current_messages in paths for agent in agents for i in range(n_replies)
+        ]
+        responses:List[Union[List[Message], None]] = await asyncio.gather(*tasks)
+        n_tasks = len(agents) * n_replies
+
+        # the children in a deterministic order: node, agent, reply
+        children: List[Tuple[Node, List[Message], List[Message]]] = []
+        for index, (node, current_messages) in enumerate(zip(batch, paths)):
+            for next in responses[index * n_tasks:(index + 1) * n_tasks]:
+                if next != None:
+                    children.append((node, current_messages, next))
+        stats.generated += len(children)
+
+        # calculate the cost of the new messages, concurrently if the cost is a coroutine
+        costs: List[float] = await resolve_awaitables(
+            [cost(current_messages, next) for node, current_messages, next in children],
+            scoring_semaphore,
+        )
+
+        # keep the cheapest child of every state that improves on the known cost
+        accepted = accept_children(children, costs, key_function, cost_so_far, hash_map, stats, canonicaliser != None)
+
+        # score the accepted children, concurrently if the heuristic is a coroutine
+        candidates = list(accepted.values())
+        conversation_keys: List[Union[str, None]] = [
+            heuristic_cache.extend_key(node.conversation_key, next) if heuristic_cache != None else None
+            for node, current_messages, next, new_cost in candidates
+        ]
+        heuristic_scores = await score(conversation_keys, lambda index: candidates[index][1] + candidates[index][2])
+
+        goal: Union[Node, None] = None
+        for (key, (node, current_messages, next, new_cost)), heuristic_score, conversation_key in zip(accepted.items(), heuristic_scores, conversation_keys):
+            # if heuristic score is None, use the heuristic score of the previous message
+            if heuristic_score == None:
+                heuristic_score = node.heuristic
+
+            child = Node(key=key, messages=tuple(next), parent=node, cost=new_cost, heuristic=heuristic_score)
+            child.conversation_key = conversation_key
+            # the entry of the previous path to the state is skipped when popped
+            previous = nodes.get(key)
+            if previous != None:
+                frontier.discard(previous)
+            nodes[key] = child
+
+            cost_so_far[key] = new_cost
+            came_from[key] = node.key
+            hash_map[key] = child.messages
+            heuristic_map[key] = heuristic_score
+
+            # Add the new node to the frontier
+            frontier.push(child)
+            stats.pushed += 1
+            if checkpoint != None:
+                checkpoint.add_node(child)
+            stats.max_frontier_size = max(stats.max_frontier_size, len(frontier))
+
+            yield SearchEvent('child_scored', current_iteration, node=child, score=heuristic_score)
+            if heuristic_score < best.heuristic:
+                best = child
+                yield SearchEvent('new_best', current_iteration, node=child, score=heuristic_score)
+
+            if heuristic_score < threshold:
+                goal = child
+                break
+
+        if goal != None:
+            stats.stale = frontier.stale
+            if checkpoint != None:
+                checkpoint.end_iteration(batch, [], stats, goal)
+            yield SearchEvent('goal_reached', current_iteration, node=goal, score=goal.heuristic)
+            yield SearchEvent('finished', current_iteration, node=goal, result=(goal.path(), came_from, cost_so_far, heuristic_map, hash_map))
+            return
+
+        # the pruned nodes were never expanded, they have no children to keep
+        pruned = frontier.prune()
+        for node in pruned:
+            stats.pruned += 1
+            del nodes[node.key], came_from[node.key], cost_so_far[node.key], heuristic_map[node.key], hash_map[node.key]
+
+        stats.stale = frontier.stale
+        if checkpoint != None:
+            checkpoint.end_iteration(batch, pruned, stats)
+
+    stats.stale = frontier.stale
+    if checkpoint != None:
+        checkpoint.flush()
+    best = nodes[min(heuristic_map, key=heuristic_map.get)]
+    yield SearchEvent('finished', stats.iterations, node=best, result=(best.path(), came_from, cost_so_far, heuristic_map, hash_map))
+
+
 async def astar_chat(
     agents: List[Agent],
     messages: List[Message],
-    cost: Callable[[List[Message]], float],
-    heuristic: Callable[[List[Message]], Union[float, None]],
+    cost: Callable[[List[Message], List[Message]], Union[float, Awaitable[float]]],
+    heuristic: Callable[[List[Message]], Union[float, None, Awaitable[Union[float, None]]]],
     threshold: int=10,
     n_replies: int=1,
     max_iteration:int=10,
+    stats:Union[SearchStats, None]=None,
+    expansion_width:int=1,
+    max_concurrency:Union[int, None]=None,
+    heuristic_concurrency:Union[int, None]=None,
+    heuristic_cache:Union[HeuristicCache, None]=None,
+    max_queue_size:Union[int, None]=None,
+    max_frontier_bytes:Union[int, None]=None,
+    checkpoint:Union[SearchCheckpoint, None]=None,
+    resume:bool=False,
+    canonicaliser:Union[Canonicaliser, None]=None,
 ) -> Tuple[
         List[Message], 
-        Dict[Tuple[int], Union[Tuple[int], None]], 
-        Dict[Tuple[int], float],
-        Dict[Tuple[int], float],
-        Dict[Union[Tuple[int], Tuple[Message]], Union[Tuple[int], Tuple[Message]]]
+        Dict[StateKey, Union[StateKey, None]], 
+        Dict[StateKey, float],
+        Dict[StateKey, float],
+        Dict[StateKey, Tuple[Message]]
     ]:
     """
     The agents will concurrently generate a response to the messages.
     The best response will be selected based on the heuristic function.
 
+    The frontier is a heap of nodes which store their parent and the messages of their own expansion only,
+    the conversation of a node is rebuilt when the node is expanded.
+
+    Each iteration expands the expansion_width best nodes of the frontier together, which trades a few extra
+    language model calls for fewer round trips. The children are processed in the order the nodes were popped,
+    then in the order of the agents and replies, so the search is deterministic for deterministic agents.
+
+    The cost and the heuristic can be coroutine functions, e.g. when the heuristic asks a language model.
+    The children of an iteration are then scored concurrently. A synchronous heuristic runs in the event loop,
+    wrap a blocking one with asyncio.to_thread.
+
+    With a heuristic_cache, a conversation already scored on another branch, or in an earlier search sharing the cache,
+    is not scored again. The hits are counted in the stats and in the cache.
+
+    With max_queue_size or max_frontier_bytes the search becomes a beam search: after every iteration the frontier
+    nodes with the worst priority are dropped until the frontier fits, and their states are removed from the maps.
+
+    With a canonicaliser, the responses equivalent up to tool call IDs, whitespace, argument order or name share
+    a state: the first one reached is kept and the others are merged into it like any duplicate, so their subtrees
+    are never expanded. The merges are counted in stats.transpositions.
+
+    With a checkpoint, the nodes and the progress of every iteration are appended to a JSONL file. With resume,
+    the search is rebuilt from the file instead of starting from the messages, and continues until max_iteration
+    iterations in total, see resume_astar_chat. The agents, cost and heuristic should be the ones of the interrupted search.
+
     :param agents: List of agents participating in the conversation
     :param messages: List of messages to start the conversation
     :param cost: Cost function for the current conversation
     :param heuristic: Heuristic function for estimating how far the current conversation is from the goal
-    :param starting_priority: Priority of the first message in the frontier queue
     :param threshold: Threshold for the heuristic function
     :param n_replies: Number of replies to generate for each agent
     :param max_iteration: Terminate the search after max_try iterations
-    :param max_queue_size: Maximum size of the frontier priority queue
+    :param stats: Counters of the search, filled in during the search
+    :param expansion_width: Number of nodes expanded per iteration
+    :param max_concurrency: Maximum number of concurrent agent calls across the expanded nodes, None for no limit
+    :param heuristic_concurrency: Maximum number of concurrent coroutine heuristic and cost calls, None for no limit
+    :param heuristic_cache: Memo table of the heuristic scores keyed by conversation
+    :param max_queue_size: Maximum number of nodes in the frontier, None for no limit
+    :param max_frontier_bytes: Maximum size of the messages held by the frontier nodes, approximated by their JSON length, None for no limit
+    :param checkpoint: Log of the search to resume from after a crash, None for no checkpoint
+    :param resume: Rebuild the search from the checkpoint, the messages are then ignored
+    :param canonicaliser: State keys merging the responses that differ only by tool call IDs, whitespace, argument order or name
+    :return: The best path, then the maps of the search keyed by state: the parent state, the cost, the heuristic score and the messages
+    """
+    progress = tqdm(total=max_iteration)
+    result = None
+    async for event in astar_chat_stream(
+        agents=agents,
+        messages=messages,
+        cost=cost,
+        heuristic=heuristic,
+        threshold=threshold,
+        n_replies=n_replies,
+        max_iteration=max_iteration,
+        stats=stats,
+        expansion_width=expansion_width,
+        max_concurrency=max_concurrency,
+        heuristic_concurrency=heuristic_concurrency,
+        heuristic_cache=heuristic_cache,
+        max_queue_size=max_queue_size,
+        max_frontier_bytes=max_frontier_bytes,
+        checkpoint=checkpoint,
+        resume=resume,
+        canonicaliser=canonicaliser,
+    ):
+        if event.type == 'node_expanded':
+            progress.update(event.iteration + 1 - progress.n)
+        elif event.type == 'finished':
+            result = event.result
+    progress.close()
+    return result
+
+
+async def resume_astar_chat(
+    checkpoint: SearchCheckpoint,
+    agents: List[Agent],
+    cost: Callable[[List[Message], List[Message]], Union[float, Awaitable[float]]],
+    heuristic: Callable[[List[Message]], Union[float, None, Awaitable[Union[float, None]]]],
+    **kwargs,
+) -> Tuple[
+        List[Message],
+        Dict[StateKey, Union[StateKey, None]],
+        Dict[StateKey, float],
+        Dict[StateKey, float],
+        Dict[StateKey, Tuple[Message]]
+    ]:
     """
-    # Initialize the frontier queue
-    frontier = queue.PriorityQueue()
+    Resume the search recorded in the checkpoint: the frontier and the maps are rebuilt from the file,
+    and the search continues with the next iteration, recording into the same checkpoint.
+    A search that had reached the threshold returns its goal without calling the agents.
 
-    # Place first message to the frontier queue
-    frontier.put(QueueItem(priority=0, messages=[messages]))
+    :param checkpoint: Log written by astar_chat
+    :param agents: List of agents participating in the conversation
+    :param cost: Cost function for the current conversation
+    :param heuristic: Heuristic function for estimating how far the current conversation is from the goal
+    :param kwargs: The other arguments of astar_chat, max_iteration counting the iterations already run
+    :return: Same as astar_chat
+    """
+    return await astar_chat(agents, [], cost, heuristic, checkpoint=checkpoint, resume=True, **kwargs)
 
-    came_from: Dict[Tuple[int], Union[Tuple[int], None]] = {}
-    cost_so_far: Dict[Tuple[int], float] = {}
-    heuristic_map: Dict[Tuple[int], float] = {}
 
-    first_hash = tuple([hash(message) for message in messages])
-    came_from[first_hash] = None
-    cost_so_far[first_hash] = 0
-    heuristic_map[first_hash] = heuristic(messages)
+GroupChatMode = Literal['roundtable', 'broadcast', 'speculative']
 
-    hash_map: Dict[Union[Tuple[int], Tuple[Message]], Union[Tuple[int], Tuple[Message]]] = {
-        first_hash: tuple(messages),
-        tuple(messages): first_hash,
-    }
 
-    for current_iteration in tqdm(range(max_iteration)):
-        if frontier.empty():
-            break
-        # Pick the next list of messages for the conversation
-        current_messages: List[List[Message]] = frontier.get().messages
-        flatten_current_messages: List[Message] = [message for sublist in current_messages for message in sublist]
-        
-        # For each agent generate n_replies responses
-        tasks = [
-            [
-                agent.a_generate_response(flatten_current_messages) for i in range(n_replies)
-            ] for agent in agents
-        ]
-        # Flatten the list of tasks
-        tasks = [item for sublist in tasks for item in sublist]
-
-        generated_messages:List[Union[List[Message], None]] = await asyncio.gather(*tasks)
-        generated_messages:List[List[Message]] = [message for message in generated_messages if message != None]
-
-        for next in generated_messages:
-            # calculate the cost of the new message
-            new_cost:float = cost_so_far[hash_map[tuple(current_messages[-1])]] + cost(flatten_current_messages, next)
-            hash_next_messages = tuple([hash(message) for message in next])
-            previous_cost = cost_so_far.get(hash_next_messages, None)
-            # the message is never seen before or the new cost is less than the previous cost
-            if previous_cost == None or new_cost < previous_cost:
-                cost_so_far[hash_next_messages] = new_cost
-                came_from[hash_next_messages] = hash_map[tuple(current_messages[-1])]
-                hash_map[hash_next_messages] = tuple(next)
-                hash_map[tuple(next)] = hash_next_messages
-                heuristic_score = heuristic(flatten_current_messages + next)
-                # if heuristic score is None, use the heuristic score of the previous message
-                if heuristic_score == None:
-                    heuristic_score = heuristic_map[hash_map[tuple(current_messages[-1])]]
-                heuristic_map[hash_next_messages] = heuristic_score
-                priority = new_cost + heuristic_score
-
-                # Add the new item to the frontier
-                new_item = QueueItem(priority=priority, messages=current_messages + [next])
-                frontier.put(new_item)
-
-                if heuristic_score < threshold:
-                    reconstructed_path:List[Message] = reconstruct_path(
-                        came_from=came_from,
-                        goal=hash_next_messages,
-                        hash_map=hash_map
-                    )
-                    return reconstructed_path, came_from, cost_so_far, heuristic_map, hash_map 
-
-    goal = min(heuristic_map, key=heuristic_map.get)
-    reconstructed_path:List[Message] = reconstruct_path(
-        came_from=came_from,
-        goal=goal,
-        hash_map=hash_map,
-    )
-
-    return reconstructed_path, came_from, cost_so_far, heuristic_map, hash_map
+async def group_chat_stream(
+    agents: List[Agent],
+    messages: List[Message],
+    heuristic: Union[Callable[[List[Message]], Union[float, None, Awaitable[Union[float, None]]]], IncrementalHeuristic]=lambda x: None,
+    threshold: int=10,
+    max_iteration:int=3,
+    heuristic_cache:Union[HeuristicCache, None]=None,
+    mode:GroupChatMode='roundtable',
+    speculate:Union[Callable[[List[Message], Agent], Union[List[Message], None, Awaitable[Union[List[Message], None]]]], None]=None,
+    stats:Union[GroupChatStats, None]=None,
+) -> AsyncIterator[SearchEvent]:
+    '''
+    group_chat as an async iterator of SearchEvent: an agent_turn event after every response, with its score,
+    then goal_reached if the threshold is reached, and finally a finished event holding the result of group_chat.
+    Stop iterating to end the chat early, a running speculative call is then cancelled.
+
+    The arguments are the ones of group_chat.
+    '''
+    if mode not in ('roundtable', 'broadcast', 'speculative'):
+        raise ValueError(f'Unknown group chat mode {mode!r}')
+    if mode == 'speculative' and speculate == None:
+        raise ValueError('The speculative mode requires a speculate function')
+    stats = stats if stats != None else GroupChatStats()
+
+    _messages = copy(messages)
+    conversation_key = heuristic_cache.conversation_key(messages) if heuristic_cache != None else None
+
+    heuristic_map: Dict[Message, float] = {}
+
+    incremental = isinstance(heuristic, IncrementalHeuristic)
+    if incremental:
+        heuristic_state = heuristic.initial_state(messages)
+        if isawaitable(heuristic_state):
+            heuristic_state = await heuristic_state
+    # the messages not fed to the incremental heuristic yet, because their score came from the cache
+    unscored: List[Message] = []
+
+    async def timed_response(agent:Agent, current_messages:List[Message]) -> Tuple[Union[List[Message], None], float, float]:
+        stats.calls += 1
+        start = time.perf_counter()
+        response = await agent.a_generate_response(current_messages)
+        return response, start, time.perf_counter()
+
+    # the call of the next agent on the conversation extended by the predicted response of the current agent
+    speculation: Union[asyncio.Task, None] = None
+    # the end of the call the speculation overlapped with
+    previous_end = 0.0
+
+    def cancel_speculation():
+        nonlocal speculation
+        if speculation != None:
+            speculation.cancel()
+            stats.extra_calls += 1
+            speculation = None
+
+    turns = [(current_iteration, agent) for current_iteration in range(max_iteration) for agent in agents]
+    try:
+        broadcast: List[Tuple[Union[List[Message], None], float, float]] = []
+        for turn, (current_iteration, agent) in enumerate(turns):
+            if mode == 'broadcast':
+                # all the agents of the round answer the conversation as it was at the start of the round
+                if turn % len(agents) == 0:
+                    broadcast = await asyncio.gather(*[timed_response(_agent, _messages) for _agent in agents])
+                    stats.latency_saved += sum(end - start for response, start, end in broadcast) \
+                        - (max(end for response, start, end in broadcast) - min(start for response, start, end in broadcast))
+                response = broadcast[turn % len(agents)][0]
+            else:
+                # after a right prediction, the call of the agent already ran, at least partly, during the previous turn
+                hit = speculation != None
+                task = speculation if hit else asyncio.create_task(timed_response(agent, _messages))
+                speculation = None
+                prediction = None
+                if mode == 'speculative' and turn + 1 < len(turns):
+                    prediction = speculate(_messages, agent)
+                    if isawaitable(prediction):
+                        prediction = await prediction
+                    if prediction != None:
+                        speculation = asyncio.create_task(timed_response(turns[turn + 1][1], _messages + prediction))
+                response, start, end = await task
+                if hit:
+                    stats.speculative_hits += 1
+                    stats.latency_saved += min(previous_end, end) - start
+                if speculation != None:
+                    if response != None and [message.digest for message in response] == [message.digest for message in prediction]:
+                        previous_end = end
+                    else:
+                        stats.speculative_misses += 1
+                        cancel_speculation()
+
+            # error handling for None response
+            if response == None:
+                if mode == 'broadcast':
+                    stats.extra_calls += len(agents) - 1 - turn % len(agents)
+                break
+
+            # the conversation is extended in place, the heuristic reads it without a copy
+            _messages.extend(response)
+
+            found = False
+            if heuristic_cache != None:
+                conversation_key = heuristic_cache.extend_key(conversation_key, response)
+                found, heuristic_score = heuristic_cache.get_score(conversation_key)
+            if incremental:
+                unscored.extend(response)
+            if not found:
+                if incremental:
+                    update = heuristic.update(heuristic_state, unscored)
+                    unscored = []
+                    if isawaitable(update):
+                        update = await update
+                    heuristic_state, heuristic_score = update
+                else:
+                    heuristic_score = heuristic(_messages)
+                    if isawaitable(heuristic_score):
+                        heuristic_score = await heuristic_score
+                if heuristic_cache != None:
+                    heuristic_cache.set_score(conversation_key, heuristic_score)
+            heuristic_map.update({message:heuristic_score for message in response})
+            stats.turns += 1
+            yield SearchEvent('agent_turn', current_iteration, score=heuristic_score, agent=agent.name, messages=response)
+            # if heuristic score is less than the threshold, terminate the chat
+            if heuristic_score != None and heuristic_score < threshold:
+                if mode == 'broadcast':
+                    stats.extra_calls += len(agents) - 1 - turn % len(agents)
+                yield SearchEvent('goal_reached', current_iteration, score=heuristic_score, agent=agent.name, messages=response)
+                break
+    finally:
+        cancel_speculation()
+
+    yield SearchEvent('finished', max_iteration, result=(_messages, heuristic_map))
 
 
 async def group_chat(
     agents: List[Agent],
     messages: List[Message],
-    heuristic: Callable[[List[Message]], Union[float, None]]=lambda x: None,
+    heuristic: Union[Callable[[List[Message]], Union[float, None, Awaitable[Union[float, None]]]], IncrementalHeuristic]=lambda x: None,
     threshold: int=10,
     max_iteration:int=3,
+    heuristic_cache:Union[HeuristicCache, None]=None,
+    mode:GroupChatMode='roundtable',
+    speculate:Union[Callable[[List[Message], Agent], Union[List[Message], None, Awaitable[Union[List[Message], None]]]], None]=None,
+    stats:Union[GroupChatStats, None]=None,
 ):
     '''
     Start the chat, with the first agent initiating the conversation.
     Each agent in the agents list will take turn in a roundtable to generate a response to the messages.
+
+    In the broadcast mode, the agents of a round answer the same conversation concurrently, as if they were independent,
+    and their responses are appended in the order of the agents. A round costs one round trip instead of one per agent.
+
+    In the speculative mode, the agents take turns, but the next agent starts on the conversation extended by the
+    response that speculate predicts for the current agent, e.g. from a response cache. The speculative call is kept
+    when the prediction is right and cancelled otherwise. The stats count the latency saved against the extra calls.
     
     :param agents: List of agents participating in the conversation
     :param messages: List of messages to start the conversation
-    :param heuristic: Heuristic function for estimating how far the current conversation is from the goal
+    :param heuristic: Heuristic function for estimating how far the current conversation is from the goal, can be a coroutine function.
+        It receives the conversation itself, which must not be modified. An IncrementalHeuristic receives the new messages only
     :param threshold: Threshold for the heuristic function
     :param max_iteration: Terminate the chat after max_iteration of turns. 
         For each turn, each agent in the agents list will, by its order, generate a response.
+    :param heuristic_cache: Memo table of the heuristic scores keyed by conversation, e.g. shared by repeated chats
+    :param mode: 'roundtable', 'broadcast' or 'speculative'
+    :param speculate: Predicts the response of an agent to the messages, None when it cannot, required by the speculative mode
+    :param stats: Counters of the chat, filled in during the chat
     '''
-    _messages = copy(messages)
-
-    heuristic_map: Dict[Message, float] = {}
-
-    for current_iteration in tqdm(range(max_iteration), desc='Iteration'):
-        for agent in tqdm(agents, desc='Agent', leave=False):
-            # Generate a response from the agent
-            response = await agent.a_generate_response(_messages)
-
-            # error handling for None response
-            if response == None:
-                return _messages, heuristic_map
-            
-            heuristic_score = heuristic(_messages + response)
-            heuristic_map.update({message:heuristic_score for message in response})
-            
-            _messages.extend(response)
-            # if heuristic score is less than the threshold, terminate the chat
-            if heuristic_score and heuristic_score < threshold:
-                return _messages, heuristic_map
-
-    return _messages, heuristic_map
\ No newline at end of file
+    progress = tqdm(total=max_iteration * len(agents), desc='Turn')
+    result = None
+    async for event in group_chat_stream(
+        agents=agents,
+        messages=messages,
+        heuristic=heuristic,
+        threshold=threshold,
+        max_iteration=max_iteration,
+        heuristic_cache=heuristic_cache,
+        mode=mode,
+        speculate=speculate,
+        stats=stats,
+    ):
+        if event.type == 'agent_turn':
+            progress.update(1)
+        elif event.type == 'finished':
+            result = event.result
+    progress.close()
+    return result
@@ -0,0 +1,256 @@
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+import math
+import threading
+import time
+import warnings
+from typing import Any, Callable, Deque, Dict, List, Sequence, Tuple, Union
+
+# upper bounds of the latency histogram buckets in milliseconds, the last bucket is unbounded
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+
+class Span():
+    """
+    One timed stage of a call, e.g. the transformation of the messages, a provider request or a tool call.
+
+    Attributes:
+        name (str): The stage, e.g. 'openai.request' or 'tool.run'.
+        attributes (Dict[str, Any]): The details of the call, e.g. whether it was retried, the token usage or the payload sizes.
+        parent (Optional[Span]): The span that was open when this one started, in the same thread or task.
+        start (float): The time.perf_counter() value at the start of the span.
+        duration (float): The duration in seconds, set when the span ends.
+        error (Optional[str]): The name of the exception raised within the span, if any.
+    """
+    __slots__ = ('name', 'attributes', 'parent', 'start', 'duration', 'error', '_instrumentation', '_token')
+
+    # False on the span returned when nobody listens, check it before computing costly attributes
+    recording = True
+
+    def __init__(self, instrumentation:'Instrumentation', name:str, attributes:Dict[str, Any]):
+        self.name = name
+        self.attributes = attributes
+        self.parent:Union[Span, None] = None
+        self.start = 0.0
+        self.duration = 0.0
+        self.error:Union[str, None] = None
+        self._instrumentation = instrumentation
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def begin(self) -> 'Span':
+        """
+        Start the span without making it the current span, for a stage left open across yields,
+        e.g. a stream, so that the spans opened by the consumer meanwhile do not get it as parent.
+        """
+        self.parent = _current_span.get()
+        self.start = time.perf_counter()
+        return self
+
+    def end(self, error:Union[BaseException, None]=None):
+        self.duration = time.perf_counter() - self.start
+        if error != None:
+            self.error = type(error).__name__
+        self._instrumentation.emit(self)
+
+    def __enter__(self) -> 'Span':
+        self.begin()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        _current_span.reset(self._token)
+        self.end(exc)
+        return False
+
+
+class NoopSpan():
+    """
+    The span returned when no listener is registered: entering, setting and leaving it cost nothing.
+    """
+    __slots__ = ()
+
+    recording = False
+
+    def set(self, **attributes):
+        pass
+
+    def begin(self) -> 'NoopSpan':
+        return self
+
+    def end(self, error:Union[BaseException, None]=None):
+        pass
+
+    def __enter__(self) -> 'NoopSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+_current_span:ContextVar[Union[Span, None]] = ContextVar('siumai_current_span', default=None)
+
+
+class Instrumentation():
+    """
+    Dispatches the spans of agents, clients and tools to the registered listeners.
+
+    A listener is any callable taking the finished Span. It is called in the thread that ran the stage,
+    so listeners shared across threads must be thread-safe, like SpanAggregator.
+    Without listeners, span() returns a shared no-op span and the instrumented code pays a single check.
+    """
+
+    def __init__(self):
+        # replaced, never mutated, so that emit can iterate without holding the lock
+        self._listeners:Tuple[Callable[[Span], None], ...] = ()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return len(self._listeners) > 0
+
+    def add_listener(self, listener:Callable[[Span], None]) -> Callable[[Span], None]:
+        """
+        Register a listener. Returns the listener, so that it can be used as a decorator.
+        """
+        with self._lock:
+            self._listeners = self._listeners + (listener,)
+        return listener
+
+    def remove_listener(self, listener:Callable[[Span], None]):
+        with self._lock:
+            self._listeners = tuple(_listener for _listener in self._listeners if _listener is not listener)
+
+    def span(self, name:str, **attributes) -> Union[Span, NoopSpan]:
+        """
+        Time a stage: `with span('openai.request', retried=False) as request_span: ...`
+        """
+        if len(self._listeners) == 0:
+            return NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def emit(self, span:Span):
+        for listener in self._listeners:
+            try:
+                listener(span)
+            except Exception as e:
+                # a broken listener must not break the call it observes
+                warnings.warn(f'Instrumentation listener {listener!r} failed on span {span.name}: {e!r}')
+
+
+def percentile(samples:Sequence[float], q:float) -> float:
+    """
+    Nearest-rank percentile of sorted samples, q between 0 and 1.
+    """
+    if len(samples) == 0:
+        return 0.0
+    return samples[max(0, min(len(samples) - 1, math.ceil(q * len(samples)) - 1))]
+
+
+class StageStats():
+    __slots__ = ('count', 'errors', 'total', 'max', 'buckets', 'samples', 'totals')
+
+    def __init__(self, n_buckets:int, max_samples:int):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (n_buckets + 1)
+        self.samples:Deque[float] = deque(maxlen=max_samples)
+        self.totals:Dict[str, float] = {}
+
+
+class SpanAggregator():
+    """
+    In-memory listener reporting the latency histogram of every stage, with p50 and p95.
+
+    The percentiles are computed over the last max_samples spans of each stage, the histogram and the counters over all of them.
+    Numeric attributes, e.g. the token usage and the payload sizes, are summed per stage, and flags counted.
+
+    Attributes:
+        buckets_ms (Sequence[float]): The upper bounds of the histogram buckets in milliseconds. Defaults to DEFAULT_BUCKETS_MS.
+        max_samples (int): The number of recent durations kept per stage for the percentiles. Defaults to 10000.
+
+    Example:
+        aggregator = SpanAggregator()
+        add_listener(aggregator)
+        ...
+        print(aggregator.report())
+    """
+
+    def __init__(self, buckets_ms:Sequence[float]=DEFAULT_BUCKETS_MS, max_samples:int=10000):
+        self.buckets_ms = tuple(buckets_ms)
+        self.max_samples = max_samples
+        self._stages:Dict[str, StageStats] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, span:Span):
+        duration_ms = span.duration * 1000
+        with self._lock:
+            stage = self._stages.get(span.name)
+            if stage == None:
+                stage = StageStats(len(self.buckets_ms), self.max_samples)
+                self._stages[span.name] = stage
+            stage.count += 1
+            stage.total += duration_ms
+            stage.max = max(stage.max, duration_ms)
+            stage.buckets[bisect_left(self.buckets_ms, duration_ms)] += 1
+            stage.samples.append(duration_ms)
+            if span.error != None:
+                stage.errors += 1
+            for key, value in span.attributes.items():
+                # numbers are summed, e.g. tokens and bytes, flags are counted, e.g. retried or cached
+                if isinstance(value, (int, float)):
+                    stage.totals[key] = stage.totals.get(key, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Per stage: count, errors, total_ms, mean_ms, p50_ms, p95_ms, max_ms, the histogram keyed by bucket label,
+        and the totals of the numeric attributes.
+        """
+        labels = [f'<={bound}ms' for bound in self.buckets_ms] + [f'>{self.buckets_ms[-1]}ms']
+        result = {}
+        with self._lock:
+            for name, stage in self._stages.items():
+                samples = sorted(stage.samples)
+                result[name] = {
+                    'count': stage.count,
+                    'errors': stage.errors,
+                    'total_ms': stage.total,
+                    'mean_ms': stage.total / stage.count,
+                    'p50_ms': percentile(samples, 0.5),
+                    'p95_ms': percentile(samples, 0.95),
+                    'max_ms': stage.max,
+                    'histogram': {label: count for label, count in zip(labels, stage.buckets) if count > 0},
+                    'totals': dict(stage.totals),
+                }
+        return result
+
+    def report(self) -> str:
+        """
+        The stats as a table, slowest stages first.
+        """
+        stats = self.stats()
+        lines:List[str] = [f'{"stage":<32} {"count":>7} {"errors":>6} {"p50 (ms)":>10} {"p95 (ms)":>10} {"max (ms)":>10} {"total (ms)":>11}']
+        for name, stage in sorted(stats.items(), key=lambda item: -item[1]['total_ms']):
+            lines.append(
+                f'{name:<32} {stage["count"]:>7} {stage["errors"]:>6} {stage["p50_ms"]:>10.1f} '
+                f'{stage["p95_ms"]:>10.1f} {stage["max_ms"]:>10.1f} {stage["total_ms"]:>11.1f}'
+            )
+        return '\n'.join(lines)
+
+
+INSTRUMENTATION = Instrumentation()
+
+span = INSTRUMENTATION.span
+add_listener = INSTRUMENTATION.add_listener
+remove_listener = INSTRUMENTATION.remove_listener
@@ -0,0 +1,130 @@
+import glob
+from hashlib import sha256
+import importlib.machinery
+import importlib.util
+import marshal
+import os
+import sys
+import threading
+import types
+from typing import Dict, Type, Union
+from pydantic import BaseModel
+
+
+class ModelRegistry():
+    """
+    In-process registry of the pydantic models published with the tools.
+
+    The source of a model is compiled and executed once per content hash, into a module registered
+    as siumai.models.model_<hash> so that the models can be pickled by reference within the process.
+    Loading N tools costs N compilations at most, and nothing is written into the package directory.
+
+    With the on-disk cache, the registry is also an import hook: another process, e.g. a worker of
+    distributed_astar_chat or a later run, imports siumai.models.model_<hash> from the cached code,
+    so the models unpickle there too. Without it, they unpickle only in the process that loaded the tool.
+
+    Attributes:
+        path (Optional[str]): The directory of the on-disk cache of compiled code, keyed by content hash. Defaults to None, i.e. memory only.
+        compiled (int): The number of sources compiled in this process.
+    """
+
+    def __init__(self, path:Union[str, None]=None):
+        self.path = path
+        self.compiled = 0
+        self._modules:Dict[str, types.ModuleType] = {}
+        self._lock = threading.Lock()
+        if self.path != None:
+            os.makedirs(self.path, exist_ok=True)
+
+    def _cache_file(self, digest:str) -> str:
+        return os.path.join(self.path, f'{digest}.{sys.implementation.cache_tag}.bin')
+
+    def _read_cache(self, digest:str) -> Union[types.CodeType, None]:
+        try:
+            with open(self._cache_file(digest), 'rb') as f:
+                data = f.read()
+            # the code of another interpreter version cannot be loaded
+            if data.startswith(importlib.util.MAGIC_NUMBER):
+                return marshal.loads(data[len(importlib.util.MAGIC_NUMBER):])
+        except (OSError, ValueError, EOFError, TypeError):
+            pass
+        return None
+
+    def _compile(self, source:str, digest:str, filename:str) -> types.CodeType:
+        if self.path != None:
+            code = self._read_cache(digest)
+            if code != None:
+                return code
+
+        code = compile(source, filename, 'exec')
+        self.compiled += 1
+
+        if self.path != None:
+            filename = self._cache_file(digest)
+            tmp = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(importlib.util.MAGIC_NUMBER + marshal.dumps(code))
+            os.replace(tmp, filename)
+
+        return code
+
+    def module(self, source:str) -> types.ModuleType:
+        """
+        Return the module executed from the source, executing it on first use.
+        """
+        digest = sha256(source.encode('utf-8')).hexdigest()
+        with self._lock:
+            module = self._modules.get(digest)
+            if module != None:
+                return module
+
+            name = f'{MODULE_PREFIX}{digest[:32]}'
+            module = types.ModuleType(name)
+            module.__file__ = f'<{name}>'
+            code = self._compile(source, digest, module.__file__)
+            sys.modules[name] = module
+            try:
+                exec(code, module.__dict__)
+            except:
+                del sys.modules[name]
+                raise
+            self._modules[digest] = module
+            return module
+
+    def load(self, source:str, class_name:str) -> Type[BaseModel]:
+        """
+        Return the model class named class_name defined by the source.
+        """
+        return getattr(self.module(source), class_name)
+
+    def find_spec(self, fullname:str, path=None, target=None) -> Union[importlib.machinery.ModuleSpec, None]:
+        """
+        Import hook of the modules of the on-disk cache, see importlib.abc.MetaPathFinder.
+        """
+        if self.path == None or not fullname.startswith(MODULE_PREFIX):
+            return None
+        prefix = fullname[len(MODULE_PREFIX):]
+        for filename in glob.glob(os.path.join(self.path, f'{glob.escape(prefix)}*.{sys.implementation.cache_tag}.bin')):
+            digest = os.path.basename(filename).split('.')[0]
+            if self._read_cache(digest) != None:
+                spec = importlib.util.spec_from_loader(fullname, self)
+                spec.loader_state = digest
+                return spec
+        return None
+
+    def create_module(self, spec:importlib.machinery.ModuleSpec) -> None:
+        return None
+
+    def exec_module(self, module:types.ModuleType):
+        digest = module.__spec__.loader_state
+        module.__file__ = f'<{module.__name__}>'
+        exec(self._read_cache(digest), module.__dict__)
+        with self._lock:
+            self._modules.setdefault(digest, module)
+
+
+# the models of the tools are in modules named after the content hash of their source
+MODULE_PREFIX = 'siumai.models.model_'
+
+MODEL_REGISTRY = ModelRegistry(path=os.environ.get('SIUMAI_MODEL_CACHE'))
+sys.meta_path.append(MODEL_REGISTRY)
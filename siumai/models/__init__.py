@@ -1,7 +1,15 @@
 from os.path import dirname, basename, isfile, join
+from importlib import import_module
 import glob
+# registers the import hook of the models of the tools, see ModelRegistry
+import siumai.model_registry
 modules = glob.glob(join(dirname(__file__), "*.py"))
 __all__ = [
     basename(f)[:-3] for f in modules if isfile(f) and not f.endswith('__init__.py')
 ]
-from . import *
\ No newline at end of file
+
+# model files are imported on first access rather than all at once with the package
+def __getattr__(name):
+    if name in __all__:
+        return import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,10 +1,13 @@
 import openai
 import json
+import time
 from jsonschema import validate
-from openai.types.chat import ChatCompletion, ChatCompletionMessage, ChatCompletionMessageToolCall
-from typing import Dict, List, Callable, Optional, Union
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ChatCompletionMessage, ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function as OpenAIFunction
+from typing import AsyncIterator, Dict, List, Callable, Optional, Tuple, Union
 from pydantic import BaseModel
-from siumai.schema import Message, Content, ToolCall, FunctionCall, GenerationConfig
+from siumai.schema import Message, Content, ToolCall, FunctionCall, GenerationConfig, StreamRejected
+from siumai.instrumentation import span
 
 OEPNAI_API_KW = [
     'model',
@@ -124,16 +127,128 @@ def transform_message_openai(message:Message) -> Dict:
             'tool_call_id': message.content.tool_response.id,
         }
 
+def transform_messages_openai(messages:List[Message]) -> List[Dict]:
+    """
+    Transform the messages into the openai format, reusing the result cached on each message.
+    Only the messages that are new, or reassigned since the previous request, are transformed.
+    """
+    return [message.memoize('openai', transform_message_openai) for message in messages]
+
 def validate_function_call(tool_call:ChatCompletionMessageToolCall, config:GenerationConfig) -> bool:
-    if tool_call.function.name.lower() not in config.tools.keys():
-        return False
-    try:
-        arguments = json.loads(tool_call.function.arguments)
-        schema = config.tools.get(tool_call.function.name.lower()).parameters
-        validate(arguments, schema)
-        return True
-    except:
-        return False
+    with span('openai.validate_function_call', tool=tool_call.function.name) as validate_span:
+        valid = False
+        if tool_call.function.name.lower() in config.tools.keys():
+            try:
+                arguments = json.loads(tool_call.function.arguments)
+                schema = config.tools.get(tool_call.function.name.lower()).parameters
+                validate(arguments, schema)
+                valid = True
+            except:
+                pass
+        validate_span.set(valid=valid)
+    return valid
+
+def openai_usage(response:ChatCompletion) -> Dict:
+    """
+    The token usage and the payload size of a response, as span attributes.
+    """
+    attributes = {'response_bytes': len(response.model_dump_json())}
+    if response.usage != None:
+        attributes['prompt_tokens'] = response.usage.prompt_tokens
+        attributes['completion_tokens'] = response.usage.completion_tokens
+        attributes['total_tokens'] = response.usage.total_tokens
+    return attributes
+
+def parse_openai_messages(
+    generated_messages:List[ChatCompletionMessage],
+    generation_config:GenerationConfig,
+    output_model:BaseModel = None,
+) -> List[Message]:
+    """
+    Turn the choices of a response into messages, dropping the invalid tool calls and the outputs not matching the output model.
+    """
+    _messages = []
+    with span('openai.parse', choices=len(generated_messages)) as parse_span:
+        for message in generated_messages:
+            if message.tool_calls != None:
+                tool_calls = [
+                    ToolCall(
+                        id=tool_call.id,
+                        type=tool_call.type,
+                        function_call=FunctionCall(
+                            name=tool_call.function.name.lower(), 
+                            arguments=tool_call.function.arguments
+                        )
+                    ) for tool_call in message.tool_calls if validate_function_call(tool_call, generation_config)
+                ]
+                if tool_calls == []:
+                    continue
+
+                content = Content(
+                    tool_calls=tool_calls
+                )
+            else:
+                content = Content(
+                    text=message.content,
+                )
+
+            if output_model and content.text != None:
+                try:
+                    output_model.model_validate_json(content.text)
+                    _messages.append(
+                        Message(
+                            role='assistant',
+                            content=content,
+                        )
+                    )
+                except:
+                    pass
+            else:
+                _messages.append(
+                    Message(
+                        role='assistant',
+                        content=content,
+                    )
+                )
+        parse_span.set(accepted=len(_messages))
+    return _messages
+
+def openai_request(
+    messages:List[Message],
+    generation_config:GenerationConfig,
+    output_model:BaseModel = None,
+) -> Tuple[List[Message], Dict]:
+    """
+    Build the messages and the keyword arguments of a chat completion request.
+    The given list of messages is never modified, a new list is returned when an instruction has to be added.
+    """
+    kw_args = openai_parse_kw_args(generation_config.model_dump())
+
+    if output_model != None:
+        messages = messages + [
+            Message(
+                role='user',
+                content=Content(
+                    text='You must return a JSON object according to this json schema. {schema}'.format(
+                        schema = output_model.model_json_schema()
+                    )
+                )
+            )
+        ]
+        kw_args['response_format'] = {'type':'json_object'}
+
+    if generation_config.tools != None:
+        kw_args['tools'] = [
+            {
+                'type':'function',
+                'function':tool.model_dump()
+            } for tool in generation_config.tools.values()
+        ]
+
+    if generation_config.api_type == 'azure':
+        kw_args['model'] = generation_config.azure_deployment
+
+    return messages, kw_args
 
 class OAIClient():
     def __init__(self, generation_config:GenerationConfig):
@@ -181,83 +296,28 @@ class OAIClient():
             output_model:BaseModel = None,
     ) -> Union[Message, List[Message], None]:
         # call the openai api
-        kw_args = openai_parse_kw_args(generation_config.model_dump())
-
-        if output_model != None:
-            messages.append(
-                Message(
-                    role='user',
-                    content=Content(
-                        text='You must return a JSON object according to this json schema. {schema}'.format(
-                            schema = output_model.model_json_schema()
-                        )
-                    )
-                )
-            )
-            kw_args['response_format'] = {'type':'json_object'}
-
-        if generation_config.tools != None:
-            kw_args['tools'] = [
-                {
-                    'type':'function',
-                    'function':tool.model_dump()
-                } for tool in generation_config.tools.values()
-            ]
-
-        if generation_config.api_type == 'azure':
-            kw_args['model'] = generation_config.azure_deployment
+        messages, kw_args = openai_request(messages, generation_config, output_model)
 
         _messages = []
 
+        # transformed once for all retries, and once per message across requests
+        with span('openai.transform', messages=len(messages)) as transform_span:
+            openai_messages = transform_messages_openai(messages)
+            if transform_span.recording:
+                transform_span.set(request_bytes=len(json.dumps(openai_messages)))
+
         for num_retry in range(generation_config.max_retries):
-            response:ChatCompletion = self.client.chat.completions.create(
-                messages=[transform_message_openai(message) for message in messages],
-                **kw_args
-            )
+            with span('openai.request', model=kw_args.get('model'), retried=num_retry > 0) as request_span:
+                response:ChatCompletion = self.client.chat.completions.create(
+                    messages=openai_messages,
+                    **kw_args
+                )
+                if request_span.recording:
+                    request_span.set(**openai_usage(response))
 
             generated_messages = [choice.message for choice in response.choices]
 
-            for message in generated_messages:
-                if message.tool_calls != None:
-                    tool_calls = [
-                        ToolCall(
-                            id=tool_call.id,
-                            type=tool_call.type,
-                            function_call=FunctionCall(
-                                name=tool_call.function.name.lower(), 
-                                arguments=tool_call.function.arguments
-                            )
-                        ) for tool_call in message.tool_calls if validate_function_call(tool_call, generation_config)
-                    ]
-                    if tool_calls == []:
-                        continue
-
-                    content = Content(
-                        tool_calls=tool_calls
-                    )
-                else:
-                    content = Content(
-                        text=message.content,
-                    )
-
-                if output_model and content.text != None:
-                    try:
-                        output_model.model_validate_json(content.text)
-                        _messages.append(
-                            Message(
-                                role='assistant',
-                                content=content,
-                            )
-                        )
-                    except:
-                        pass
-                else:
-                    _messages.append(
-                        Message(
-                            role='assistant',
-                            content=content,
-                        )
-                    )
+            _messages += parse_openai_messages(generated_messages, generation_config, output_model)
 
             if len(_messages) >= generation_config.n_candidates:
                 _messages = _messages[:generation_config.n_candidates]
@@ -278,82 +338,28 @@ class OAIClient():
         output_model:BaseModel = None
     ) -> Union[Message, List[Message], None]:
         # call the openai api
-        kw_args = openai_parse_kw_args(generation_config.model_dump())
-        
-        if output_model != None:
-            messages.append(
-                Message(
-                    role='user', 
-                    content=Content(
-                        text='You must return a JSON object according to this json schema. {schema}'.format(
-                            schema=output_model.model_json_schema()
-                        )
-                    )
-                )
-            )
-            kw_args['response_format'] = {'type':'json_object'}
-
-        if generation_config.tools != None:
-            kw_args['tools'] = [
-                {
-                    'type':'function',
-                    'function':tool.model_dump()
-                } for tool in generation_config.tools.values()
-            ]
-        
-        if generation_config.api_type == 'azure':
-            kw_args['model'] = generation_config.azure_deployment
+        messages, kw_args = openai_request(messages, generation_config, output_model)
 
         _messages = []
 
+        # transformed once for all retries, and once per message across requests
+        with span('openai.transform', messages=len(messages)) as transform_span:
+            openai_messages = transform_messages_openai(messages)
+            if transform_span.recording:
+                transform_span.set(request_bytes=len(json.dumps(openai_messages)))
+
         for num_retry in range(generation_config.max_retries):
-            response = await self.a_client.chat.completions.create(
-                messages=[transform_message_openai(message) for message in messages],
-                **kw_args
-            )
+            with span('openai.request', model=kw_args.get('model'), retried=num_retry > 0) as request_span:
+                response:ChatCompletion = await self.a_client.chat.completions.create(
+                    messages=openai_messages,
+                    **kw_args
+                )
+                if request_span.recording:
+                    request_span.set(**openai_usage(response))
 
             generated_messages:List[ChatCompletionMessage] = [choice.message for choice in response.choices]
 
-            for message in generated_messages:
-                if message.tool_calls != None:
-                    tool_calls = [
-                        ToolCall(
-                            id=tool_call.id,
-                            type=tool_call.type, 
-                            function_call=FunctionCall(
-                                name=tool_call.function.name.lower(), 
-                                arguments=tool_call.function.arguments
-                            )
-                        ) for tool_call in message.tool_calls if validate_function_call(tool_call, generation_config)
-                    ]
-                    if tool_calls == []:
-                        continue
-                    content = Content(
-                        tool_calls=tool_calls
-                    )
-                else:
-                    content = Content(
-                        text=message.content,
-                    )
-
-                if output_model and content.text != None:
-                    try:
-                        output_model.model_validate_json(content.text)
-                        _messages.append(
-                            Message(
-                                role='assistant',
-                                content=content,
-                            )
-                        )
-                    except:
-                        pass
-                else:
-                    _messages.append(
-                        Message(
-                            role='assistant',
-                            content=content,
-                        )
-                    )
+            _messages += parse_openai_messages(generated_messages, generation_config, output_model)
 
             if len(_messages) >= generation_config.n_candidates:
                 _messages = _messages[:generation_config.n_candidates]
@@ -364,4 +370,135 @@ class OAIClient():
         if reduce_function:
             return reduce_function(_messages)
         else:
-            return _messages
\ No newline at end of file
+            return _messages
+
+    async def a_generate_stream(
+        self,
+        messages: List[Message],
+        generation_config: GenerationConfig,
+        output_model:BaseModel = None
+    ) -> AsyncIterator[Union[str, Message, StreamRejected]]:
+        """
+        Stream a single candidate: yields the text deltas as they arrive, then the assembled message.
+        A candidate whose tool calls or output fail validation is followed by a StreamRejected instead,
+        and the request is retried like the non streaming path, up to max_retries times.
+        """
+        # call the openai api
+        messages, kw_args = openai_request(messages, generation_config, output_model)
+        kw_args['n'] = 1
+
+        with span('openai.transform', messages=len(messages)) as transform_span:
+            openai_messages = transform_messages_openai(messages)
+            if transform_span.recording:
+                transform_span.set(request_bytes=len(json.dumps(openai_messages)))
+
+        for num_retry in range(generation_config.max_retries):
+            accepted = False
+            candidate = self._a_stream_candidate(openai_messages, kw_args, generation_config, output_model, num_retry)
+            try:
+                async for item in candidate:
+                    accepted = isinstance(item, Message)
+                    yield item
+            finally:
+                # closed with the stream when the consumer stops early
+                await candidate.aclose()
+            if accepted:
+                return
+
+    async def _a_stream_candidate(
+        self,
+        openai_messages: List[Dict],
+        kw_args: Dict,
+        generation_config: GenerationConfig,
+        output_model:BaseModel,
+        num_retry:int,
+    ) -> AsyncIterator[Union[str, Message, StreamRejected]]:
+        """
+        One streaming request: the text deltas, then the assembled message or a StreamRejected.
+        """
+        text:List[str] = []
+        tool_calls:List[ToolCall] = []
+        # fragments of the tool call being streamed, keyed by the index of the tool call
+        fragments:Dict[int, Dict[str, str]] = {}
+
+        def assemble(index:int):
+            fragment = fragments.pop(index)
+            tool_call = ChatCompletionMessageToolCall(
+                id=fragment['id'],
+                type='function',
+                function=OpenAIFunction(name=fragment['name'], arguments=fragment['arguments']),
+            )
+            if validate_function_call(tool_call, generation_config):
+                tool_calls.append(
+                    ToolCall(
+                        id=tool_call.id,
+                        type=tool_call.type,
+                        function_call=FunctionCall(
+                            name=tool_call.function.name.lower(),
+                            arguments=tool_call.function.arguments
+                        )
+                    )
+                )
+
+        # spans the whole stream, time_to_first_token_ms is the latency the caller perceives
+        # not entered as the current span: it stays open across the yields, in the context of the consumer
+        stream_span = span('openai.stream', model=kw_args.get('model'), retried=num_retry > 0).begin()
+        try:
+            stream:AsyncIterator[ChatCompletionChunk] = await self.a_client.chat.completions.create(
+                messages=openai_messages,
+                stream=True,
+                **kw_args
+            )
+
+            async for chunk in stream:
+                # azure sends chunks without choices, e.g. for content filtering results
+                if len(chunk.choices) == 0:
+                    continue
+                delta = chunk.choices[0].delta
+
+                if delta.content:
+                    if len(text) == 0 and stream_span.recording:
+                        stream_span.set(time_to_first_token_ms=(time.perf_counter() - stream_span.start) * 1000)
+                    text.append(delta.content)
+                    yield delta.content
+
+                for fragment in delta.tool_calls or []:
+                    # a new index means the previous tool calls are complete
+                    for index in [index for index in fragments.keys() if index < fragment.index]:
+                        assemble(index)
+                    current = fragments.setdefault(fragment.index, {'id': '', 'name': '', 'arguments': ''})
+                    if fragment.id:
+                        current['id'] = fragment.id
+                    if fragment.function != None:
+                        current['name'] += fragment.function.name or ''
+                        current['arguments'] += fragment.function.arguments or ''
+        except BaseException as e:
+            # including GeneratorExit when the consumer closes the stream early
+            stream_span.end(e)
+            raise
+        stream_span.end()
+
+        streamed_tool_calls = len(fragments) > 0 or len(tool_calls) > 0
+        for index in sorted(fragments.keys()):
+            assemble(index)
+
+        if streamed_tool_calls:
+            # same as the non streaming path, drop the candidate if none of the tool calls are valid
+            if len(tool_calls) == 0:
+                yield StreamRejected(attempt=num_retry + 1, reason='none of the tool calls are valid')
+                return
+            content = Content(tool_calls=tool_calls)
+        else:
+            content = Content(text=''.join(text))
+
+        if output_model and content.text != None:
+            try:
+                output_model.model_validate_json(content.text)
+            except:
+                yield StreamRejected(attempt=num_retry + 1, reason=f'the output does not parse as {output_model.__name__}')
+                return
+
+        yield Message(
+            role='assistant',
+            content=content,
+        )
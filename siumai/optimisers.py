@@ -1,7 +1,9 @@
 import asyncio
 import random
 import copy
+import time
 from siumai.agent import Agent
+from siumai.ratelimit import RateLimiter, is_rate_limit_error, retry_after
 from siumai.schema import Message, Content, GenerationConfig
 from siumai.saved_agents import GradientAgent, BackpropAgent
 from typing import Awaitable, Dict, List, Tuple, Callable, Union, Any, TypeVar
@@ -46,6 +48,9 @@ class TextualGradientPromptTrainer():
         n_sample: int = 10,
         budget: int = 50,
         concurrency: int = 5,
+        rate_limiter: Union[RateLimiter, None] = None,
+        tokens_per_request: int = 0,
+        max_rate_limit_retries: int = 5,
     ):
         """
         Apply textual gradient descent to optimise the system prompt of an Agent or the description of a Tool
@@ -71,6 +76,12 @@ class TextualGradientPromptTrainer():
         :type budget: int
         :param concurrency: The maximum number of concurrent call for forward(). Default is 5.
         :type concurrency: int
+        :param rate_limiter: The requests and tokens per minute allowed to forward(), e.g. shared with other trainers. Default is no limit, with a backoff on rate limit errors.
+        :type rate_limiter: Union[RateLimiter, None]
+        :param tokens_per_request: The estimated number of tokens of a forward() call, counted against the tokens per minute. Default is 0.
+        :type tokens_per_request: int
+        :param max_rate_limit_retries: The number of times a forward() call failing with a rate limit error is retried. Default is 5.
+        :type max_rate_limit_retries: int
         """
         self.agent = agent
         self.forward = forward
@@ -81,6 +92,13 @@ class TextualGradientPromptTrainer():
         self.n_sample = n_sample
         self.budget = budget
         self.concurrency = concurrency
+        self.rate_limiter = rate_limiter if rate_limiter != None else RateLimiter()
+        self.tokens_per_request = tokens_per_request
+        self.max_rate_limit_retries = max_rate_limit_retries
+        # achieved throughput of forward(), see throughput()
+        self.forward_calls = 0
+        self.forward_seconds = 0.0
+        self.rate_limited = 0
         self.gradient_agent = GradientAgent(generation_config=generation_config)
         self.backprop_agent = BackpropAgent(generation_config=generation_config, num_prompts=n_sample)
     
@@ -145,19 +163,41 @@ class TextualGradientPromptTrainer():
         agent:Agent,
         x:List[InputType],
     ) -> List[PredictType]:
-        # forward in batches with concurrency
-        
-        predict:List[PredictType] = []
-        # generate responses for each data point
-        for index in range(0, len(x), self.concurrency):
-            batch = await asyncio.gather(*[
-                self.forward(agent, x[i]) for i in range(index, min(index+self.concurrency, len(x)))
-            ])
-            predict.extend(batch)
-            # avoid rate limiting error
-            await asyncio.sleep(5)
-        
-        return predict
+        # a continuous pipeline: a call starts as soon as another one ends, within the concurrency and the rate limits
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(input:InputType) -> PredictType:
+            async with semaphore:
+                for attempt in range(self.max_rate_limit_retries + 1):
+                    await self.rate_limiter.acquire(self.tokens_per_request)
+                    try:
+                        result = await self.forward(agent, input)
+                    except Exception as e:
+                        if not is_rate_limit_error(e) or attempt == self.max_rate_limit_retries:
+                            raise
+                        self.rate_limited += 1
+                        self.rate_limiter.backoff(retry_after(e))
+                        continue
+                    self.rate_limiter.success()
+                    self.forward_calls += 1
+                    return result
+
+        start = time.perf_counter()
+        try:
+            return await asyncio.gather(*[run(input) for input in x])
+        finally:
+            self.forward_seconds += time.perf_counter() - start
+
+    def throughput(self) -> Dict[str, float]:
+        """
+        The forward() calls completed, the rate limit errors, the seconds spent forwarding and the calls per second.
+        """
+        return {
+            'forward_calls': self.forward_calls,
+            'rate_limited': self.rate_limited,
+            'seconds': self.forward_seconds,
+            'calls_per_second': self.forward_calls / self.forward_seconds if self.forward_seconds > 0 else 0.0,
+        }
 
 
     async def expand(
@@ -250,7 +290,8 @@ class TextualGradientPromptTrainer():
                 prompts = [self.agent.generation_config.tools[self.target].description]
 
         scores_log = []
-        for i in tqdm(range(n_training_steps), desc='Training Step'):
+        progress = tqdm(range(n_training_steps), desc='Training Step')
+        for i in progress:
             i = i % (len(x) // self.batch_size)
             # sample a mini batch of data
             batch_x = x[i*self.batch_size:(i+1)*self.batch_size]
@@ -263,6 +304,8 @@ class TextualGradientPromptTrainer():
             prompts_remained, scores = await self.select(expanded_prompts, x=x, y=y)
             scores_log.append(scores)
             prompts = prompts_remained
+            throughput = self.throughput()
+            progress.set_postfix(calls_per_second=round(throughput['calls_per_second'], 2), rate_limited=throughput['rate_limited'])
 
         return prompts, scores_log
     
\ No newline at end of file
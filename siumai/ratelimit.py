@@ -0,0 +1,139 @@
+import asyncio
+import time
+from typing import Any, Union
+
+
+class TokenBucket():
+    """
+    Token bucket refilled at a constant rate, which callers may overdraw: a caller takes its tokens at once
+    and waits until the bucket is back to zero, so concurrent callers are spaced out in the order they came.
+
+    Attributes:
+        rate (float): The tokens added per second.
+        capacity (float): The maximum number of tokens, i.e. the largest burst.
+    """
+
+    def __init__(self, rate:float, capacity:float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, amount:float, rate:Union[float, None]=None) -> float:
+        """
+        Take the tokens and return the seconds to wait before using them.
+
+        :param rate: The rate to refill the bucket at until now, e.g. lowered after rate limit errors. Defaults to rate.
+        """
+        now = time.monotonic()
+        rate = rate if rate != None else self.rate
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        self.tokens -= amount
+        return -self.tokens / rate if self.tokens < 0 else 0.0
+
+
+class RateLimiter():
+    """
+    Client-side limit of the requests and tokens per minute sent to a provider, shared by concurrent asyncio tasks,
+    with an adaptive backoff when the provider answers 429 anyway.
+
+    A rate limit error pauses every caller, for the Retry-After of the provider or for an exponential delay,
+    and halves the rates. Every success then raises them back by a tenth of the configured rates.
+    Without limits, the limiter only applies the backoff.
+
+    Attributes:
+        requests_per_minute (Optional[float]): The maximum number of requests per minute. Defaults to None, i.e. no limit.
+        tokens_per_minute (Optional[float]): The maximum number of tokens per minute. Defaults to None, i.e. no limit.
+        burst (float): The seconds of quota that can be spent at once. Defaults to 1, i.e. the requests of one second at most.
+        min_backoff (float): The pause after the first rate limit error in seconds. Defaults to 1.
+        max_backoff (float): The longest pause in seconds. Defaults to 60.
+        rate_limited (int): The number of rate limit errors reported.
+
+    Example:
+        limiter = RateLimiter(requests_per_minute=500, tokens_per_minute=90000)
+        await limiter.acquire(tokens=1200)
+    """
+
+    def __init__(
+        self,
+        requests_per_minute:Union[float, None]=None,
+        tokens_per_minute:Union[float, None]=None,
+        burst:float=1,
+        min_backoff:float=1,
+        max_backoff:float=60,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.burst = burst
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.rate_limited = 0
+        self._requests = TokenBucket(requests_per_minute / 60, requests_per_minute / 60 * burst) if requests_per_minute != None else None
+        self._tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute / 60 * burst) if tokens_per_minute != None else None
+        # share of the configured rates currently allowed, lowered by rate limit errors
+        self._factor = 1.0
+        self._consecutive = 0
+        self._paused_until = 0.0
+
+    async def acquire(self, tokens:float=0):
+        """
+        Wait until a request of that many tokens can be sent.
+        """
+        await self._wait_pause()
+        wait = 0.0
+        if self._requests != None:
+            wait = self._requests.take(1, self._requests.rate * self._factor)
+        if self._tokens != None and tokens > 0:
+            wait = max(wait, self._tokens.take(tokens, self._tokens.rate * self._factor))
+        if wait > 0:
+            await asyncio.sleep(wait)
+            # a rate limit error may have been reported in the meantime
+            await self._wait_pause()
+
+    async def _wait_pause(self):
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause <= 0:
+                return
+            await asyncio.sleep(pause)
+
+    def success(self):
+        self._consecutive = 0
+        self._factor = min(1.0, self._factor + 0.1)
+
+    def backoff(self, retry_after:Union[float, None]=None) -> float:
+        """
+        Report a rate limit error. Returns the pause applied to every caller in seconds.
+        """
+        self.rate_limited += 1
+        delay = retry_after if retry_after != None else min(self.max_backoff, self.min_backoff * 2 ** self._consecutive)
+        self._consecutive += 1
+        self._factor = max(0.05, self._factor / 2)
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+
+def is_rate_limit_error(error:Exception) -> bool:
+    """
+    Whether the exception of a provider SDK is a rate limit error: HTTP 429 for OpenAI and Vertex AI, throttling for Bedrock.
+    """
+    if getattr(error, 'status_code', None) == 429 or getattr(error, 'code', None) == 429:
+        return True
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code') in ('ThrottlingException', 'TooManyRequestsException')
+    return getattr(response, 'status_code', None) == 429
+
+
+def retry_after(error:Exception) -> Union[float, None]:
+    """
+    The seconds to wait given by the Retry-After header of the error response, if any.
+    """
+    headers:Any = getattr(getattr(error, 'response', None), 'headers', None)
+    if headers == None:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
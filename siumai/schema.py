@@ -1,5 +1,33 @@
-from pydantic import BaseModel, HttpUrl, FilePath
-from typing import Dict, List, Optional, Union, Literal, Any
+from hashlib import blake2b
+import json
+from pydantic import BaseModel, HttpUrl, FilePath, PrivateAttr
+from typing import Callable, Dict, List, Optional, Tuple, Union, Literal, Any, TypeVar
+
+MemoType = TypeVar('MemoType')
+
+def canonical_json(value) -> str:
+    '''
+    Serialise a value into a stable JSON string: sorted keys and no insignificant whitespace.
+    '''
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+
+class VersionedModel(BaseModel):
+    '''
+    Base model that counts the assignments to its fields, so that values derived from it can be cached.
+    Only assignments are tracked: replace a field rather than mutating a nested object in place.
+    '''
+    _version: int = PrivateAttr(default=0)
+
+    def __setattr__(self, name:str, value:Any):
+        super().__setattr__(name, value)
+        if name in type(self).model_fields:
+            self._version += 1
+
+    # private attributes hold bookkeeping only, they are not part of the value
+    def __eq__(self, other:Any) -> bool:
+        if not isinstance(other, BaseModel):
+            return NotImplemented
+        return type(self) is type(other) and self.__dict__ == other.__dict__
 
 class OpenAPIFunctionSchema(BaseModel):
     type: Optional[str] = None
@@ -38,21 +66,70 @@ class ToolResponse(BaseModel):
     name:str
     content:str
 
-class Content(BaseModel):
+class Content(VersionedModel):
     text: Optional[str] = None
     files: Optional[List[File]] = None
     urls: Optional[List[HttpUrl]] = None
     tool_calls: Optional[List[ToolCall]] = None
     tool_response: Optional[ToolResponse] = None
 
-class Message(BaseModel):
+class Message(VersionedModel):
     role: str
     content: Content
     name:Optional[str] = None
 
-    # use for comparing if two messages are the same, exclude ID
+    _memo: Dict[str, Tuple[Tuple[int, ...], Any]] = PrivateAttr(default_factory=dict)
+
+    def memoize(self, key:str, factory:Callable[['Message'], MemoType]) -> MemoType:
+        '''
+        Return factory(self), computed once and reused until the message or its content is reassigned.
+        Copies of the message, e.g. from model_copy, never reuse the cached value of the original.
+        '''
+        # private attributes are read from __pydantic_private__, the attribute lookup of pydantic is several times slower
+        private = self.__pydantic_private__
+        content = self.content
+        stamp = (id(self), private['_version'], id(content), content.__pydantic_private__['_version'])
+        entry = private['_memo'].get(key)
+        if entry == None or entry[0] != stamp:
+            entry = (stamp, factory(self))
+            # rebind rather than update, copies of the message share the dictionary
+            self._memo = {**private['_memo'], key: entry}
+        return entry[1]
+
+    @property
+    def digest(self) -> bytes:
+        '''
+        Content address of the message: 16-byte blake2b of its canonical JSON, the same in every process.
+        Computed once per version of the message, see memoize.
+        '''
+        return self.memoize(
+            'digest',
+            lambda message: blake2b(canonical_json(message.model_dump(mode='json')).encode('utf-8'), digest_size=16).digest(),
+        )
+
+    @property
+    def digest_id(self) -> str:
+        '''
+        The digest as a hexadecimal string, e.g. to key messages in JSON.
+        '''
+        return self.digest.hex()
+
+    # use for comparing if two messages are the same, without serialising the message again
     def __hash__(self):
-        return hash(self.model_dump_json(exclude='id'))
+        return hash(self.digest)
+
+class StreamRejected(BaseModel):
+    """
+    Yielded by a stream when the candidate streamed so far fails validation, e.g. invalid tool calls or an output
+    that does not parse: the text deltas since the previous message or rejection are void. The request is then retried
+    up to max_retries times, so a stream ending with a StreamRejected instead of a Message failed.
+
+    Attributes:
+        attempt (int): The number of the rejected attempt, from 1.
+        reason (str): Why the candidate was rejected.
+    """
+    attempt: int
+    reason: str
 
 class GenerationConfig(BaseModel):
     """
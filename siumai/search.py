@@ -0,0 +1,579 @@
+from abc import ABC, abstractmethod
+from hashlib import blake2b
+import heapq
+import itertools
+import json
+import os
+from typing import Any, Callable, Dict, Iterator, List, Literal, Tuple, Union
+from siumai.schema import Message, canonical_json
+
+StateKey = Tuple[bytes, ...]
+
+
+def state_key(messages:List[Message]) -> StateKey:
+    """
+    The key of a search state, i.e. of the messages generated by one expansion: the digests of the messages, see Message.digest.
+    """
+    return tuple([message.digest for message in messages])
+
+
+class Node():
+    """
+    A state of the search tree. Only the messages generated by the expansion are stored,
+    the conversation leading to the node is rebuilt on demand by following the parent pointers.
+
+    Attributes:
+        key (StateKey): The key of the state, see state_key.
+        messages (Tuple[Message, ...]): The messages generated by the expansion that created the node.
+        parent (Optional[Node]): The node that was expanded, None for the root.
+        cost (float): The cost from the root to the node.
+        heuristic (float): The heuristic score of the node.
+        priority (float): cost + heuristic, the frontier pops the lowest first.
+        depth (int): The number of expansions from the root.
+        stale (bool): Set when a cheaper path to the same state is found, the frontier then skips the node.
+        conversation_key (Optional[str]): The rolling hash of the conversation up to the node, set when a heuristic cache is used.
+        size (int): The approximate size in bytes of the messages of the node, counted when the frontier has a byte limit.
+        queued (bool): Whether the node is waiting in the frontier.
+        number (Optional[int]): The position of the node in the checkpoint of the search, set when the search is checkpointed.
+    """
+    __slots__ = ('key', 'messages', 'parent', 'cost', 'heuristic', 'priority', 'depth', 'stale', 'conversation_key', 'size', 'queued', 'number')
+
+    def __init__(
+        self,
+        key:StateKey,
+        messages:Tuple[Message, ...],
+        parent:Union['Node', None]=None,
+        cost:float=0,
+        heuristic:float=0,
+    ):
+        self.key = key
+        self.messages = messages
+        self.parent = parent
+        self.cost = cost
+        self.heuristic = heuristic
+        self.priority = cost + heuristic
+        self.depth = parent.depth + 1 if parent != None else 0
+        self.stale = False
+        self.conversation_key:Union[str, None] = None
+        self.size = 0
+        self.queued = False
+        self.number:Union[int, None] = None
+
+    def lineage(self) -> Iterator['Node']:
+        """
+        The nodes from this one up to the root.
+        """
+        node = self
+        while node != None:
+            yield node
+            node = node.parent
+
+    def path(self) -> List[Message]:
+        """
+        The conversation from the root to this node.
+        """
+        chunks = [node.messages for node in self.lineage()]
+        return [message for chunk in reversed(chunks) for message in chunk]
+
+
+class Canonicaliser():
+    """
+    State keys that ignore the differences between messages which do not change the conversation,
+    so that astar_chat merges equivalent branches into one state and expands it once.
+
+    The canonical form of a message is computed once per version of the message, see Message.memoize.
+
+    Attributes:
+        tool_call_ids (bool): Ignore the IDs of the tool calls and tool responses, which the providers generate at random. Defaults to True.
+        whitespace (bool): Strip the texts and collapse their runs of whitespace. Defaults to True.
+        argument_order (bool): Compare the JSON arguments of the tool calls and the JSON tool responses by value,
+            i.e. regardless of the order of their keys and of their formatting. Defaults to True.
+        name (bool): Ignore the name of the messages. Defaults to True.
+    """
+
+    def __init__(self, tool_call_ids:bool=True, whitespace:bool=True, argument_order:bool=True, name:bool=True):
+        self.tool_call_ids = tool_call_ids
+        self.whitespace = whitespace
+        self.argument_order = argument_order
+        self.name = name
+        # memo key, canonicalisers with the same options share the cached digests
+        self._memo_key = f'canonical:{int(tool_call_ids)}{int(whitespace)}{int(argument_order)}{int(name)}'
+
+    def _json(self, value:str) -> str:
+        if self.argument_order:
+            try:
+                return canonical_json(json.loads(value))
+            except ValueError:
+                pass
+        return ' '.join(value.split()) if self.whitespace else value
+
+    def canonical(self, message:Message) -> Dict[str, Any]:
+        """
+        The canonical form of the message, as a JSON-compatible dictionary.
+        """
+        data = message.model_dump(mode='json', exclude_none=True)
+        if self.name:
+            data.pop('name', None)
+        content = data['content']
+        if self.whitespace and 'text' in content:
+            content['text'] = ' '.join(content['text'].split())
+        for tool_call in content.get('tool_calls', []):
+            if self.tool_call_ids:
+                tool_call.pop('id', None)
+            tool_call['function_call']['arguments'] = self._json(tool_call['function_call']['arguments'])
+        tool_response = content.get('tool_response')
+        if tool_response != None:
+            if self.tool_call_ids:
+                tool_response.pop('id', None)
+            tool_response['content'] = self._json(tool_response['content'])
+        return data
+
+    def digest(self, message:Message) -> bytes:
+        return message.memoize(
+            self._memo_key,
+            lambda message: blake2b(canonical_json(self.canonical(message)).encode('utf-8'), digest_size=16).digest(),
+        )
+
+    def __call__(self, messages:List[Message]) -> StateKey:
+        """
+        The key of the state of the messages, like state_key.
+        """
+        return tuple([self.digest(message) for message in messages])
+
+
+def message_size(message:Message) -> int:
+    """
+    The approximate memory held by a message: the length of its JSON, computed once per version of the message.
+    """
+    return message.memoize('size', lambda message: len(message.model_dump_json()))
+
+
+class Frontier():
+    """
+    Priority queue of the nodes to expand, on top of heapq.
+
+    Ties are broken by insertion order, so that a search is deterministic.
+    A node superseded by a cheaper path is not removed from the heap, it is discarded and skipped when popped.
+
+    With max_size or max_bytes, prune drops the nodes with the worst priority until the queued nodes fit,
+    i.e. a beam search. The size of a node is the size of its own messages, see message_size.
+
+    Attributes:
+        max_size (Optional[int]): The maximum number of queued nodes. Defaults to None, i.e. no limit.
+        max_bytes (Optional[int]): The maximum size of the messages of the queued nodes. Defaults to None, i.e. no limit.
+        bytes (int): The size of the messages of the queued nodes, counted when max_bytes is set.
+        stale (int): The number of discarded entries dropped from the heap.
+    """
+
+    def __init__(self, max_size:Union[int, None]=None, max_bytes:Union[int, None]=None):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.stale = 0
+        self._heap:List[Tuple[float, int, Node]] = []
+        self._counter = itertools.count()
+        self._queued = 0
+
+    def push(self, node:Node):
+        if self.max_bytes != None:
+            node.size = sum(message_size(message) for message in node.messages)
+            self.bytes += node.size
+        node.queued = True
+        self._queued += 1
+        heapq.heappush(self._heap, (node.priority, next(self._counter), node))
+
+    def discard(self, node:Node):
+        """
+        Mark a queued node as superseded, it is skipped when popped. Nodes that are not queued are left untouched.
+        """
+        if node.queued:
+            node.stale = True
+            node.queued = False
+            self._queued -= 1
+            self.bytes -= node.size
+
+    def pop(self) -> Union[Node, None]:
+        """
+        Pop the node with the lowest priority, None when the frontier is empty.
+        """
+        while len(self._heap) > 0:
+            node = heapq.heappop(self._heap)[2]
+            if node.stale:
+                self.stale += 1
+                continue
+            node.queued = False
+            self._queued -= 1
+            self.bytes -= node.size
+            return node
+        return None
+
+    def prune(self) -> List[Node]:
+        """
+        Drop the worst nodes until the frontier fits max_size and max_bytes. Returns the dropped nodes, worst last.
+        """
+        over_size = self.max_size != None and self._queued > self.max_size
+        over_bytes = self.max_bytes != None and self.bytes > self.max_bytes
+        if not over_size and not over_bytes:
+            return []
+
+        queued = sorted(entry for entry in self._heap if not entry[2].stale)
+        self.stale += len(self._heap) - len(queued)
+        keep = len(queued) if self.max_size == None else min(len(queued), self.max_size)
+        size = sum(entry[2].size for entry in queued[:keep])
+        while self.max_bytes != None and keep > 0 and size > self.max_bytes:
+            keep -= 1
+            size -= queued[keep][2].size
+
+        pruned = [entry[2] for entry in queued[keep:]]
+        for node in pruned:
+            node.stale = True
+            node.queued = False
+        # a sorted list is a heap
+        self._heap = queued[:keep]
+        self._queued = keep
+        self.bytes = size
+        return pruned
+
+    def __len__(self) -> int:
+        return self._queued
+
+
+class SearchStats():
+    """
+    Counters of a search. Pass an instance to the search to read them once it returns.
+
+    Attributes:
+        iterations (int): The number of iterations run.
+        expanded (int): The number of nodes expanded.
+        generated (int): The number of responses generated by the agents.
+        pushed (int): The number of nodes pushed to the frontier.
+        duplicates (int): The number of responses reaching a known state without improving its cost.
+        stale (int): The number of superseded frontier entries skipped.
+        max_frontier_size (int): The largest number of queued nodes.
+        pruned (int): The number of nodes dropped from the frontier to fit its size or memory limit.
+        transpositions (int): The number of duplicates whose messages differ from the known state only by the canonicalisation,
+            i.e. the expansions saved by the canonicaliser.
+        heuristic_calls (int): The number of calls of the heuristic.
+        heuristic_cache_hits (int): The number of heuristic scores served by the heuristic cache.
+    """
+
+    def __init__(self):
+        self.iterations = 0
+        self.expanded = 0
+        self.generated = 0
+        self.pushed = 0
+        self.duplicates = 0
+        self.stale = 0
+        self.max_frontier_size = 0
+        self.pruned = 0
+        self.transpositions = 0
+        self.heuristic_calls = 0
+        self.heuristic_cache_hits = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+    def __repr__(self) -> str:
+        return f'SearchStats({", ".join(f"{key}={value}" for key, value in vars(self).items())})'
+
+
+def accept_children(
+    children:List[Tuple[Node, List[Message], List[Message]]],
+    costs:List[float],
+    key_function:Callable[[List[Message]], StateKey],
+    cost_so_far:Dict[StateKey, float],
+    hash_map:Dict[StateKey, Tuple[Message]],
+    stats:SearchStats,
+    count_transpositions:bool=False,
+) -> Dict[StateKey, Tuple[Node, List[Message], List[Message], float]]:
+    """
+    The children of one iteration worth scoring: the cheapest child of every state that improves on the known cost,
+    keyed by state in the order the states first appear, as (parent, parent path, messages, cost).
+    The other children are counted as duplicates, and as transpositions when count_transpositions is set
+    and their messages differ from the ones kept, i.e. when a canonicaliser merged them.
+
+    :param children: The (parent, parent path, messages) of the iteration, in a deterministic order
+    :param costs: The cost of the messages of every child
+    """
+    accepted: Dict[StateKey, Tuple[Node, List[Message], List[Message], float]] = {}
+    for (node, current_messages, next), child_cost in zip(children, costs):
+        new_cost:float = node.cost + child_cost
+        key = key_function(next)
+        previous_cost = accepted[key][3] if key in accepted else cost_so_far.get(key, None)
+        # skip the state if it was seen before at a lower or equal cost
+        if previous_cost != None and new_cost >= previous_cost:
+            stats.duplicates += 1
+            if count_transpositions:
+                known = accepted[key][2] if key in accepted else hash_map[key]
+                if state_key(next) != state_key(known):
+                    stats.transpositions += 1
+            continue
+        accepted[key] = (node, current_messages, next, new_cost)
+    return accepted
+
+
+class IncrementalHeuristic(ABC):
+    """
+    Stateful heuristic fed with the appended messages only, so that scoring a turn does not read the whole conversation again.
+
+    Subclass it and implement initial_state and update, either can be a coroutine function.
+    group_chat detects the subclasses, any other callable is called with the whole conversation as before.
+
+    Example:
+        class ToolResponseCount(IncrementalHeuristic):
+            def initial_state(self, messages):
+                return 0
+
+            def update(self, state, messages):
+                state += sum(1 for message in messages if message.content.tool_response != None)
+                return state, 3 - state
+    """
+
+    @abstractmethod
+    def initial_state(self, messages:List[Message]) -> Any:
+        """
+        The state of the conversation at the start of the chat.
+        """
+
+    @abstractmethod
+    def update(self, state:Any, messages:List[Message]) -> Tuple[Any, Union[float, None]]:
+        """
+        The state once the messages are appended, and the heuristic score of the conversation, None for no score.
+        The state given must not be modified.
+        """
+
+
+class GroupChatStats():
+    """
+    Counters of a group chat. Pass an instance to the chat to read them once it returns.
+
+    Attributes:
+        turns (int): The number of responses added to the conversation.
+        calls (int): The number of agent calls started.
+        extra_calls (int): The number of calls whose response was discarded: missed speculations,
+            and responses of a broadcast round following the goal.
+        speculative_hits (int): The number of speculative calls whose predicted conversation was right.
+        speculative_misses (int): The number of speculative calls cancelled because the prediction was wrong.
+        latency_saved (float): The seconds of agent calls overlapped with other calls, compared with taking turns.
+    """
+
+    def __init__(self):
+        self.turns = 0
+        self.calls = 0
+        self.extra_calls = 0
+        self.speculative_hits = 0
+        self.speculative_misses = 0
+        self.latency_saved = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+    def __repr__(self) -> str:
+        return f'GroupChatStats({", ".join(f"{key}={value}" for key, value in vars(self).items())})'
+
+
+EventType = Literal['node_expanded', 'child_scored', 'new_best', 'goal_reached', 'agent_turn', 'finished']
+
+
+class SearchEvent():
+    """
+    Progress of a search, yielded by astar_chat_stream and group_chat_stream.
+
+    The events hold the node rather than its conversation, call path() to materialise it only when needed.
+
+    Attributes:
+        type (EventType): What happened:
+            node_expanded: the node was popped and the agents are about to answer it.
+            child_scored: the node was generated, scored and pushed to the frontier.
+            new_best: the node has the lowest heuristic score so far.
+            goal_reached: the heuristic score of the node is below the threshold, the search stops.
+            agent_turn: an agent of a group chat answered, its messages and their score are set.
+            finished: the search returned, the result is set.
+        iteration (int): The iteration of the search.
+        node (Optional[Node]): The node of the event, None in a group chat.
+        score (Optional[float]): The heuristic score of the node or of the agent turn.
+        agent (Optional[str]): The name of the agent of an agent turn.
+        messages (Optional[List[Message]]): The messages of an agent turn.
+        result (Any): The return value of the search, set on the finished event.
+    """
+    __slots__ = ('type', 'iteration', 'node', 'score', 'agent', 'messages', 'result')
+
+    def __init__(
+        self,
+        type:EventType,
+        iteration:int,
+        node:Union[Node, None]=None,
+        score:Union[float, None]=None,
+        agent:Union[str, None]=None,
+        messages:Union[List[Message], None]=None,
+        result:Any=None,
+    ):
+        self.type = type
+        self.iteration = iteration
+        self.node = node
+        self.score = score
+        self.agent = agent
+        self.messages = messages
+        self.result = result
+
+    def path(self) -> List[Message]:
+        """
+        The conversation up to the node, or the messages of the agent turn.
+        """
+        if self.node != None:
+            return self.node.path()
+        return list(self.messages) if self.messages != None else []
+
+    def __repr__(self) -> str:
+        return f'SearchEvent(type={self.type!r}, iteration={self.iteration}, score={self.score}, agent={self.agent!r})'
+
+
+class SearchState():
+    """
+    A search restored from a checkpoint, see SearchCheckpoint.load.
+
+    Attributes:
+        root (Node): The node of the initial messages.
+        nodes (Dict[StateKey, Node]): The node holding the cheapest known path to each state, pruned states excluded.
+        queued (List[Node]): The nodes waiting in the frontier, in the order they were pushed.
+        goal (Optional[Node]): The node that reached the threshold, if the search had finished.
+        stats (Dict[str, Any]): The counters of the search, see SearchStats.as_dict.
+    """
+
+    def __init__(self, root:Node, nodes:Dict[StateKey, Node], queued:List[Node], goal:Union[Node, None], stats:Dict[str, Any]):
+        self.root = root
+        self.nodes = nodes
+        self.queued = queued
+        self.goal = goal
+        self.stats = stats
+
+
+class SearchCheckpoint():
+    """
+    Append-only JSONL log of a search, from which the search can be resumed after a crash.
+
+    Every node is written once, when it is pushed, with its own messages and the number of its parent,
+    the nodes being numbered in the order they are written. The conversations are never written twice.
+    Each iteration then writes the numbers of the expanded and pruned nodes and the stats.
+    The records are buffered and appended every `every` iterations. On load, the records following
+    the last complete iteration, e.g. a line cut by a crash, are ignored, so a resumed search repeats that iteration at most.
+
+    Attributes:
+        path (str): The JSONL file.
+        every (int): The number of iterations between two writes. Defaults to 1, i.e. after every iteration.
+    """
+
+    def __init__(self, path:str, every:int=1):
+        self.path = path
+        self.every = every
+        self._count = 0
+        self._buffer:List[str] = []
+        self._iterations = 0
+        # the size of the file up to the last complete iteration
+        self._size = 0
+
+    def start(self, resume:bool=False):
+        """
+        Start writing a search: a fresh search drops the whole file and numbers its nodes from 0,
+        a resumed one drops the records following the last complete iteration found by load.
+        """
+        if not resume:
+            self._count = 0
+            self._size = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(self._size)
+        self._buffer = []
+        self._iterations = 0
+
+    def add_node(self, node:Node):
+        node.number = self._count
+        self._count += 1
+        self._buffer.append(json.dumps({
+            'type': 'node',
+            'parent': node.parent.number if node.parent != None else None,
+            'messages': [message.model_dump(mode='json', exclude_none=True) for message in node.messages],
+            'cost': node.cost,
+            'heuristic': node.heuristic,
+            'conversation_key': node.conversation_key,
+        }, separators=(',', ':')) + '\n')
+
+    def end_iteration(self, expanded:List[Node], pruned:List[Node], stats:SearchStats, goal:Union[Node, None]=None):
+        self._buffer.append(json.dumps({
+            'type': 'iteration',
+            'expanded': [node.number for node in expanded],
+            'pruned': [node.number for node in pruned],
+            'goal': goal.number if goal != None else None,
+            'stats': stats.as_dict(),
+        }, separators=(',', ':')) + '\n')
+        self._iterations += 1
+        if self._iterations >= self.every or goal != None:
+            self.flush()
+
+    def flush(self):
+        """
+        Append the buffered records to the file, up to the last complete iteration.
+        """
+        if len(self._buffer) == 0:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(self._buffer))
+            f.flush()
+            os.fsync(f.fileno())
+        self._buffer = []
+        self._iterations = 0
+
+    def load(self, key:Callable[[List[Message]], StateKey]=state_key) -> Union[SearchState, None]:
+        """
+        Replay the file. Returns None when it holds no complete iteration.
+
+        :param key: The state key function of the search, e.g. a Canonicaliser
+        """
+        self._count = 0
+        self._size = 0
+        if not os.path.exists(self.path):
+            return None
+
+        records:List[Node] = []
+        pending:List[Node] = []
+        nodes:Dict[StateKey, Node] = {}
+        expanded = set()
+        goal:Union[Node, None] = None
+        stats:Dict[str, Any] = {}
+        with open(self.path, 'rb') as f:
+            offset = 0
+            for line in f:
+                offset += len(line)
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record['type'] == 'node':
+                    messages = tuple(Message.model_validate(message) for message in record['messages'])
+                    parent = records[record['parent']] if record['parent'] != None else None
+                    node = Node(key=key(messages), messages=messages, parent=parent, cost=record['cost'], heuristic=record['heuristic'])
+                    node.conversation_key = record['conversation_key']
+                    node.number = len(records)
+                    records.append(node)
+                    pending.append(node)
+                    continue
+                # the nodes of an iteration are kept once the iteration is complete, later ones replace earlier paths to the same state
+                for node in pending:
+                    nodes[node.key] = node
+                pending = []
+                expanded.update(record['expanded'])
+                for number in record['pruned']:
+                    node = records[number]
+                    if nodes.get(node.key) is node:
+                        del nodes[node.key]
+                goal = records[record['goal']] if record['goal'] != None else None
+                stats = record['stats']
+                self._count = len(records)
+                self._size = offset
+
+        if self._size == 0:
+            return None
+        queued = [node for node in records[:self._count] if node.number not in expanded and nodes.get(node.key) is node]
+        return SearchState(root=records[0], nodes=nodes, queued=queued, goal=goal, stats=stats)
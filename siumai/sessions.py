@@ -0,0 +1,265 @@
+import asyncio
+import atexit
+import threading
+from typing import AsyncGenerator, Dict, List, Sequence, Tuple, Union, TYPE_CHECKING
+
+# the HTTP libraries are imported with the first request, they are a large share of the import time of siumai
+if TYPE_CHECKING:
+    import aiohttp
+    import requests
+    from requests.adapters import HTTPAdapter
+
+
+class SessionPool():
+    """
+    Process-wide pool of requests connections shared by all tools and clients.
+
+    Every thread gets its own requests.Session, and all of them mount the same HTTPAdapter,
+    whose urllib3 connection pool is thread-safe, so connections are reused across threads.
+    Only idempotent methods are retried, a tool call (POST) is never sent twice.
+
+    Attributes:
+        pool_connections (int): The number of hosts to keep connection pools for. Defaults to 10.
+        pool_maxsize (int): The maximum number of connections kept per host. Defaults to 32.
+        max_retries (int): The maximum number of retries of idempotent requests. Defaults to 3.
+        backoff_factor (float): The exponential backoff factor between retries in seconds. Defaults to 0.5.
+        status_forcelist (Sequence[int]): The status codes that trigger a retry. Defaults to 429 and 5xx gateway errors.
+        timeout (Optional[float]): The default timeout of a request in seconds. Defaults to 120.
+    """
+
+    def __init__(
+        self,
+        pool_connections:int=10,
+        pool_maxsize:int=32,
+        max_retries:int=3,
+        backoff_factor:float=0.5,
+        status_forcelist:Sequence[int]=(429, 500, 502, 503, 504),
+        timeout:Union[float, None]=120,
+    ):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = status_forcelist
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._adapter:Union['HTTPAdapter', None] = None
+        # bumped by configure so that the sessions of every thread pick up the new adapter
+        self._generation = 0
+
+    def configure(self, **kwargs):
+        """
+        Change the settings of the pool. Open connections are closed and new ones follow the new settings.
+        """
+        for key, value in kwargs.items():
+            if not hasattr(self, key) or key.startswith('_'):
+                raise ValueError(f'Unknown session pool setting: {key}')
+            setattr(self, key, value)
+        self.close()
+
+    def _get_adapter(self) -> 'HTTPAdapter':
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        with self._lock:
+            if self._adapter == None:
+                self._adapter = HTTPAdapter(
+                    pool_connections=self.pool_connections,
+                    pool_maxsize=self.pool_maxsize,
+                    max_retries=Retry(
+                        total=self.max_retries,
+                        backoff_factor=self.backoff_factor,
+                        status_forcelist=self.status_forcelist,
+                        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                        raise_on_status=False,
+                    ),
+                )
+                self._generation += 1
+            return self._adapter
+
+    @property
+    def session(self) -> 'requests.Session':
+        """
+        The session of the calling thread.
+        """
+        import requests
+        adapter = self._get_adapter()
+        session:Union['requests.Session', None] = getattr(self._local, 'session', None)
+        if session == None or getattr(self._local, 'generation', None) != self._generation:
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+            self._local.generation = self._generation
+        return session
+
+    def request(self, method:str, url:str, **kwargs) -> 'requests.Response':
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url:str, **kwargs) -> 'requests.Response':
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url:str, **kwargs) -> 'requests.Response':
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url:str, **kwargs) -> 'requests.Response':
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        """
+        Close the pooled connections. The pool stays usable and reconnects on the next request.
+        """
+        with self._lock:
+            adapter, self._adapter = self._adapter, None
+        if adapter != None:
+            adapter.close()
+
+
+class AsyncSessionPool():
+    """
+    Process-wide pool of aiohttp sessions shared by all tools.
+
+    aiohttp sessions are bound to an event loop, so the pool keeps one session per running loop.
+    Connections are kept alive and reused across calls, which saves the DNS, TCP and TLS setup of every tool call
+    and bounds the number of open sockets under fan-out.
+
+    A session is closed within its loop when the loop shuts down its async generators, e.g. at the end of asyncio.run.
+    The sessions of loops closed without that step are closed by the next get(), or at interpreter exit.
+    A service can also bound the session to its lifetime with `async with ASYNC_SESSION_POOL:`.
+
+    Attributes:
+        limit (int): The maximum number of open connections per session. Defaults to 100.
+        limit_per_host (int): The maximum number of open connections to a single host. Defaults to 16.
+        keepalive_timeout (float): The number of seconds an idle connection is kept open. Defaults to 30.
+        timeout (Optional[float]): The total timeout of a request in seconds. Defaults to 120.
+        connect_timeout (Optional[float]): The timeout to acquire a connection in seconds. Defaults to None.
+        ttl_dns_cache (int): The number of seconds resolved addresses are cached. Defaults to 300.
+
+    Example:
+        async def main():
+            async with ASYNC_SESSION_POOL:
+                await tool.a_run(query='...')
+    """
+
+    def __init__(
+        self,
+        limit:int=100,
+        limit_per_host:int=16,
+        keepalive_timeout:float=30,
+        timeout:Union[float, None]=120,
+        connect_timeout:Union[float, None]=None,
+        ttl_dns_cache:int=300,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        # the session of every loop and the async generator closing it, loops are kept until their session is closed
+        self._sessions:Dict[asyncio.AbstractEventLoop, Tuple['aiohttp.ClientSession', AsyncGenerator]] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, **kwargs):
+        """
+        Change the settings of the pool. Sessions created before keep their settings until they are closed.
+        """
+        for key, value in kwargs.items():
+            if not hasattr(self, key) or key.startswith('_'):
+                raise ValueError(f'Unknown session pool setting: {key}')
+            setattr(self, key, value)
+
+    def _create(self) -> 'aiohttp.ClientSession':
+        import aiohttp
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.ttl_dns_cache,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout, connect=self.connect_timeout),
+        )
+
+    @staticmethod
+    async def _closer(session:'aiohttp.ClientSession') -> AsyncGenerator:
+        # once started in a loop, the loop closes it when it shuts down its async generators
+        try:
+            yield
+        finally:
+            if not session.closed:
+                await session.close()
+
+    async def get(self) -> 'aiohttp.ClientSession':
+        """
+        Return the session of the running event loop, creating it on first use.
+        """
+        loop = asyncio.get_running_loop()
+        stale:List[AsyncGenerator] = []
+        closer = None
+        with self._lock:
+            for other in [other for other in self._sessions if other.is_closed()]:
+                stale.append(self._sessions.pop(other)[1])
+            entry = self._sessions.get(loop)
+            if entry == None or entry[0].closed:
+                if entry != None:
+                    stale.append(entry[1])
+                session = self._create()
+                closer = self._closer(session)
+                self._sessions[loop] = (session, closer)
+            else:
+                session = entry[0]
+        if closer != None:
+            await closer.__anext__()
+        # the sessions of loops closed without shutting down their async generators
+        for stale_closer in stale:
+            await stale_closer.aclose()
+        return session
+
+    async def close(self):
+        """
+        Close the session of the running event loop. Call it when a service shuts down.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._sessions.pop(loop, None)
+        if entry != None:
+            await entry[1].aclose()
+
+    async def __aenter__(self) -> 'AsyncSessionPool':
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback) -> bool:
+        await self.close()
+        return False
+
+    def close_all(self):
+        """
+        Close the sessions of the loops that are not running. Registered to run at interpreter exit.
+        """
+        with self._lock:
+            entries = [(loop, entry) for loop, entry in self._sessions.items() if not loop.is_running()]
+            for loop, entry in entries:
+                del self._sessions[loop]
+        stale:List[AsyncGenerator] = []
+        for loop, (session, closer) in entries:
+            if loop.is_closed():
+                stale.append(closer)
+            else:
+                loop.run_until_complete(closer.aclose())
+        if len(stale) > 0:
+            loop = asyncio.new_event_loop()
+            try:
+                for closer in stale:
+                    loop.run_until_complete(closer.aclose())
+            finally:
+                loop.close()
+
+
+SESSION_POOL = SessionPool()
+atexit.register(SESSION_POOL.close)
+
+ASYNC_SESSION_POOL = AsyncSessionPool()
+atexit.register(ASYNC_SESSION_POOL.close_all)
@@ -1,14 +1,16 @@
 from hashlib import sha256
 import uuid
-import siumai.models
-import requests
-import aiohttp
 import os
 import json
-from os.path import dirname
 from pydantic import BaseModel, AnyHttpUrl
-from typing import Dict, Optional
-from importlib import reload
+from typing import Dict, Optional, Union
+from siumai.cache import LRUCache
+from siumai.instrumentation import span
+from siumai.model_registry import MODEL_REGISTRY
+from siumai.sessions import SESSION_POOL, ASYNC_SESSION_POOL
+
+# shared by the tools which declare themselves cacheable without bringing their own cache
+DEFAULT_TOOL_CACHE = LRUCache(max_size=4096, ttl=3600)
 
 
 def to_camel_case(snake: str):
@@ -46,6 +48,9 @@ class Tool():
         self.price: Optional[int] = kwargs.get('price')
         self.free_quota: Optional[int] = kwargs.get('free_quota')
         self.endpoint: Optional[AnyHttpUrl] = kwargs.get('endpoint')
+        # deterministic tools can declare themselves cacheable in their metadata
+        self.cacheable: bool = kwargs.get('cacheable', False)
+        self.cache: Optional[LRUCache] = kwargs.get('cache')
 
         if self.input_model != None:
             self.input_json_schema = self.input_model.model_json_schema()
@@ -56,7 +61,7 @@ class Tool():
     def load(cls, id, api_key):
         tool = Tool(api_key=api_key, id=id)
 
-        response = requests.get(
+        response = SESSION_POOL.get(
             f'{cls.url}/tools/{id}',
             headers={
                 'Api-Key': api_key
@@ -73,13 +78,8 @@ class Tool():
         
         for key, value in tool_dict.items():
             if key in ['input_model', 'output_model']:
-                path = dirname(__file__)
-                filename = id
-                with open(f'{path}/models/{filename}_{key}.py', 'w') as f:
-                    f.write(value)
-                module = reload(siumai.models)
-                submodule = getattr(module, f'{filename}_{key}')
-                model = getattr(submodule, to_camel_case(key))
+                # compiled once per version of the source, shared by every tool loading it
+                model = MODEL_REGISTRY.load(value, to_camel_case(key))
                 setattr(tool, key, model)
                 continue
             
@@ -92,6 +92,22 @@ class Tool():
         return tool
 
 
+    def result_cache(self) -> Union[LRUCache, None]:
+        '''
+        The cache of the results of the tool, keyed by the tool id and the validated input.
+        A cache given explicitly is always used, cacheable tools share DEFAULT_TOOL_CACHE otherwise.
+        '''
+        if self.cache != None:
+            return self.cache
+        if self.cacheable:
+            return DEFAULT_TOOL_CACHE
+        return None
+
+
+    def cache_key(self, model:BaseModel) -> str:
+        return f'{self.id or self.name}:{model.model_dump_json()}'
+
+
     def publish(self, api_key: Optional[str] = None, webhook_secret: Optional[str] = None, public=True):
         self.api_key = api_key
         # create a random webhook_secret if not given
@@ -105,7 +121,7 @@ class Tool():
         if self.output_model != None:
             self.output_json_schema = self.output_model.model_json_schema()
 
-        response = requests.post(
+        response = SESSION_POOL.post(
             f'{self.url}/tools/',
             json={
                 'name': self.name,
@@ -147,24 +163,37 @@ class Tool():
             'Parent-Id': parent_id
         }
 
-        # use the tool
-        model = self.input_model.model_validate(kwargs)
+        with span('tool.run', tool=self.name) as tool_span:
+            # use the tool
+            model = self.input_model.model_validate(kwargs)
 
-        resp = requests.post(
-            url,
-            data=bytes(model.model_dump_json(), 'utf-8'),
-            headers=headers,
-        )
+            cache = self.result_cache()
+            if cache != None:
+                result = cache.get(self.cache_key(model))
+                tool_span.set(cached=result != None)
+                if result != None:
+                    return result
 
-        if resp.status_code >= 300:
-            raise Exception(resp.text)
+            data = bytes(model.model_dump_json(), 'utf-8')
+            resp = SESSION_POOL.post(
+                url,
+                data=data,
+                headers=headers,
+            )
+            tool_span.set(request_bytes=len(data), response_bytes=len(resp.content))
 
-        response = resp.json()
-        status = response.get('status')
-        if status >= 300:
-            raise Exception(response.get('response'))
+            if resp.status_code >= 300:
+                raise Exception(resp.text)
 
-        return response.get('response')
+            response = resp.json()
+            status = response.get('status')
+            if status >= 300:
+                raise Exception(response.get('response'))
+
+            result = response.get('response')
+            if cache != None and isinstance(result, str):
+                cache.set(self.cache_key(model), result)
+            return result
 
 
     async def a_run(
@@ -184,20 +213,34 @@ class Tool():
         if parent_id != None:
             headers['Parent-Id'] = parent_id
 
-        # use the tool
-        model = self.input_model.model_validate(kwargs)
+        with span('tool.a_run', tool=self.name) as tool_span:
+            # use the tool
+            model = self.input_model.model_validate(kwargs)
+
+            cache = self.result_cache()
+            if cache != None:
+                result = cache.get(self.cache_key(model))
+                tool_span.set(cached=result != None)
+                if result != None:
+                    return result
 
-        # use the tool asynchronously
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, data=bytes(model.model_dump_json(), 'utf-8'), headers=headers) as resp:
+            # use the tool asynchronously, over the connections shared by all tools
+            data = bytes(model.model_dump_json(), 'utf-8')
+            session = await ASYNC_SESSION_POOL.get()
+            async with session.post(url, data=data, headers=headers) as resp:
 
                 if resp.status >= 300:
                     raise Exception(await resp.text())
 
-                response = await resp.json()
+                body = await resp.read()
+                tool_span.set(request_bytes=len(data), response_bytes=len(body))
+                response = json.loads(body)
 
                 status = response.get('status')
                 if status >= 300:
                     raise Exception(response.get('detail'))
 
-                return response.get('response')
+            result = response.get('response')
+            if cache != None and isinstance(result, str):
+                cache.set(self.cache_key(model), result)
+            return result
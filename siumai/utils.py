@@ -1,19 +1,46 @@
+import asyncio
 import base64
-from typing import Callable, Coroutine, List, Union
-from inspect import iscoroutinefunction
+from typing import Any, Callable, Coroutine, List, Union
+from inspect import isawaitable, iscoroutinefunction
 from siumai.schema import Message
 
 def encode_image(image_file):
     return base64.b64encode(image_file.read()).decode('utf-8')
 
-def get_coroutine(function:Callable, **kwargs) -> Coroutine:
+def get_coroutine(function:Callable, *args, **kwargs) -> Coroutine:
     if iscoroutinefunction(function):
-        return function(**kwargs)
+        return function(*args, **kwargs)
     else:
         async def wrapper():
-            return function(**kwargs)
+            result = function(*args, **kwargs)
+            # e.g. a lambda or a partial wrapping a coroutine function
+            if isawaitable(result):
+                return await result
+            return result
         return wrapper()
 
+async def resolve_awaitables(values:List[Any], semaphore:Union[asyncio.Semaphore, None]=None) -> List[Any]:
+    """
+    Replace the awaitables among the values by their results, awaiting them concurrently.
+    Plain values are returned as they are, so synchronous callers pay nothing.
+    At most semaphore's value of the awaitables run at the same time if a semaphore is given.
+    """
+    indices = [index for index, value in enumerate(values) if isawaitable(value)]
+    if len(indices) == 0:
+        return values
+
+    async def run(awaitable):
+        if semaphore == None:
+            return await awaitable
+        async with semaphore:
+            return await awaitable
+
+    results = await asyncio.gather(*[run(values[index]) for index in indices])
+    values = list(values)
+    for index, result in zip(indices, results):
+        values[index] = result
+    return values
+
 def append_to_messages(messages:List[Message], message:Union[Message, List[Message]]) -> List[Message]:
     if isinstance(message, list):
         messages.extend(message)
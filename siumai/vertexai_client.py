@@ -7,6 +7,7 @@ from typing import Callable, List, Dict, Optional, Union
 from pydantic import BaseModel
 
 from siumai.schema import Message, ToolCall, FunctionCall, GenerationConfig, Content
+from siumai.instrumentation import span
 from siumai.vertexai_utils import transform_siumai_tool_to_vertexai_tool
 from vertexai import generative_models
 
@@ -110,6 +111,87 @@ def transform_message_vertexai(message:Message) -> generative_models.Content:
             )
 
 
+def transform_messages_vertexai(messages:List[Message]) -> List[generative_models.Content]:
+    """
+    Transforms the messages for the Vertex AI system, reusing the result cached on each message.
+
+    Args:
+        messages (List[Message]): The messages to transform.
+
+    Returns:
+        List[generative_models.Content]: The transformed messages.
+    """
+    return [message.memoize('vertexai', transform_message_vertexai) for message in messages]
+
+
+def replace_text(message:Message, text:str) -> Message:
+    """
+    Copy-on-write replacement of the text of a message. The original message is left untouched.
+
+    Args:
+        message (Message): The message to copy.
+        text (str): The new text.
+
+    Returns:
+        Message: A shallow copy of the message with the new text.
+    """
+    return message.model_copy(
+        update={'content': message.content.model_copy(update={'text': text})}
+    )
+
+
+def prepare_messages_vertexai(messages:List[Message], output_model:Optional[BaseModel]=None) -> List[Message]:
+    """
+    Adds the output model instruction and folds the system message into the first user message.
+    Returns a new list, the given messages are never modified.
+
+    Args:
+        messages (List[Message]): The messages of the request.
+        output_model (Optional[BaseModel], optional): The model the response must follow. Defaults to None.
+
+    Returns:
+        List[Message]: The messages ready to be transformed for Vertex AI.
+    """
+    messages = list(messages)
+
+    if output_model != None:
+        schema = output_model.model_json_schema()
+        messages[0] = replace_text(
+            messages[0],
+            f"""You must return a JSON object according to this json schema. {schema}
+            
+            {messages[0].content.text}
+            """
+        )
+
+    # Gemini doesn't support system roles, so if the first message is a system,
+    # it will be injected into the following one (which will always be a user one)
+    if messages[0].role == "system":
+        system_message = messages.pop(0).content.text
+        messages[0] = replace_text(
+            messages[0],
+            f"""{system_message}
+            
+            {messages[0].content.text}"""
+        )
+
+    return messages
+
+
+def vertexai_usage(response:generative_models.GenerationResponse) -> Dict:
+    """
+    The token usage of a response, as span attributes.
+    """
+    usage = getattr(response, 'usage_metadata', None)
+    if usage == None:
+        return {}
+    return {
+        'prompt_tokens': usage.prompt_token_count,
+        'completion_tokens': usage.candidates_token_count,
+        'total_tokens': usage.total_token_count,
+    }
+
+
 class VertexAIClient():
 
     def __init__(self, generation_config:GenerationConfig):
@@ -175,33 +257,21 @@ class VertexAIClient():
         else:
             vertexai_tools = None
         
-        if output_model != None:
-            schema = output_model.model_json_schema()
-            messages[0].content.text = \
-            f"""You must return a JSON object according to this json schema. {schema}
-            
-            {messages[0].content.text}
-            """
-        
-        # Gemini doesn't support system roles, so if the first message is a system,
-        # it will be injected into the following one (which will always be a user one)
-        if messages[0].role == "system":
-            system_message = messages[0].content.text
-            messages[1].content.text = \
-            f"""{system_message}
-            
-            {messages[1].content.text}"""
-            messages.pop(0)
-        
+        messages = prepare_messages_vertexai(messages, output_model)
+
         # Initialise returned message list
         _messages = []
         
         # Transform AgentX messages into Vertex AI generative_models.Content objects
-        vertex_content = [transform_message_vertexai(message) for message in messages]
+        with span('vertexai.transform', messages=len(messages)):
+            vertex_content = transform_messages_vertexai(messages)
         
         for num_retry in range(generation_config.max_retries):
             # Generate content based on the history of content
-            response = model.generate_content(contents = vertex_content, tools = vertexai_tools, **kw_args)
+            with span('vertexai.request', model=generation_config.model, retried=num_retry > 0) as request_span:
+                response = model.generate_content(contents = vertex_content, tools = vertexai_tools, **kw_args)
+                if request_span.recording:
+                    request_span.set(**vertexai_usage(response))
 
             # Rename variable for lighted code
             response_parts = response.candidates[0].content.parts[0]
@@ -407,13 +477,17 @@ class VertexAIClient():
         _messages = []
         
         # Transform AgentX messages into Vertex AI messages
-        vertex_messages = [transform_message_vertexai(message) for message in messages]
+        with span('vertexai.transform', messages=len(messages)):
+            vertex_messages = transform_messages_vertexai(messages)
         
         # Transform Vertex AI messages into Vertex AI generative_models.Content objects
         vertex_content = [generative_models.Content(**vertex_message) if type(vertex_message) is dict else vertex_message for vertex_message in vertex_messages]
 
         # Generate content based on the history of content
-        response = await model.generate_content(contents = vertex_content, tools = kw_args['tools'])
+        with span('vertexai.request', model=generation_config.model) as request_span:
+            response = await model.generate_content(contents = vertex_content, tools = kw_args['tools'])
+            if request_span.recording:
+                request_span.set(**vertexai_usage(response))
 
         # Rename variable for lighted code
         response_parts = response.candidates[0].content.parts[0]
@@ -0,0 +1,20 @@
+from typing import List, Union
+from siumai.schema import Message, Content
+
+
+# shared by the search tests, defined at the top level of a module so that they pickle for spawned workers
+def text_message(text:str, role:str='assistant') -> Message:
+    return Message(role=role, content=Content(text=text))
+
+
+class CountingAgent():
+    '''
+    Replies with its name and the number of messages it has seen, so that replies are deterministic and depend on the path
+    '''
+    def __init__(self, name:str):
+        self.name = name
+        self.calls = 0
+
+    async def a_generate_response(self, messages:List[Message]) -> Union[List[Message], None]:
+        self.calls += 1
+        return [text_message(f'{self.name} {len(messages)}')]
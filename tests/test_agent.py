@@ -1,10 +1,14 @@
 import json
+import subprocess
+import sys
+import time
 from typing import List
 import unittest
 import os
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from siumai.schema import GenerationConfig, Message, Content, ToolResponse, Function
+from siumai.cache import ResponseCache
+from siumai.schema import GenerationConfig, Message, Content, ToolResponse, Function, ToolCall, FunctionCall, StreamRejected
 from siumai.agent import Agent
 from siumai.utils import encode_image
 from siumai.tool import Tool
@@ -392,5 +396,163 @@ class AsyncAgentTestCase(unittest.IsolatedAsyncioTestCase):
         self.assertIsInstance(response.content.text, str)
     
 
+class EchoTool(Tool):
+    def run(self, **kwargs):
+        return json.dumps({'response':kwargs})
+    async def a_run(self, **kwargs):
+        return json.dumps({'response':kwargs})
+
+class ScriptedClient():
+    '''
+    Replays a fixed list of assistant messages, one per call
+    '''
+    def __init__(self, replies:List[Message]):
+        self.replies = replies
+        self.requests = []
+
+    def generate(self, messages, generation_config, reduce_function=None, output_model=None):
+        self.requests.append(list(messages))
+        return self.replies[len(self.requests) - 1].model_copy(deep=True)
+
+    async def a_generate(self, messages, generation_config, reduce_function=None, output_model=None):
+        return self.generate(messages, generation_config, reduce_function, output_model)
+
+    async def a_generate_stream(self, messages, generation_config, output_model=None):
+        message = self.generate(messages, generation_config, output_model=output_model)
+        if message.content.text != None:
+            for word in message.content.text.split(' '):
+                yield word
+        yield message
+
+class SleepTool(Tool):
+    def run(self, **kwargs):
+        time.sleep(float(kwargs['query']))
+        return json.dumps({'response':kwargs['query']})
+
+def tool_call_message(*queries:str) -> Message:
+    return Message(
+        role='assistant',
+        content=Content(
+            tool_calls=[
+                ToolCall(
+                    id=f'call_{i}',
+                    type='function',
+                    function_call=FunctionCall(name='echo', arguments=json.dumps({'query':query})),
+                ) for i, query in enumerate(queries)
+            ]
+        ),
+    )
+
+class OfflineAgentTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.agent = Agent(
+            name='test_agent',
+            system_prompt='You are a helpful assistant.',
+            generation_config=GenerationConfig(api_type='openai', api_key='test'),
+            tools=[EchoTool(name='echo', description='echo', input_json_schema={})],
+        )
+        self.agent.client = ScriptedClient([
+            tool_call_message('a', 'b'),
+            Message(role='assistant', content=Content(text='all done')),
+        ])
+        self.messages = [Message(role='user', content=Content(text='Echo a and b.'))]
+
+    async def test_a_stream_response(self):
+        items = [item async for item in self.agent.a_stream_response(self.messages)]
+        deltas = [item for item in items if isinstance(item, str)]
+        messages = [item for item in items if isinstance(item, Message)]
+        self.assertEqual(deltas, ['all', 'done'])
+        self.assertEqual([message.role for message in messages], ['assistant', 'tool', 'tool', 'assistant'])
+        self.assertEqual(messages[-1].content.text, 'all done')
+        # the second request carries the system prompt, the tool calls and their responses
+        self.assertEqual(len(self.agent.client.requests[-1]), 5)
+
+    async def test_a_stream_response_with_cached_candidates(self):
+        # a reduce_function keeping every candidate caches a list of messages
+        self.agent.cache = ResponseCache()
+        self.agent.reduce_function = lambda messages: messages
+        key = self.agent.cache.request_key(self.agent._request_messages(self.messages), self.agent.generation_config)
+        self.agent.cache.set_response(key, [Message(role='assistant', content=Content(text=text)) for text in ['first', 'second']])
+        items = [item async for item in self.agent.a_stream_response(self.messages)]
+        self.assertEqual(items[0], 'first')
+        self.assertEqual(items[1].content.text, 'first')
+        self.assertEqual(len(items), 2)
+
+    async def test_a_stream_response_failed_turn(self):
+        class FailingClient():
+            async def a_generate(self, messages, generation_config, reduce_function=None, output_model=None):
+                return None
+
+        self.agent.client = FailingClient()
+        items = [item async for item in self.agent.a_stream_response(self.messages)]
+        self.assertEqual(len(items), 1)
+        self.assertIsInstance(items[-1], StreamRejected)
+
+    async def test_a_generate_response_matches_stream(self):
+        messages = await self.agent.a_generate_response(self.messages)
+        self.assertEqual([message.role for message in messages], ['assistant', 'tool', 'tool', 'assistant'])
+        self.assertEqual(json.loads(messages[1].content.tool_response.content), {'response':{'query':'a'}})
+
+class ConcurrentToolAgentTestCase(unittest.TestCase):
+    def make_agent(self, replies:List[Message], **kwargs) -> Agent:
+        agent = Agent(
+            name='test_agent',
+            generation_config=GenerationConfig(api_type='openai', api_key='test'),
+            tools=[SleepTool(name='echo', description='sleep', input_json_schema={})],
+            **kwargs
+        )
+        agent.client = ScriptedClient(replies)
+        return agent
+
+    def test_tool_calls_run_concurrently_in_order(self):
+        agent = self.make_agent(
+            [tool_call_message('0.3', '0.2', '0.1', '0.2'), Message(role='assistant', content=Content(text='done'))],
+            max_tool_concurrency=4,
+        )
+        start = time.perf_counter()
+        messages = agent.generate_response([Message(role='user', content=Content(text='sleep'))])
+        elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual(
+            [json.loads(message.content.tool_response.content)['response'] for message in messages[1:5]],
+            ['0.3', '0.2', '0.1', '0.2'],
+        )
+        self.assertEqual([message.content.tool_response.id for message in messages[1:5]], ['call_0', 'call_1', 'call_2', 'call_3'])
+
+    def test_tool_timeout(self):
+        agent = self.make_agent(
+            [tool_call_message('1', '0'), Message(role='assistant', content=Content(text='done'))],
+            tool_timeout=0.2,
+        )
+        messages = agent.generate_response([Message(role='user', content=Content(text='sleep'))])
+        self.assertIn('error', json.loads(messages[1].content.tool_response.content))
+        self.assertEqual(json.loads(messages[2].content.tool_response.content), {'response':'0'})
+
+    def test_tool_timeout_releases_the_slot(self):
+        # the first call hangs, the one queued behind it must still run within the turn
+        agent = self.make_agent(
+            [tool_call_message('30', '0'), Message(role='assistant', content=Content(text='done'))],
+            max_tool_concurrency=1,
+            tool_timeout=0.2,
+        )
+        start = time.perf_counter()
+        messages = agent.generate_response([Message(role='user', content=Content(text='sleep'))])
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertIn('error', json.loads(messages[1].content.tool_response.content))
+        self.assertEqual(json.loads(messages[2].content.tool_response.content), {'response':'0'})
+
+class LazyImportTestCase(unittest.TestCase):
+    def test_provider_sdks_are_imported_on_demand(self):
+        code = '''
+import sys
+import siumai.agent
+from siumai.schema import GenerationConfig
+siumai.agent.Agent(name='test', generation_config=GenerationConfig(api_type='openai', api_key='test'))
+print(','.join(m for m in ['openai', 'vertexai', 'boto3', 'aiohttp'] if m in sys.modules))
+'''
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), 'openai')
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,139 @@
+import os
+import tempfile
+import time
+import unittest
+from typing import List
+from siumai.agent import Agent
+from siumai.cache import HeuristicCache, LRUCache, ResponseCache
+from siumai.schema import GenerationConfig, Message, Content
+
+
+class CountingClient():
+    def __init__(self):
+        self.calls = 0
+
+    def generate(self, messages:List[Message], generation_config, reduce_function=None, output_model=None):
+        self.calls += 1
+        return Message(role='assistant', content=Content(text=f'reply {len(messages)}'))
+
+    async def a_generate(self, messages:List[Message], generation_config, reduce_function=None, output_model=None):
+        return self.generate(messages, generation_config, reduce_function, output_model)
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', '1')
+        cache.set('b', '2')
+        cache.get('a')
+        cache.set('c', '3')
+        self.assertEqual(cache.get('a'), '1')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_ttl(self):
+        cache = LRUCache(ttl=0.01)
+        cache.set('a', '1')
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.misses, 1)
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as path:
+            LRUCache(path=path).set('a', '1')
+            cache = LRUCache(path=path)
+            self.assertEqual(cache.get('a'), '1')
+            self.assertEqual(cache.disk_hits, 1)
+
+    def test_clear_keeps_other_files(self):
+        with tempfile.TemporaryDirectory() as path:
+            with open(os.path.join(path, 'user.json'), 'w') as f:
+                f.write('{}')
+            responses = ResponseCache(path=path)
+            responses.set('a', '1')
+            heuristics = HeuristicCache(path=path)
+            heuristics.set('a', '2')
+            responses.clear()
+            self.assertIn('user.json', os.listdir(path))
+            self.assertIsNone(ResponseCache(path=path).get('a'))
+            self.assertEqual(HeuristicCache(path=path).get('a'), '2')
+
+
+class MessageDigestTest(unittest.TestCase):
+
+    def test_digest_follows_content(self):
+        message = Message(role='user', content=Content(text='hello'))
+        copy = Message.model_validate(message.model_dump())
+        self.assertEqual(message.digest, copy.digest)
+        self.assertEqual(hash(message), hash(copy))
+        self.assertEqual(len(message.digest_id), 32)
+        before = message.digest
+        message.content.text = 'bye'
+        self.assertNotEqual(message.digest, before)
+        message.content = Content(text='hello')
+        self.assertEqual(message.digest, before)
+        message.name = 'someone'
+        self.assertNotEqual(message.digest, before)
+
+
+class HeuristicCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.messages = [Message(role='user', content=Content(text=f'message {i}')) for i in range(3)]
+
+    def test_rolling_key(self):
+        cache = HeuristicCache()
+        prefix = cache.conversation_key(self.messages[:1])
+        self.assertEqual(cache.extend_key(prefix, self.messages[1:]), cache.conversation_key(self.messages))
+        self.assertNotEqual(cache.conversation_key(self.messages), cache.conversation_key(self.messages[::-1]))
+        # same content, other objects
+        copies = [Message.model_validate(message.model_dump()) for message in self.messages]
+        self.assertEqual(cache.conversation_key(copies), cache.conversation_key(self.messages))
+
+    def test_none_score_and_persistence(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = HeuristicCache(path=path)
+            key = cache.conversation_key(self.messages)
+            self.assertEqual(cache.get_score(key), (False, None))
+            cache.set_score(key, None)
+            self.assertEqual(cache.get_score(key), (True, None))
+            HeuristicCache(path=path).set_score(key, 2.5)
+            self.assertEqual(HeuristicCache(path=path).get_score(key), (True, 2.5))
+
+
+class AgentResponseCacheTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.agent = Agent(
+            name='test_agent',
+            system_prompt='You are a helpful assistant.',
+            generation_config=GenerationConfig(api_type='openai', api_key='test'),
+            cache=ResponseCache(max_size=8),
+        )
+        self.client = CountingClient()
+        self.agent.client = self.client
+        self.messages = [Message(role='user', content=Content(text='Tell me a joke.'))]
+
+    def test_generate_response_hits_cache(self):
+        first = self.agent.generate_response(self.messages)
+        second = self.agent.generate_response(self.messages)
+        self.assertEqual(self.client.calls, 1)
+        self.assertEqual(first[-1].content.text, second[-1].content.text)
+        self.assertEqual(self.agent.cache.hits, 1)
+        self.assertEqual(self.agent.cache.misses, 1)
+
+    async def test_a_generate_response_hits_cache(self):
+        await self.agent.a_generate_response(self.messages)
+        await self.agent.a_generate_response(self.messages)
+        self.assertEqual(self.client.calls, 1)
+
+    def test_different_config_misses(self):
+        self.agent.generate_response(self.messages)
+        self.agent.generation_config.temperature = 0.5
+        self.agent.generate_response(self.messages)
+        self.assertEqual(self.client.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from typing import List, Union
+from siumai.distributed import AgentSpec, distributed_astar_chat
+from siumai.groupchat import astar_chat
+from siumai.schema import Message
+from siumai.search import SearchStats
+from tests.search_fixtures import CountingAgent, text_message
+
+
+class FailingAgent(CountingAgent):
+    async def a_generate_response(self, messages:List[Message]) -> Union[List[Message], None]:
+        raise ValueError('no reply')
+
+
+# the cost and the heuristic are sent to the workers, they are defined at the top level to be picklable
+def unit_cost(messages:List[Message], next_messages:List[Message]) -> float:
+    return 1
+
+
+def prefer_b(messages:List[Message]) -> float:
+    return 6 - len(messages) + sum(1 for message in messages if message.content.text.startswith('a'))
+
+
+def cheaper_after_a(messages:List[Message], next_messages:List[Message]) -> float:
+    return 1 if messages[-1].content.text.startswith('a') and next_messages[0].content.text.startswith('a') else 2
+
+
+def tie_after_a(messages:List[Message]) -> float:
+    return 10 - len(messages) + (1 if messages[-1].content.text.startswith('a') else 0)
+
+
+class DistributedAStarChatTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_same_search_as_astar_chat(self):
+        kwargs = dict(messages=[text_message('start', 'user')], cost=unit_cost, heuristic=prefer_b, threshold=1, n_replies=2, max_iteration=4)
+        expected = await astar_chat(agents=[CountingAgent('a'), CountingAgent('b')], expansion_width=2, **kwargs)
+        stats = SearchStats()
+        result = await distributed_astar_chat(
+            agent_specs=[AgentSpec(CountingAgent, name='a'), AgentSpec(CountingAgent, name='b')],
+            n_workers=2,
+            stats=stats,
+            start_method='spawn',
+            **kwargs,
+        )
+        self.assertEqual([message.content.text for message in result[0]], ['start', 'b 1', 'b 2', 'b 3', 'b 4'])
+        self.assertEqual(result[0], expected[0])
+        self.assertEqual(result[2], expected[2])
+        self.assertGreater(stats.expanded, stats.iterations)
+
+    async def test_cheaper_duplicate_in_the_same_iteration(self):
+        # b 1 is expanded before a 1, which then reaches a 2 cheaper, with the priority of b 2:
+        # the tie is broken by the position a 2 first took in the iteration
+        kwargs = dict(messages=[text_message('start', 'user')], cost=cheaper_after_a, heuristic=tie_after_a, threshold=7, max_iteration=4, expansion_width=2)
+        expected_stats = SearchStats()
+        expected = await astar_chat(agents=[CountingAgent('a'), CountingAgent('b')], stats=expected_stats, **kwargs)
+        stats = SearchStats()
+        result = await distributed_astar_chat(
+            agent_specs=[AgentSpec(CountingAgent, name='a'), AgentSpec(CountingAgent, name='b')],
+            n_workers=2,
+            stats=stats,
+            start_method='spawn',
+            **kwargs,
+        )
+        self.assertEqual([message.content.text for message in result[0]], ['start', 'a 1', 'a 2', 'b 3'])
+        self.assertEqual(result, expected)
+        self.assertGreater(stats.duplicates, 0)
+        # duplicates are not scored, the root is
+        self.assertEqual(stats.heuristic_calls, stats.pushed)
+        self.assertEqual(stats.as_dict(), expected_stats.as_dict())
+
+    async def test_worker_errors_are_raised(self):
+        with self.assertRaises(RuntimeError):
+            await distributed_astar_chat(
+                agent_specs=[AgentSpec(FailingAgent, name='a')],
+                messages=[text_message('start', 'user')],
+                cost=unit_cost,
+                heuristic=prefer_b,
+                n_workers=1,
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
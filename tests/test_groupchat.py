@@ -0,0 +1,476 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from typing import List, Union
+from siumai.cache import HeuristicCache
+from siumai.groupchat import astar_chat, astar_chat_stream, group_chat, group_chat_stream, reconstruct_path, resume_astar_chat
+from siumai.schema import Message, Content, ToolCall, FunctionCall
+from siumai.search import Canonicaliser, Frontier, GroupChatStats, IncrementalHeuristic, Node, SearchCheckpoint, SearchStats, state_key
+from tests.search_fixtures import CountingAgent, text_message
+
+
+class ToolCallingAgent(CountingAgent):
+    '''
+    Calls the same tool as every other ToolCallingAgent, but with its own tool call ID, key order and spacing
+    '''
+    def __init__(self, name:str, arguments:str):
+        super().__init__(name)
+        self.arguments = arguments
+
+    async def a_generate_response(self, messages:List[Message]) -> Union[List[Message], None]:
+        self.calls += 1
+        tool_call = ToolCall(id=f'{self.name} {self.calls}', type='function', function_call=FunctionCall(name='search', arguments=self.arguments))
+        return [Message(role='assistant', name=self.name, content=Content(text=f' step  {len(messages)}', tool_calls=[tool_call]))]
+
+
+class SlowAgent(CountingAgent):
+    '''
+    Records the highest number of its calls running at the same time
+    '''
+    running = 0
+    max_running = 0
+
+    async def a_generate_response(self, messages:List[Message]) -> Union[List[Message], None]:
+        SlowAgent.running += 1
+        SlowAgent.max_running = max(SlowAgent.max_running, SlowAgent.running)
+        await asyncio.sleep(0.01)
+        SlowAgent.running -= 1
+        return await super().a_generate_response(messages)
+
+
+class FrontierTest(unittest.TestCase):
+
+    def test_pop_order_and_stale_entries(self):
+        frontier = Frontier()
+        nodes = [Node(key=(i,), messages=(), cost=cost) for i, cost in enumerate([3, 1, 2, 1])]
+        for node in nodes:
+            frontier.push(node)
+        frontier.discard(nodes[2])
+        self.assertEqual(len(frontier), 3)
+        # ties are popped in insertion order
+        self.assertEqual([frontier.pop().key for _ in range(3)], [(1,), (3,), (0,)])
+        self.assertIsNone(frontier.pop())
+        self.assertEqual(frontier.stale, 1)
+
+    def test_path_follows_parents(self):
+        root = Node(key=(0,), messages=(text_message('a', 'user'),))
+        child = Node(key=(1,), messages=(text_message('b'), text_message('c')), parent=root, cost=1)
+        grandchild = Node(key=(2,), messages=(text_message('d'),), parent=child, cost=2)
+        self.assertEqual([message.content.text for message in grandchild.path()], ['a', 'b', 'c', 'd'])
+        self.assertEqual(grandchild.depth, 2)
+
+    def test_prune_keeps_best_nodes(self):
+        def make_nodes() -> List[Node]:
+            return [Node(key=(i,), messages=(text_message('x' * 10),), cost=cost) for i, cost in enumerate([3, 1, 2, 4])]
+
+        frontier = Frontier(max_size=2)
+        for node in make_nodes():
+            frontier.push(node)
+        self.assertEqual([node.key for node in frontier.prune()], [(0,), (3,)])
+        self.assertEqual(len(frontier), 2)
+        self.assertEqual([frontier.pop().key for _ in range(2)], [(1,), (2,)])
+
+        frontier = Frontier(max_bytes=1)
+        for node in make_nodes():
+            frontier.push(node)
+        self.assertEqual(len(frontier.prune()), 4)
+        self.assertEqual(frontier.bytes, 0)
+        self.assertIsNone(frontier.pop())
+
+
+class CanonicaliserTest(unittest.TestCase):
+
+    def test_equivalent_messages_share_a_key(self):
+        def message(id:str, text:str, arguments:str, name:str) -> Message:
+            tool_call = ToolCall(id=id, type='function', function_call=FunctionCall(name='search', arguments=arguments))
+            return Message(role='assistant', name=name, content=Content(text=text, tool_calls=[tool_call]))
+
+        first = message('call_1', 'Looking  it up.', '{"query": "Naples", "limit": 1}', 'a')
+        second = message('call_2', ' Looking it up.\n', '{"limit":1,"query":"Naples"}', 'b')
+        self.assertNotEqual(state_key([first]), state_key([second]))
+        self.assertEqual(Canonicaliser()([first]), Canonicaliser()([second]))
+        self.assertNotEqual(Canonicaliser(tool_call_ids=False)([first]), Canonicaliser(tool_call_ids=False)([second]))
+        self.assertNotEqual(Canonicaliser()([first]), Canonicaliser()([message('call_1', 'Looking it up.', '{"query": "Rome", "limit": 1}', 'a')]))
+
+
+class AStarChatTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_reaches_goal(self):
+        agents = [CountingAgent('a'), CountingAgent('b')]
+        messages = [text_message('start', 'user')]
+        stats = SearchStats()
+        path, came_from, cost_so_far, heuristic_map, hash_map = await astar_chat(
+            agents=agents,
+            messages=messages,
+            cost=lambda messages, next_messages: 1,
+            # prefer the replies of b, the goal is 3 replies deep
+            heuristic=lambda messages: 4 - len(messages) + sum(1 for message in messages if message.content.text.startswith('a')),
+            threshold=1,
+            max_iteration=10,
+            stats=stats,
+        )
+        self.assertEqual([message.content.text for message in path], ['start', 'b 1', 'b 2', 'b 3'])
+        goal = state_key(path[-1:])
+        self.assertEqual(cost_so_far[goal], 3)
+        self.assertEqual(reconstruct_path(came_from, goal, hash_map), path)
+        self.assertEqual(stats.expanded, 3)
+        self.assertEqual(stats.generated, 6)
+
+    async def test_returns_best_path_when_threshold_not_reached(self):
+        agents = [CountingAgent('a')]
+        path, came_from, cost_so_far, heuristic_map, hash_map = await astar_chat(
+            agents=agents,
+            messages=[text_message('start', 'user')],
+            cost=lambda messages, next_messages: 1,
+            heuristic=lambda messages: 10 - len(messages),
+            threshold=0,
+            max_iteration=2,
+        )
+        self.assertEqual(len(path), 3)
+        self.assertEqual(agents[0].calls, 2)
+
+    async def test_expansion_width(self):
+        async def search(expansion_width:int, stats:SearchStats):
+            return await astar_chat(
+                agents=[SlowAgent('a'), SlowAgent('b')],
+                messages=[text_message('start', 'user')],
+                cost=lambda messages, next_messages: 1,
+                heuristic=lambda messages: 10 - len(messages),
+                threshold=0,
+                n_replies=2,
+                max_iteration=3,
+                stats=stats,
+                expansion_width=expansion_width,
+                max_concurrency=3,
+            )
+
+        SlowAgent.max_running = 0
+        stats = SearchStats()
+        path, came_from, cost_so_far, heuristic_map, hash_map = await search(4, stats)
+        self.assertEqual(stats.iterations, 3)
+        self.assertGreater(stats.expanded, stats.iterations)
+        self.assertLessEqual(SlowAgent.max_running, 3)
+        # the same search gives the same result
+        again = await search(4, SearchStats())
+        self.assertEqual(path, again[0])
+        self.assertEqual(list(cost_so_far.keys()), list(again[2].keys()))
+
+    async def test_coroutine_heuristic_scores_children_concurrently(self):
+        running = 0
+        max_running = 0
+
+        async def heuristic(messages:List[Message]) -> float:
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return 10 - len(messages)
+
+        async def cost(messages:List[Message], next_messages:List[Message]) -> float:
+            return 1
+
+        agents = [CountingAgent(name) for name in 'abcd']
+        kwargs = dict(messages=[text_message('start', 'user')], threshold=0, max_iteration=3)
+        path = (await astar_chat(agents=agents, cost=cost, heuristic=heuristic, heuristic_concurrency=2, **kwargs))[0]
+        self.assertEqual(max_running, 2)
+        # same search as with synchronous functions
+        sync_path = (await astar_chat(
+            agents=agents, cost=lambda messages, next_messages: 1, heuristic=lambda messages: 10 - len(messages), **kwargs
+        ))[0]
+        self.assertEqual(path, sync_path)
+
+    async def test_heuristic_cache_shared_across_searches(self):
+        calls = 0
+
+        def heuristic(messages:List[Message]) -> float:
+            nonlocal calls
+            calls += 1
+            return 10 - len(messages)
+
+        cache = HeuristicCache()
+        kwargs = dict(
+            messages=[text_message('start', 'user')],
+            cost=lambda messages, next_messages: 1,
+            heuristic=heuristic,
+            threshold=0,
+            max_iteration=3,
+            heuristic_cache=cache,
+        )
+        first = await astar_chat(agents=[CountingAgent('a'), CountingAgent('b')], **kwargs)
+        first_calls = calls
+        stats = SearchStats()
+        second = await astar_chat(agents=[CountingAgent('a'), CountingAgent('b')], stats=stats, **kwargs)
+        self.assertEqual(calls, first_calls)
+        self.assertEqual(stats.heuristic_calls, 0)
+        self.assertEqual(stats.heuristic_cache_hits, first_calls)
+        self.assertEqual(first[0], second[0])
+        self.assertEqual(cache.stats()['hit_rate'], 0.5)
+
+    async def test_canonicaliser_merges_equivalent_branches(self):
+        async def search(canonicaliser:Union[Canonicaliser, None]) -> SearchStats:
+            stats = SearchStats()
+            await astar_chat(
+                agents=[ToolCallingAgent('a', '{"query": "Naples", "limit": 1}'), ToolCallingAgent('b', '{"limit":1,"query":"Naples"}')],
+                messages=[text_message('start', 'user')],
+                cost=lambda messages, next_messages: 1,
+                heuristic=lambda messages: 10 - len(messages),
+                threshold=0,
+                max_iteration=3,
+                stats=stats,
+                canonicaliser=canonicaliser,
+            )
+            return stats
+
+        plain = await search(None)
+        self.assertEqual((plain.pushed, plain.transpositions), (7, 0))
+        merged = await search(Canonicaliser())
+        # one state per expansion instead of two
+        self.assertEqual((merged.pushed, merged.duplicates, merged.transpositions), (4, 3, 3))
+
+    async def test_max_queue_size_prunes_frontier(self):
+        stats = SearchStats()
+        path, came_from, cost_so_far, heuristic_map, hash_map = await astar_chat(
+            agents=[CountingAgent(name) for name in 'abcd'],
+            messages=[text_message('start', 'user')],
+            cost=lambda messages, next_messages: 1,
+            heuristic=lambda messages: 10 - len(messages),
+            threshold=0,
+            max_iteration=3,
+            stats=stats,
+            max_queue_size=2,
+        )
+        self.assertGreater(stats.pruned, 0)
+        self.assertLessEqual(stats.pushed - stats.pruned - stats.expanded, 2)
+        # the pruned states are forgotten
+        self.assertEqual(len(cost_so_far), stats.pushed - stats.pruned)
+        self.assertEqual(set(cost_so_far), set(hash_map))
+        self.assertIn(state_key(path[-1:]), cost_so_far)
+
+
+class StreamTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_astar_chat_events(self):
+        kwargs = dict(
+            messages=[text_message('start', 'user')],
+            cost=lambda messages, next_messages: 1,
+            heuristic=lambda messages: 4 - len(messages) + sum(1 for message in messages if message.content.text.startswith('a')),
+            threshold=1,
+            max_iteration=10,
+        )
+        events = [event async for event in astar_chat_stream(agents=[CountingAgent('a'), CountingAgent('b')], **kwargs)]
+        types = [event.type for event in events]
+        self.assertEqual(types.count('node_expanded'), 3)
+        self.assertEqual(types.count('child_scored'), 6)
+        self.assertEqual(types[-2:], ['goal_reached', 'finished'])
+        self.assertEqual([message.content.text for message in events[-2].path()], ['start', 'b 1', 'b 2', 'b 3'])
+        best = [event.score for event in events if event.type == 'new_best']
+        self.assertEqual(best, sorted(best, reverse=True))
+        self.assertEqual(events[-1].result, await astar_chat(agents=[CountingAgent('a'), CountingAgent('b')], **kwargs))
+
+    async def test_astar_chat_cancel(self):
+        agents = [CountingAgent('a'), CountingAgent('b')]
+        stream = astar_chat_stream(
+            agents=agents,
+            messages=[text_message('start', 'user')],
+            cost=lambda messages, next_messages: 1,
+            heuristic=lambda messages: 10,
+            threshold=0,
+            max_iteration=10,
+        )
+        async for event in stream:
+            if event.type == 'child_scored':
+                break
+        await stream.aclose()
+        self.assertEqual(sum(agent.calls for agent in agents), 2)
+
+    async def test_group_chat_events(self):
+        events = [event async for event in group_chat_stream(
+            agents=[CountingAgent('a'), CountingAgent('b')],
+            messages=[text_message('start', 'user')],
+            heuristic=lambda messages: 0 if len(messages) >= 3 else 5,
+            threshold=1,
+            max_iteration=3,
+        )]
+        self.assertEqual([(event.type, event.agent) for event in events[:-1]], [('agent_turn', 'a'), ('agent_turn', 'b'), ('goal_reached', 'b')])
+        self.assertEqual([message.content.text for message in events[-1].result[0]], ['start', 'a 1', 'b 2'])
+
+
+class CheckpointTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'search.jsonl')
+        self.kwargs = dict(
+            cost=lambda messages, next_messages: 1,
+            heuristic=lambda messages: 10 - len(messages) + sum(1 for message in messages if message.content.text.startswith('a')),
+            threshold=0,
+            n_replies=2,
+            expansion_width=2,
+            max_queue_size=5,
+        )
+
+    async def test_resume_continues_the_search(self):
+        messages = [text_message('start', 'user')]
+        full = await astar_chat(agents=[CountingAgent('a'), CountingAgent('b')], messages=messages, max_iteration=4, **self.kwargs)
+
+        await astar_chat(
+            agents=[CountingAgent('a'), CountingAgent('b')], messages=messages, max_iteration=2,
+            checkpoint=SearchCheckpoint(self.path), **self.kwargs,
+        )
+        # a crash while writing the next iteration
+        with open(self.path, 'a') as f:
+            f.write('{"type":"node","parent":0,"mess')
+        agents = [CountingAgent('a'), CountingAgent('b')]
+        stats = SearchStats()
+        resumed = await resume_astar_chat(SearchCheckpoint(self.path), agents=agents, max_iteration=4, stats=stats, **self.kwargs)
+        self.assertEqual(resumed[0], full[0])
+        for restored, expected in zip(resumed[1:], full[1:]):
+            self.assertEqual(restored, expected)
+        self.assertEqual(stats.iterations, 4)
+        # only the last two iterations ran, each expanding two nodes with two agents and two replies
+        self.assertEqual(sum(agent.calls for agent in agents), 2 * 2 * 2 * 2)
+
+        # the resumed iterations were recorded too
+        state = SearchCheckpoint(self.path).load()
+        self.assertEqual(state.stats['iterations'], 4)
+        self.assertEqual(set(state.nodes), set(full[2]))
+
+    async def test_resume_after_goal_does_not_search(self):
+        kwargs = dict(self.kwargs, threshold=8)
+        checkpoint = SearchCheckpoint(self.path, every=10)
+        path = (await astar_chat(agents=[CountingAgent('a'), CountingAgent('b')], messages=[text_message('start', 'user')], max_iteration=5, checkpoint=checkpoint, **kwargs))[0]
+        self.assertIsNotNone(SearchCheckpoint(self.path).load().goal)
+        agents = [CountingAgent('a')]
+        self.assertEqual((await resume_astar_chat(SearchCheckpoint(self.path), agents=agents, max_iteration=5, **kwargs))[0], path)
+        self.assertEqual(agents[0].calls, 0)
+
+    async def test_reused_checkpoint_starts_fresh(self):
+        messages = [text_message('start', 'user')]
+        full = await astar_chat(agents=[CountingAgent('a'), CountingAgent('b')], messages=messages, max_iteration=4, **self.kwargs)
+
+        # a second search with the same checkpoint, and one after a load, replace the file
+        checkpoint = SearchCheckpoint(self.path)
+        for i in range(2):
+            await astar_chat(agents=[CountingAgent('a'), CountingAgent('b')], messages=messages, max_iteration=2, checkpoint=checkpoint, **self.kwargs)
+        checkpoint.load()
+        await astar_chat(agents=[CountingAgent('a'), CountingAgent('b')], messages=messages, max_iteration=2, checkpoint=checkpoint, **self.kwargs)
+        with open(self.path) as f:
+            self.assertEqual(f.read().count('"parent":null'), 1)
+
+        resumed = await resume_astar_chat(SearchCheckpoint(self.path), agents=[CountingAgent('a'), CountingAgent('b')], max_iteration=4, **self.kwargs)
+        self.assertEqual(resumed, full)
+
+    async def test_resume_without_checkpoint_fails(self):
+        with self.assertRaises(ValueError):
+            await resume_astar_chat(SearchCheckpoint(self.path), agents=[CountingAgent('a')], max_iteration=1, **self.kwargs)
+
+
+class LengthHeuristic(IncrementalHeuristic):
+    '''
+    Counts the messages of the conversation, and records the number of messages of every update
+    '''
+    def __init__(self, goal:int):
+        self.goal = goal
+        self.updates = []
+
+    def initial_state(self, messages:List[Message]) -> int:
+        return len(messages)
+
+    async def update(self, state:int, messages:List[Message]):
+        self.updates.append(len(messages))
+        state += len(messages)
+        return state, self.goal - state
+
+
+class GroupChatTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_coroutine_heuristic_terminates(self):
+        async def heuristic(messages:List[Message]) -> float:
+            return 0 if len(messages) >= 3 else 5
+
+        messages, heuristic_map = await group_chat(
+            agents=[CountingAgent('a'), CountingAgent('b')],
+            messages=[text_message('start', 'user')],
+            heuristic=heuristic,
+            threshold=1,
+            max_iteration=3,
+        )
+        self.assertEqual([message.content.text for message in messages], ['start', 'a 1', 'b 2'])
+
+    async def test_incremental_heuristic(self):
+        kwargs = dict(messages=[text_message('start', 'user')], threshold=1, max_iteration=3)
+        heuristic = LengthHeuristic(goal=5)
+        messages, heuristic_map = await group_chat(agents=[CountingAgent('a'), CountingAgent('b')], heuristic=heuristic, **kwargs)
+        self.assertEqual(len(messages), 5)
+        self.assertEqual(heuristic.updates, [1, 1, 1, 1])
+        # the same chat with a function of the whole conversation
+        expected = await group_chat(agents=[CountingAgent('a'), CountingAgent('b')], heuristic=lambda messages: 5 - len(messages), **kwargs)
+        self.assertEqual((messages, heuristic_map), expected)
+
+        # the turns scored by the cache are fed to the heuristic with the next miss
+        cache = HeuristicCache()
+        await group_chat(agents=[CountingAgent('a'), CountingAgent('b')], heuristic=LengthHeuristic(goal=5), heuristic_cache=cache, **dict(kwargs, max_iteration=1))
+        heuristic = LengthHeuristic(goal=5)
+        messages = (await group_chat(agents=[CountingAgent('a'), CountingAgent('b')], heuristic=heuristic, heuristic_cache=cache, **kwargs))[0]
+        self.assertEqual(len(messages), 5)
+        self.assertEqual(heuristic.updates, [3, 1])
+
+    def test_incremental_heuristic_is_abstract(self):
+        class MissingUpdate(IncrementalHeuristic):
+            def initial_state(self, messages):
+                return 0
+
+        with self.assertRaises(TypeError):
+            MissingUpdate()
+
+    async def test_broadcast_round_is_concurrent(self):
+        SlowAgent.max_running = 0
+        stats = GroupChatStats()
+        messages, heuristic_map = await group_chat(
+            agents=[SlowAgent('a'), SlowAgent('b'), SlowAgent('c')],
+            messages=[text_message('start', 'user')],
+            max_iteration=2,
+            mode='broadcast',
+            stats=stats,
+        )
+        # every agent of a round sees the conversation as it was at the start of the round
+        self.assertEqual([message.content.text for message in messages], ['start', 'a 1', 'b 1', 'c 1', 'a 4', 'b 4', 'c 4'])
+        self.assertEqual(SlowAgent.max_running, 3)
+        self.assertEqual(stats.calls, 6)
+        self.assertGreater(stats.latency_saved, 0)
+
+    async def test_speculative_turns(self):
+        async def chat(speculate):
+            stats = GroupChatStats()
+            messages = (await group_chat(
+                agents=[SlowAgent('a'), SlowAgent('b')],
+                messages=[text_message('start', 'user')],
+                max_iteration=2,
+                mode='speculative',
+                speculate=speculate,
+                stats=stats,
+            ))[0]
+            return [message.content.text for message in messages], stats
+
+        roundtable = ['start', 'a 1', 'b 2', 'a 3', 'b 4']
+        # SlowAgent answers with its name and the length of the conversation, a perfect prediction
+        messages, stats = await chat(lambda messages, agent: [text_message(f'{agent.name} {len(messages)}')])
+        self.assertEqual(messages, roundtable)
+        self.assertEqual((stats.speculative_hits, stats.speculative_misses, stats.extra_calls), (3, 0, 0))
+        self.assertEqual(stats.calls, 4)
+        self.assertGreater(stats.latency_saved, 0)
+
+        messages, stats = await chat(lambda messages, agent: [text_message('wrong')])
+        self.assertEqual(messages, roundtable)
+        self.assertEqual((stats.speculative_hits, stats.speculative_misses, stats.extra_calls), (0, 3, 3))
+        self.assertEqual(stats.calls, 7)
+
+        with self.assertRaises(ValueError):
+            await chat(None)
+
+
+if __name__ == '__main__':
+    unittest.main()
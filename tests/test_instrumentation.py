@@ -0,0 +1,82 @@
+import unittest
+from typing import List
+from pydantic import BaseModel
+from benchmarks.mock_server import MockOpenAIServer
+from siumai.agent import Agent
+from siumai.instrumentation import NOOP_SPAN, Instrumentation, Span, SpanAggregator, add_listener, remove_listener, span
+from siumai.schema import GenerationConfig, Message, Content
+from siumai.tool import Tool
+
+
+class Address(BaseModel):
+    address: str
+
+
+class EchoTool(Tool):
+    async def a_run(self, **kwargs) -> str:
+        return '{"response": "ok"}'
+
+
+class SpanTest(unittest.TestCase):
+
+    def test_noop_without_listeners(self):
+        instrumentation = Instrumentation()
+        self.assertIs(instrumentation.span('stage', size=1), NOOP_SPAN)
+
+    def test_nested_spans_and_errors(self):
+        instrumentation = Instrumentation()
+        spans:List[Span] = []
+        instrumentation.add_listener(spans.append)
+        with self.assertRaises(ValueError):
+            with instrumentation.span('outer'):
+                with instrumentation.span('inner', size=3) as inner:
+                    inner.set(tokens=5)
+                raise ValueError()
+        self.assertEqual([_span.name for _span in spans], ['inner', 'outer'])
+        self.assertIs(spans[0].parent, spans[1])
+        self.assertEqual(spans[0].attributes, {'size': 3, 'tokens': 5})
+        self.assertEqual(spans[1].error, 'ValueError')
+
+    def test_aggregator(self):
+        instrumentation = Instrumentation()
+        aggregator = SpanAggregator()
+        instrumentation.add_listener(aggregator)
+        for duration in range(1, 101):
+            _span = Span(instrumentation, 'stage', {'tokens': 2, 'retried': duration > 90})
+            _span.duration = duration / 1000
+            instrumentation.emit(_span)
+        stats = aggregator.stats()['stage']
+        self.assertEqual(stats['count'], 100)
+        self.assertEqual(stats['p50_ms'], 50)
+        self.assertEqual(stats['p95_ms'], 95)
+        self.assertEqual(stats['totals'], {'tokens': 200, 'retried': 10})
+        self.assertEqual(sum(stats['histogram'].values()), 100)
+        self.assertIn('stage', aggregator.report())
+
+
+class AgentInstrumentationTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_stages_of_a_turn(self):
+        aggregator = SpanAggregator()
+        add_listener(aggregator)
+        self.addCleanup(remove_listener, aggregator)
+        with MockOpenAIServer(tool_call_rate=1.0) as server:
+            agent = Agent(
+                name='test_agent',
+                generation_config=GenerationConfig(api_type='fastchat', api_key='mock', base_url=server.base_url, model='mock'),
+                tools=[EchoTool(name='geocoding', description='Geocode an address.', input_model=Address)],
+            )
+            await agent.a_generate_response([Message(role='user', content=Content(text='Where is Naples?'))])
+
+        stats = aggregator.stats()
+        self.assertEqual(stats['agent.a_generate_response']['count'], 1)
+        self.assertEqual(stats['agent.generate']['count'], 2)
+        self.assertEqual(stats['agent.tool_call']['count'], 1)
+        self.assertEqual(stats['openai.request']['count'], 2)
+        self.assertGreater(stats['openai.request']['totals']['total_tokens'], 0)
+        self.assertEqual(stats['openai.validate_function_call']['totals']['valid'], 1)
+        self.assertGreater(stats['openai.transform']['totals']['request_bytes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import json
+import unittest
+from pydantic import BaseModel
+from benchmarks.mock_server import MockOpenAIServer
+from siumai.agent import Agent
+from siumai.schema import GenerationConfig, Message, Content
+from siumai.tool import Tool
+
+
+class Address(BaseModel):
+    address: str
+
+
+class EchoTool(Tool):
+    def run(self, **kwargs) -> str:
+        return json.dumps({'response': kwargs})
+
+    async def a_run(self, **kwargs) -> str:
+        return json.dumps({'response': kwargs})
+
+
+class MockServerAgentTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.server = MockOpenAIServer(tool_call_rate=1.0)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.messages = [Message(role='user', content=Content(text='Where is Naples?'))]
+
+    def agent(self, n_candidates:int=1) -> Agent:
+        return Agent(
+            name='test_agent',
+            system_prompt='You are a helpful assistant.',
+            generation_config=GenerationConfig(
+                api_type='fastchat',
+                api_key='mock',
+                base_url=self.server.base_url,
+                model='mock',
+                n_candidates=n_candidates,
+            ),
+            tools=[EchoTool(name='geocoding', description='Geocode an address.', input_model=Address)],
+        )
+
+    def test_generate_response_runs_tool_loop(self):
+        response = self.agent().generate_response(self.messages)
+        self.assertEqual([message.role for message in response], ['assistant', 'tool', 'assistant'])
+        self.assertEqual(response[-1].content.text, self.server.text)
+        self.assertEqual(self.server.requests, 2)
+
+    async def test_a_generate_response_candidates(self):
+        self.server.tool_call_rate = 0.0
+        candidates = []
+        agent = self.agent(n_candidates=3)
+        agent.reduce_function = lambda messages: candidates.extend(messages) or messages[-1]
+        response = await agent.a_generate_response(self.messages)
+        self.assertEqual(len(candidates), 3)
+        self.assertEqual(response[-1].content.text, self.server.text)
+
+    async def test_a_stream_response(self):
+        self.server.tool_call_rate = 0.0
+        deltas = []
+        messages = []
+        async for item in self.agent().a_stream_response(self.messages):
+            if isinstance(item, str):
+                deltas.append(item)
+            else:
+                messages.append(item)
+        self.assertEqual(''.join(deltas), self.server.text)
+        self.assertEqual(messages[-1].content.text, self.server.text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,15 @@
+import asyncio
 import unittest
+from unittest.mock import patch
 import os
 from dotenv import load_dotenv
-from siumai.schema import Message, Content, GenerationConfig
-from siumai.oai_client import OAIClient
-from siumai.vertexai_client import VertexAIClient
+from openai.types.chat import ChatCompletionChunk
+from siumai.schema import Message, Content, GenerationConfig, Function, StreamRejected
+from pydantic import BaseModel
+import siumai.oai_client
+from siumai.instrumentation import Instrumentation, _current_span
+from siumai.oai_client import OAIClient, openai_request, transform_messages_openai
+from siumai.vertexai_client import VertexAIClient, prepare_messages_vertexai
 from siumai.bedrock_client import BedrockClient
 
 load_dotenv()
@@ -79,6 +85,171 @@ class AsyncOAIClientTest(unittest.IsolatedAsyncioTestCase):
         print(response.content.text)
         self.assertIsNotNone(response.content.text)
 
+class Answer(BaseModel):
+    answer: str
+
+class RequestPreparationTest(unittest.TestCase):
+    def setUp(self):
+        self.messages = [
+            Message(role='system', content=Content(text='You are a helpful assistant.')),
+            Message(role='user', content=Content(text='Tell me a joke.')),
+        ]
+        self.snapshot = [message.model_dump() for message in self.messages]
+
+    def test_openai_request_does_not_modify_messages(self):
+        messages, kw_args = openai_request(
+            self.messages,
+            GenerationConfig(api_type='openai', api_key='test'),
+            output_model=Answer,
+        )
+        self.assertEqual(len(messages), 3)
+        self.assertEqual(len(self.messages), 2)
+        self.assertEqual(kw_args['response_format'], {'type':'json_object'})
+
+    def test_vertexai_messages_do_not_modify_messages(self):
+        messages = prepare_messages_vertexai(self.messages, output_model=Answer)
+        self.assertEqual(len(messages), 1)
+        self.assertIn('You are a helpful assistant.', messages[0].content.text)
+        self.assertIn('Tell me a joke.', messages[0].content.text)
+        self.assertEqual([message.model_dump() for message in self.messages], self.snapshot)
+
+class TransformMemoTest(unittest.TestCase):
+    def test_only_new_messages_are_transformed(self):
+        messages = [Message(role='user', content=Content(text=f'message {i}')) for i in range(3)]
+        with patch.object(siumai.oai_client, 'transform_message_openai', wraps=siumai.oai_client.transform_message_openai) as transform:
+            first = transform_messages_openai(messages)
+            messages.append(Message(role='assistant', content=Content(text='reply')))
+            second = transform_messages_openai(messages)
+            self.assertEqual(transform.call_count, 4)
+            self.assertIs(first[0], second[0])
+
+    def test_reassignment_invalidates(self):
+        message = Message(role='user', content=Content(text='before'), name='user')
+        self.assertEqual(transform_messages_openai([message])[0]['content'], 'before')
+        message.content.text = 'after'
+        self.assertEqual(transform_messages_openai([message])[0]['content'], 'after')
+        message.name = 'someone'
+        self.assertEqual(transform_messages_openai([message])[0]['name'], 'someone')
+        copy = message.model_copy(update={'name':'copy'})
+        self.assertEqual(transform_messages_openai([copy])[0]['name'], 'copy')
+        self.assertEqual(transform_messages_openai([message])[0]['name'], 'someone')
+
+def chunk(delta:dict) -> ChatCompletionChunk:
+    return ChatCompletionChunk.model_validate({
+        'id': 'chunk',
+        'object': 'chat.completion.chunk',
+        'created': 0,
+        'model': 'test',
+        'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}],
+    })
+
+class FakeStream():
+    '''
+    Streams the chunks of one attempt per call, the last attempt is repeated
+    '''
+    def __init__(self, *attempts):
+        self.attempts = attempts
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.kwargs = kwargs
+        chunks = self.attempts[min(self.calls, len(self.attempts) - 1)]
+        self.calls += 1
+        async def stream():
+            for chunk in chunks:
+                yield chunk
+        return stream()
+
+class FakeAsyncClient():
+    def __init__(self, *attempts):
+        self.completions = FakeStream(*attempts)
+        self.chat = self
+
+class StreamOAIClientTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.generation_config = GenerationConfig(
+            api_type='openai',
+            api_key='test',
+            tools={
+                'test_tool':Function(
+                    name='test_tool',
+                    description='test',
+                    parameters={'type':'object', 'properties':{'query':{'type':'string'}}, 'required':['query']},
+                )
+            },
+        )
+        self.client = OAIClient(generation_config=self.generation_config)
+        self.messages = [Message(role='user', content=Content(text='Tell me a joke.'))]
+
+    async def collect(self, *attempts, output_model=None):
+        self.client.a_client = FakeAsyncClient(*attempts)
+        return [
+            item async for item in self.client.a_generate_stream(
+                messages=self.messages,
+                generation_config=self.generation_config,
+                output_model=output_model,
+            )
+        ]
+
+    async def test_stream_text(self):
+        items = await self.collect([chunk({'content':'Hello'}), chunk({'content':' world'})])
+        self.assertEqual(items[:2], ['Hello', ' world'])
+        self.assertEqual(items[-1].content.text, 'Hello world')
+        self.assertTrue(self.client.a_client.completions.kwargs['stream'])
+
+    async def test_stream_tool_calls(self):
+        items = await self.collect([
+            chunk({'tool_calls':[{'index':0, 'id':'call_0', 'type':'function', 'function':{'name':'test_tool', 'arguments':'{"que'}}]}),
+            chunk({'tool_calls':[{'index':0, 'function':{'arguments':'ry": "a"}'}}]}),
+            chunk({'tool_calls':[{'index':1, 'id':'call_1', 'type':'function', 'function':{'name':'test_tool', 'arguments':'{"query": "b"}'}}]}),
+        ])
+        self.assertEqual(len(items), 1)
+        tool_calls = items[0].content.tool_calls
+        self.assertEqual([tool_call.id for tool_call in tool_calls], ['call_0', 'call_1'])
+        self.assertEqual(tool_calls[0].function_call.arguments, '{"query": "a"}')
+
+    async def test_stream_invalid_tool_call(self):
+        items = await self.collect([
+            chunk({'tool_calls':[{'index':0, 'id':'call_0', 'type':'function', 'function':{'name':'test_tool', 'arguments':'{}'}}]}),
+        ])
+        # every attempt is rejected, the stream ends without a message
+        self.assertEqual([item.attempt for item in items], [1, 2, 3])
+        self.assertTrue(all(isinstance(item, StreamRejected) for item in items))
+        self.assertEqual(self.client.a_client.completions.calls, self.generation_config.max_retries)
+
+    async def test_stream_retries_invalid_output(self):
+        class Joke(BaseModel):
+            setup: str
+
+        items = await self.collect(
+            [chunk({'content':'not json'})],
+            [chunk({'content':'{"setup": '}), chunk({'content':'"a"}'})],
+            output_model=Joke,
+        )
+        self.assertEqual(items[0], 'not json')
+        self.assertIsInstance(items[1], StreamRejected)
+        self.assertEqual(items[2:4], ['{"setup": ', '"a"}'])
+        self.assertEqual(items[4].content.text, '{"setup": "a"}')
+        self.assertEqual(len(items), 5)
+
+    async def test_stream_span_is_not_current(self):
+        instrumentation = Instrumentation()
+        spans = []
+        instrumentation.add_listener(spans.append)
+        self.client.a_client = FakeAsyncClient([chunk({'content':'Hello'}), chunk({'content':' world'})])
+        with patch('siumai.oai_client.span', instrumentation.span):
+            stream = self.client.a_generate_stream(messages=self.messages, generation_config=self.generation_config)
+            self.assertEqual(await stream.__anext__(), 'Hello')
+            # the spans of the consumer are not children of the stream
+            with instrumentation.span('consumer') as consumer_span:
+                pass
+            self.assertIsNone(consumer_span.parent)
+            # closed from another task than the one it started in
+            await asyncio.create_task(stream.aclose())
+        self.assertIsNone(_current_span.get())
+        self.assertEqual([_span.name for _span in spans], ['openai.transform', 'consumer', 'openai.stream'])
+        self.assertEqual(spans[-1].error, 'GeneratorExit')
+
 class VertexAIClientTest(unittest.TestCase):
     def test_generate_response_with_image(self):
         pass
@@ -0,0 +1,100 @@
+import asyncio
+import time
+import unittest
+from typing import Union
+from pydantic import BaseModel
+from siumai.agent import Agent
+from siumai.optimisers import TextualGradientPromptTrainer
+from siumai.ratelimit import RateLimiter, is_rate_limit_error, retry_after
+from siumai.schema import GenerationConfig
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class RateLimiterTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_requests_per_minute(self):
+        # 1200 requests per minute, i.e. one every 50ms, without burst
+        limiter = RateLimiter(requests_per_minute=1200, burst=0.05)
+        start = time.monotonic()
+        await asyncio.gather(*[limiter.acquire() for _ in range(5)])
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    async def test_tokens_per_minute(self):
+        limiter = RateLimiter(tokens_per_minute=6000)
+        start = time.monotonic()
+        await limiter.acquire(tokens=100)
+        await limiter.acquire(tokens=10)
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    async def test_backoff_pauses_every_caller(self):
+        limiter = RateLimiter(min_backoff=0.05)
+        self.assertEqual(limiter.backoff(), 0.05)
+        self.assertEqual(limiter.backoff(), 0.1)
+        start = time.monotonic()
+        await limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        self.assertEqual(limiter.rate_limited, 2)
+
+    def test_rate_limit_errors(self):
+        self.assertTrue(is_rate_limit_error(RateLimitError()))
+        self.assertFalse(is_rate_limit_error(ValueError()))
+        throttling = Exception()
+        throttling.response = {'Error': {'Code': 'ThrottlingException'}}
+        self.assertTrue(is_rate_limit_error(throttling))
+        self.assertIsNone(retry_after(RateLimitError()))
+
+
+class Prediction(BaseModel):
+    length: int
+
+
+class ForwardPipelineTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.running = 0
+        self.max_running = 0
+        self.failures = 1
+
+        async def forward(agent:Agent, input:str) -> Union[Prediction, None]:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            try:
+                # the first call is rate limited once
+                if input == 'input 0' and self.failures > 0:
+                    self.failures -= 1
+                    raise RateLimitError()
+                await asyncio.sleep(0.01)
+                return Prediction(length=len(input))
+            finally:
+                self.running -= 1
+
+        self.trainer = TextualGradientPromptTrainer(
+            generation_config=GenerationConfig(api_type='openai', api_key='test'),
+            agent=None,
+            forward=forward,
+            loss=lambda predict, truth: 0,
+            concurrency=3,
+            rate_limiter=RateLimiter(min_backoff=0.01),
+        )
+        self.x = [f'input {i}' for i in range(12)]
+
+    async def test_retries_rate_limited_calls(self):
+        predict = await self.trainer._forward(None, self.x)
+        self.assertEqual([prediction.length for prediction in predict], [len(input) for input in self.x])
+        self.assertEqual(self.max_running, 3)
+        throughput = self.trainer.throughput()
+        self.assertEqual(throughput['forward_calls'], 12)
+        self.assertEqual(throughput['rate_limited'], 1)
+        self.assertGreater(throughput['calls_per_second'], 0)
+
+    async def test_raises_after_max_retries(self):
+        self.trainer.max_rate_limit_retries = 0
+        with self.assertRaises(RateLimitError):
+            await self.trainer._forward(None, self.x)
+
+
+if __name__ == '__main__':
+    unittest.main()
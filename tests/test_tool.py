@@ -1,6 +1,20 @@
+import asyncio
+import json
+import pickle
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
+from unittest.mock import patch, MagicMock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import os
 from dotenv import load_dotenv
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from siumai.cache import LRUCache
+from siumai.model_registry import ModelRegistry
+from siumai.sessions import SESSION_POOL, ASYNC_SESSION_POOL
 from siumai.tool import Tool
 from pydantic import BaseModel, Field
 
@@ -114,5 +128,182 @@ class AsyncToolTest(unittest.IsolatedAsyncioTestCase):
     async def test_async_tool_call_with_error_handler(self):
         pass
 
+class Address(BaseModel):
+    address: str
+
+def tool_response(text:str) -> MagicMock:
+    response = MagicMock()
+    response.status_code = 200
+    response.json.return_value = {'status':200, 'response':text}
+    return response
+
+class ToolCacheTest(unittest.TestCase):
+
+    def test_explicit_cache(self):
+        tool = Tool(id='xentropy--geocoding', input_model=Address, cache=LRUCache(max_size=8))
+        with patch.object(SESSION_POOL, 'post', return_value=tool_response('{"lat": 0}')) as post:
+            first = tool.run(address='Porto di Napoli')
+            second = tool.run(address='Porto di Napoli')
+            tool.run(address='Gare Port La Goulette')
+        self.assertEqual(first, second)
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(tool.cache.hits, 1)
+
+    def test_cacheable_metadata(self):
+        tool = Tool(id='xentropy--geodesic', input_model=Address, cacheable=True)
+        with patch.object(SESSION_POOL, 'post', return_value=tool_response('{"km": 1}')) as post:
+            tool.run(address='a')
+            tool.run(address='a')
+        self.assertEqual(post.call_count, 1)
+
+    def test_not_cached_by_default(self):
+        tool = Tool(id='xentropy--geocoding', input_model=Address)
+        with patch.object(SESSION_POOL, 'post', return_value=tool_response('{"lat": 0}')) as post:
+            tool.run(address='a')
+            tool.run(address='a')
+        self.assertEqual(post.call_count, 2)
+
+INPUT_MODEL_SOURCE = '''from pydantic import BaseModel
+
+class Coordinate(BaseModel):
+    latitude: float
+    longitude: float
+
+class InputModel(BaseModel):
+    coordinate_0: Coordinate
+    coordinate_1: Coordinate
+'''
+
+class ModelRegistryTest(unittest.TestCase):
+
+    def test_compiled_once_per_source(self):
+        registry = ModelRegistry()
+        first = registry.load(INPUT_MODEL_SOURCE, 'InputModel')
+        second = registry.load(INPUT_MODEL_SOURCE, 'InputModel')
+        self.assertIs(first, second)
+        self.assertEqual(registry.compiled, 1)
+        model = first.model_validate({'coordinate_0':{'latitude':0, 'longitude':0}, 'coordinate_1':{'latitude':1, 'longitude':1}})
+        self.assertEqual(pickle.loads(pickle.dumps(model)), model)
+
+    def test_disk_cache(self):
+        with tempfile.TemporaryDirectory() as path:
+            ModelRegistry(path=path).load(INPUT_MODEL_SOURCE, 'InputModel')
+            registry = ModelRegistry(path=path)
+            registry.load(INPUT_MODEL_SOURCE, 'InputModel')
+            self.assertEqual(registry.compiled, 0)
+
+    def test_unpickle_in_another_process(self):
+        with tempfile.TemporaryDirectory() as path:
+            model = ModelRegistry(path=path).load(INPUT_MODEL_SOURCE, 'InputModel').model_validate(
+                {'coordinate_0':{'latitude':0, 'longitude':0}, 'coordinate_1':{'latitude':1, 'longitude':2}}
+            )
+            # a fresh interpreter finds the module of the model in the on-disk cache
+            result = subprocess.run(
+                [sys.executable, '-c', 'import pickle, sys; print(pickle.loads(sys.stdin.buffer.read()).coordinate_1.longitude)'],
+                input=pickle.dumps(model),
+                capture_output=True,
+                env=dict(os.environ, SIUMAI_MODEL_CACHE=path),
+            )
+            self.assertEqual(result.stdout.decode().strip(), '2.0', result.stderr.decode())
+
+    def test_tool_load(self):
+        response = MagicMock()
+        response.status_code = 200
+        response.json.return_value = {
+            'id': 'xentropy--geodesic',
+            'name': 'xentropy--geodesic',
+            'input_model': INPUT_MODEL_SOURCE,
+            'input_json_schema': json.dumps({'type':'object'}),
+        }
+        with patch.object(SESSION_POOL, 'get', return_value=response):
+            tool = Tool.load('xentropy--geodesic', api_key='test')
+            again = Tool.load('xentropy--geodesic', api_key='test')
+        self.assertTrue(issubclass(tool.input_model, BaseModel))
+        self.assertIs(tool.input_model, again.input_model)
+        self.assertEqual(tool.input_json_schema, {'type':'object'})
+
+class ToolSessionTest(unittest.TestCase):
+    def setUp(self):
+        peers = self.peers = []
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def do_POST(self):
+                peers.append(self.client_address)
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                payload = json.dumps({'status':200, 'response':body['address']}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            def log_message(self, *args):
+                pass
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        SESSION_POOL.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused(self):
+        tool = Tool(api_key='test', id='test--tool', input_model=Address)
+        tool.url = f'http://127.0.0.1:{self.server.server_port}'
+        for i in range(4):
+            self.assertEqual(tool.run(address=f'{i}'), f'{i}')
+        self.assertEqual(len(set(self.peers)), 1)
+
+    def test_configure_rejects_unknown_settings(self):
+        with self.assertRaises(ValueError):
+            SESSION_POOL.configure(pool_size=4)
+
+class AsyncToolSessionTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.peers = []
+        async def handler(request:web.Request) -> web.Response:
+            self.peers.append(request.transport.get_extra_info('peername'))
+            body = await request.json()
+            return web.json_response({'status':200, 'response':body['address']})
+        app = web.Application()
+        app.router.add_post('/tools/{id}', handler)
+        self.server = TestServer(app)
+        await self.server.start_server()
+
+    async def asyncTearDown(self):
+        await ASYNC_SESSION_POOL.close()
+        await self.server.close()
+
+    async def test_connections_are_reused(self):
+        tools = [Tool(api_key='test', id=f'test--tool-{i}', input_model=Address) for i in range(2)]
+        for tool in tools:
+            tool.url = str(self.server.make_url('')).rstrip('/')
+        for i in range(4):
+            self.assertEqual(await tools[i % 2].a_run(address=f'{i}'), f'{i}')
+        # a single keep-alive connection served every call of both tools
+        self.assertEqual(len(set(self.peers)), 1)
+        self.assertIs(await ASYNC_SESSION_POOL.get(), await ASYNC_SESSION_POOL.get())
+
+    async def test_async_with_closes_the_session(self):
+        async with ASYNC_SESSION_POOL:
+            session = await ASYNC_SESSION_POOL.get()
+        self.assertTrue(session.closed)
+
+class AsyncSessionPoolShutdownTest(unittest.TestCase):
+    def tearDown(self):
+        ASYNC_SESSION_POOL.close_all()
+
+    def test_sessions_close_with_their_loop(self):
+        sessions = [asyncio.run(ASYNC_SESSION_POOL.get()) for i in range(2)]
+        self.assertTrue(all(session.closed for session in sessions))
+
+    def test_sessions_of_closed_loops_are_swept(self):
+        # a loop closed without shutting down its async generators
+        loop = asyncio.new_event_loop()
+        session = loop.run_until_complete(ASYNC_SESSION_POOL.get())
+        loop.close()
+        self.assertFalse(session.closed)
+        asyncio.run(ASYNC_SESSION_POOL.get())
+        self.assertTrue(session.closed)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file